@@ -0,0 +1,86 @@
+"""
+Throughput of the CPU-bound part of handling one update (decode the webhook body, validate the
+weatherapi payload, format the reply) with 1 and N worker processes.
+
+Usage:
+    python -m benchmarks.bench_workers --workers 4 --seconds 5
+"""
+import argparse
+import json
+import time
+from multiprocessing import Pool
+
+from helpers.helpers import wind
+from helpers.model_message import decode_update
+from helpers.models_weather import WeatherData
+
+UPDATE = json.dumps({
+    "update_id": 1,
+    "message": {
+        "message_id": 2,
+        "from": {"id": 3, "is_bot": False, "first_name": "Bench", "username": "bench", "language_code": "en"},
+        "chat": {"id": 3, "type": "private"},
+        "date": 1700000000,
+        "text": "/current_weather",
+    },
+}).encode()
+
+CONDITION = {"text": "Partly cloudy", "icon": "//cdn.weatherapi.com/116.png", "code": 1003}
+DAY = {
+    "maxtemp_c": 5.1, "maxtemp_f": 41.2, "mintemp_c": -1.3, "mintemp_f": 29.7, "avgtemp_c": 2.0, "avgtemp_f": 35.6,
+    "maxwind_mph": 9.4, "maxwind_kph": 15.1, "totalprecip_mm": 0.2, "totalprecip_in": 0.01, "totalsnow_cm": 0.0,
+    "avgvis_km": 9.8, "avgvis_miles": 6.0, "avghumidity": 81, "daily_will_it_rain": 0, "daily_chance_of_rain": 12,
+    "daily_will_it_snow": 0, "daily_chance_of_snow": 3, "condition": CONDITION, "uv": 1.0,
+}
+ASTRO = {"sunrise": "07:20 AM", "sunset": "03:50 PM", "moonrise": "05:11 AM", "moonset": "02:40 PM",
+         "moon_phase": "Waning Crescent", "moon_illumination": 5, "is_moon_up": 0, "is_sun_up": 0}
+WEATHER = json.dumps({
+    "location": {"name": "Kazan", "region": "Tatarstan", "country": "Russia", "lat": 55.75, "lon": 49.13,
+                 "tz_id": "Europe/Moscow", "localtime_epoch": 1700000000, "localtime": "2023-11-14 22:13"},
+    "current": {"last_updated_epoch": 1700000000, "last_updated": "2023-11-14 22:00", "temp_c": 1.0, "temp_f": 33.8,
+                "is_day": 0, "condition": CONDITION, "wind_mph": 6.9, "wind_kph": 11.2, "wind_degree": 200,
+                "wind_dir": "SSW", "pressure_mb": 1012.0, "pressure_in": 29.88, "precip_mm": 0.0, "precip_in": 0.0,
+                "humidity": 87, "cloud": 75, "feelslike_c": -2.9, "feelslike_f": 26.8, "vis_km": 10.0,
+                "vis_miles": 6.0, "uv": 1.0, "gust_mph": 12.1, "gust_kph": 19.5},
+    "forecast": {"forecastday": [{"date": f"2023-11-{14 + i}", "date_epoch": 1699920000 + i * 86400, "day": DAY,
+                                  "astro": ASTRO} for i in range(10)]},
+}).encode()
+
+
+def handle_once() -> str:
+    message = decode_update(UPDATE).message
+    weather_data = WeatherData.model_validate_json(WEATHER)
+    forecast = weather_data.forecast.forecastday[0].day
+    return (
+        f"{message.chat.id} {weather_data.location.name} ({weather_data.location.region})\n"
+        f"Temperature: {weather_data.current.temp_c}°C (feels like {weather_data.current.feelslike_c}°C)\n"
+        f"Maximum temperature: {forecast.maxtemp_c}°C\n"
+        f"{wind(weather_data.current.wind_dir, weather_data.current.wind_kph, forecast.maxwind_kph)}\n"
+        f"{forecast.condition.text}"
+    )
+
+
+def run_for(seconds: float) -> int:
+    done = 0
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        handle_once()
+        done += 1
+    return done
+
+
+def bench(workers: int, seconds: float) -> float:
+    with Pool(workers) as pool:
+        total = sum(pool.map(run_for, [seconds] * workers))
+    return total / seconds
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--seconds", type=float, default=5.0)
+    args = parser.parse_args()
+    single = bench(1, args.seconds)
+    multi = bench(args.workers, args.seconds)
+    print(f"1 worker: {single:.0f} updates/s")
+    print(f"{args.workers} workers: {multi:.0f} updates/s ({multi / single:.2f}x)")
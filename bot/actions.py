@@ -1,12 +1,22 @@
+from bot.keyboards import (MAX_FORECAST_DAYS, HOURLY_WINDOWS, date_picker, days_picker, hourly_picker,
+                           favorite_fits, favorites_editor)
+from bot.charts import ChartCache, ChartSeries, forecast_series, history_series
+from bot.render import (language_of, current_weather_text, forecast_day_text, forecast_days_texts, history_day_text,
+                        chart_caption, hourly_text)
 from config.config import Settings
-from helpers.helpers import wind, get_response, calculate_avg_temp_7days, calculate_avg_temp_3days
+from helpers.helpers import utc_offset_minutes, to_due_minute, grid_cell
+from helpers.weather_api import (fetch_forecast, fetch_forecasts, fetch_history, calculate_avg_temp_7days,
+                                 calculate_avg_temp_3days, statistics_cache_only)
 from helpers.model_message import Message
+from helpers.location_index import LocationIndex
 from helpers.models_weather import *
 from pydantic import ValidationError
+import time
 from datetime import datetime, date, timedelta
-from postgres.database_adapters import sql_update_user_state_bd
+from typing import Any, Dict, List, Optional, Tuple
+from postgres.database_adapters import (sql_update_user_state_bd, upsert_subscription, delete_subscription,
+                                        add_favorite, remove_favorite)
 import logging
-import traceback
 from prometheus.couters import count_user_errors, instance_id, count_instance_errors, validation_error
 from postgres.decorators import log_database_query
 from telebot.async_telebot import AsyncTeleBot
@@ -36,13 +46,18 @@ async def start_message(message: Message, bot: AsyncTeleBot) -> None:
             f'/current_weather - current weather\n'
             f'/weather_forecast - weather forecast for a specific date\n'
             f'/forecast_for_several_days - weather forecast for several days (from 2 to 10)\n'
+            f'/hourly - hourly forecast for the next 24 or 48 hours\n'
+            f'/add_favorite - add the current city to your favorites\n'
+            f'/my_cities - current weather in all your favorite cities\n'
             f'/weather_statistics - weather statistics for the last 7 days\n'
             f'/prediction - prediction of the average temperature for 3 days\n'
+            f'/subscribe - daily forecast at a time of your choice\n'
+            f'/unsubscribe - stop the daily forecast\n'
             f'or simply press the menu to display all commands \n')
         await bot.send_message(message.chat.id, msg)
     except Exception as e:
         log.error("An error occurred: %s", str(e))
-        log.debug(traceback.format_exc())
+        log.debug("Exception traceback", exc_info=True)
         count_instance_errors.labels(instance=instance_id).inc()
         await bot.send_message(message.chat.id, 'An error occurred. Please try again later.')
 
@@ -57,13 +72,13 @@ async def change_city(pool: Pool, message: Message, bot: AsyncTeleBot) -> None:
         bot: The asynchronous Telegram bot instance.
     """
     try:
-        log.debug("User {message.chat.id} wants to change city")
+        log.debug("User %s wants to change city", message.chat.id)
         await bot.send_message(message.chat.id, 'Please enter the new city')
         await sql_update_user_state_bd(bot, pool, message, "city")
-        log.debug(f" User {message.chat.id} waiting_value: city")
+        log.debug(" User %s waiting_value: city", message.chat.id)
     except Exception as e:
         log.error("An error occurred: %s", str(e))
-        log.debug(traceback.format_exc())
+        log.debug("Exception traceback", exc_info=True)
         count_instance_errors.labels(instance=instance_id).inc()
         await bot.send_message(message.chat.id, 'An error occurred. Please try again later.')
 
@@ -72,6 +87,8 @@ async def change_city(pool: Pool, message: Message, bot: AsyncTeleBot) -> None:
 async def add_city(pool: Pool, message: Message, bot: AsyncTeleBot, config: Settings) -> None:
     """
     Add a new city to the user's preferences based on the message received.
+    The typed name is resolved through the location index, and the canonical id is stored,
+    so different spellings of one city share a single cache entry.
 
     Parameters:
     - pool: Database connection pool
@@ -84,15 +101,48 @@ async def add_city(pool: Pool, message: Message, bot: AsyncTeleBot, config: Sett
     """
     try:
         log.debug("verify city")
-        url = f'http://api.weatherapi.com/v1/forecast.json?key={config.API_KEY}&q={message.text}'
-        responses = await get_response(message, url, bot)
-        if responses:
-            await sql_update_user_state_bd(bot, pool, message, "city", message.text)
-            log.debug(f"User {message.chat.id} added new city: {message.text}")
-            await bot.send_message(message.chat.id, 'City added successfully. Select the next command.')
+        resolution = await LocationIndex.resolve(pool, bot, config, message.text)
+        location = resolution.location
+        if location:
+            await sql_update_user_state_bd(bot, pool, message, "city", location.query)
+            log.debug("User %s added new city: %s (%s)", message.chat.id, location.query, message.text)
+            await bot.send_message(message.chat.id,
+                                   f'City {location.title} added successfully. Select the next command.')
+        elif resolution.not_found:
+            count_user_errors.labels(instance=instance_id).inc()
+            suggestions = LocationIndex.suggest(message.text)
+            msg = 'City not found, please check the city name.'
+            if suggestions:
+                msg += '\nDid you mean:\n' + '\n'.join(suggestions)
+            await bot.send_message(message.chat.id, msg)
+        else:
+            await bot.send_message(message.chat.id, 'Could not check the city. Please try again later.')
+    except Exception as e:
+        log.error("An error occurred: %s", str(e))
+        log.debug("Exception traceback", exc_info=True)
+        count_instance_errors.labels(instance=instance_id).inc()
+        await bot.send_message(message.chat.id, 'An error occurred. Please try again later.')
+
+
+@log_database_query
+async def set_location(pool: Pool, message: Message, bot: AsyncTeleBot, config: Settings) -> None:
+    """
+    Uses a shared GPS position as the user's city.
+
+    The position is quantized to a LOCATION_GRID_DEG cell and the cell center is stored in user_state.city,
+    so later commands query weatherapi by coordinates without geocoding and nearby users share cached data.
+    """
+    try:
+        cell = grid_cell(message.location.latitude, message.location.longitude, config.LOCATION_GRID_DEG)
+        await sql_update_user_state_bd(bot, pool, message, "city", cell)
+        log.debug("User %s shared location, cell %s", message.chat.id, cell)
+        # Warms the cache for the cell; the reply names the place when weatherapi answers
+        data = await fetch_forecast(message, bot, config, cell)
+        place = f" ({data['location']['name']})" if data else ""
+        await bot.send_message(message.chat.id, f'Location{place} saved. Select the next command.')
     except Exception as e:
         log.error("An error occurred: %s", str(e))
-        log.debug(f"Exception traceback: \n {traceback.format_exc()}")
+        log.debug("Exception traceback", exc_info=True)
         count_instance_errors.labels(instance=instance_id).inc()
         await bot.send_message(message.chat.id, 'An error occurred. Please try again later.')
 
@@ -106,15 +156,20 @@ async def help_message(message: Message, bot: AsyncTeleBot) -> None:
             ('current_weather', 'current weather'),
             ('weather_forecast', 'weather forecast for a specific date'),
             ('forecast_for_several_days', 'weather forecast for multiple days'),
+            ('hourly', 'hourly forecast for the next 24 or 48 hours'),
+            ('add_favorite', 'add the current city to your favorites'),
+            ('my_cities', 'current weather in all your favorite cities'),
             ('weather_statistic', 'weather statistics for the last 7 days'),
-            ('prediction', 'prediction for 3 days')
+            ('prediction', 'prediction for 3 days'),
+            ('subscribe', 'daily forecast at a time of your choice'),
+            ('unsubscribe', 'stop the daily forecast')
         )
         full_msg = '\n'.join([f'/{command} - {description}' for command, description in help_messages])
 
         await bot.send_message(message.chat.id, full_msg)
     except Exception as e:
         log.error("An error occurred: %s", str(e))
-        log.debug(f"Exception traceback: \n {traceback.format_exc()}")
+        log.debug("Exception traceback", exc_info=True)
         count_instance_errors.labels(instance=instance_id).inc()
         await bot.send_message(message.chat.id, 'An error occurred. Please try again later.')
 
@@ -132,216 +187,194 @@ async def weather(message: Message, bot: AsyncTeleBot, config: Settings, status_
     """
     try:
 
-        log.info(f"User requested current weather for': {status_user['city']}")
-        url_current = f'http://api.weatherapi.com/v1/forecast.json?key={config.API_KEY}&q={status_user["city"]}'
-        data = await get_response(message, url_current, bot)
-        weather_data = WeatherData.model_validate(data)
-        forecast = weather_data.forecast.forecastday[0].day
-
-        city_name = weather_data.location.name
-        region = weather_data.location.region
-        local_time = weather_data.location.localtime
-        temperature = weather_data.current.temp_c
-        feels_like = weather_data.current.feelslike_c
-        max_temp = forecast.maxtemp_c
-        min_temp = forecast.mintemp_c
-        wind_info = wind(weather_data.current.wind_dir, weather_data.current.wind_kph,
-                         weather_data.forecast.forecastday[0].day.maxwind_kph)
-        humidity = weather_data.current.humidity
-        precipitation = forecast.daily_chance_of_rain if weather_data.current.temp_c > 0 else forecast.daily_chance_of_snow
-        condition = forecast.condition.text
-
-        current_msg = (
-            f"{city_name} ({region}): {local_time}\n"
-            f"Temperature: {temperature}°C (feels like {feels_like}°C)\n"
-            f"Maximum temperature: {max_temp}°C\n"
-            f"Minimum temperature: {min_temp}°C\n"
-            f"{wind_info}\n"
-            f"Humidity: {humidity}% \n"
-            f"Precipitation: {precipitation}%\n"
-            f"{condition}"
-        )
+        log.info("User requested current weather for': %s", status_user['city'])
+        data = await fetch_forecast(message, bot, config, status_user["city"])
+        current_msg = current_weather_text(status_user["city"], language_of(message.from_user), data)
 
         await bot.send_message(message.chat.id, current_msg)
         return log.info("current_weather: Success")
     except Exception as e:
         log.error("An error occurred: %s", str(e))
-        log.debug(f"Exception traceback: \n {traceback.format_exc()}")
+        log.debug("Exception traceback", exc_info=True)
         count_instance_errors.labels(instance=instance_id).inc()
         await bot.send_message(message.chat.id, f"Error")
     except ValidationError as e:
-        log.error(f"Data validation error {e}")
+        log.error("Data validation error %s", e)
         validation_error.labels(instance=instance_id).inc(0)
         await bot.send_message(message.chat.id, 'An error occurred. Please try again later.')
 
 
-async def weather_forecast(pool: Pool, message: Message, bot: AsyncTeleBot) -> None:
+async def weather_forecast(message: Message, bot: AsyncTeleBot) -> None:
     """
-    This function sends a message to the user prompting to input a date range,
-    updates the database with the date difference, and logs the activity.
+    This function sends the user a date picker for the next days; the pressed button is answered by
+    `forecast_for_date` without any conversation state stored in the database.
     """
     try:
-        today_date = date.today()
-        max_date = today_date + timedelta(days=10)
-        await bot.send_message(message.chat.id,
-                               f'Input the date from {today_date} до {max_date}:')
-        await sql_update_user_state_bd(bot, pool, message, "date_difference", "waiting_value")
-
-        log.info(f" User {message.chat.id} waiting_value: date_difference")
+        await bot.send_message(message.chat.id, 'Choose the date:', reply_markup=date_picker(date.today()))
+        log.info(" User %s date picker sent", message.chat.id)
     except Exception as e:
         log.error("An error occurred: %s", str(e))
-        log.debug(f"Exception traceback: \n {traceback.format_exc()}")
+        log.debug("Exception traceback", exc_info=True)
         count_instance_errors.labels(instance=instance_id).inc()
         await bot.send_message(message.chat.id, 'An error occurred. Please try again later.')
         return
 
 
-async def add_day(pool: Pool, message: Message, bot: AsyncTeleBot, config: Settings, status_user: dict) -> None:
+async def add_day(message: Message, bot: AsyncTeleBot, config: Settings, status_user: dict) -> None:
     """
-    Add a day to the date entered by the user and get the weather forecast for that day if it's within 10 days from today.
+    Parse a date typed by the user and get the weather forecast for it.
+    Only reached by conversations started with the text prompt used before the date picker.
     """
     try:
-        today_date = date.today()
         input_date = datetime.strptime(message.text, "%Y-%m-%d").date()
-        if (input_date - today_date).days <= 10:
-            date_difference = (input_date - today_date).days + 2
-            await get_weather_forecast(pool, date_difference, message, bot, config, status_user)
-        else:
-            max_date = today_date + timedelta(days=10)
-            await bot.send_message(message.chat.id, f'The entered date must be no later than {max_date}.')
-            count_user_errors.labels(instance=instance_id).inc()
-            log.debug("add_day: The entered date must be no later than {max_date}.")
     except ValueError:
         await bot.send_message(message.chat.id, "Date must be in the format YYYY-MM-DD.")
         count_user_errors.labels(instance=instance_id).inc()
         log.error("add_day: Does not match the format YYYY-MM-DD.")
+        return
+    await forecast_for_date(input_date, message, bot, config, status_user)
+
+
+async def forecast_for_date(input_date: date, message: Message, bot: AsyncTeleBot, config: Settings,
+                            status_user: dict) -> None:
+    """
+    Get the weather forecast for a date if it's within 10 days from today.
+    """
+    try:
+        today_date = date.today()
+        if 0 <= (input_date - today_date).days <= MAX_FORECAST_DAYS:
+            date_difference = (input_date - today_date).days + 2
+            await get_weather_forecast(date_difference, message, bot, config, status_user)
+        else:
+            max_date = today_date + timedelta(days=MAX_FORECAST_DAYS)
+            await bot.send_message(message.chat.id, f'The date must be from {today_date} to {max_date}.')
+            count_user_errors.labels(instance=instance_id).inc()
+            log.debug("forecast_for_date: The date must be from %s to %s.", today_date, max_date)
     except Exception as e:
         count_instance_errors.labels(instance=instance_id).inc()
         log.error("An error occurred: %s", str(e))
-        log.debug(f"Exception traceback: \n {traceback.format_exc()}")
-        log.debug(f"User input (weather_forecast): {message.text}")
+        log.debug("Exception traceback", exc_info=True)
+        log.debug("User input (weather_forecast): %s", input_date)
 
 
-async def get_weather_forecast(pool: Pool, date_difference: int, message: Message, bot: AsyncTeleBot, config: Settings,
+async def get_weather_forecast(date_difference: int, message: Message, bot: AsyncTeleBot, config: Settings,
                                status_user: dict) -> None:
     """
     Retrieves weather forecast based on the date difference for the user's city.
     """
     try:
-        log.info(
-            f"User requested weather forecast {date_difference} days")
-        url_forecast = (f'http://api.weatherapi.com/v1/forecast.json?key={config.API_KEY}&'
-                        f'q={status_user["city"]}&days={date_difference}&aqi=no&alerts=no')
-        data = await get_response(message, url_forecast, bot)
-        weather_data = WeatherData.model_validate(data)
+        log.info("User requested weather forecast %s days", date_difference)
+        data = await fetch_forecast(message, bot, config, status_user["city"], days=date_difference)
         correction_num = int(date_difference) - 2
-
-        forecast_day = weather_data.forecast.forecastday[correction_num]
-        max_temp = forecast_day.day.maxtemp_c
-        min_temp = forecast_day.day.mintemp_c
-        wind_speed = round(forecast_day.day.maxwind_kph / 3.6)
-        precipitation = forecast_day.day.daily_chance_of_rain if weather_data.current.temp_c > 0 else \
-            weather_data.forecast.forecastday[1].day.daily_chance_of_snow
-        condition = forecast_day.day.condition.text
-
-        forecast_msg = (
-            f"{weather_data.location.name} ({weather_data.location.region}):{forecast_day.date}\n"
-            f"Maximum temperature: {max_temp}°C\n"
-            f"Minimum temperature: {min_temp}°C\n"
-            f"Wind up to {wind_speed} m/s\n"
-            f"Precipitation: {precipitation}%\n"
-            f"{condition}")
+        forecast_msg = forecast_day_text(status_user["city"], language_of(message.from_user), data, correction_num)
 
         await bot.send_message(message.chat.id, forecast_msg)
-        await sql_update_user_state_bd(bot, pool, message, "date_difference", "None")
-        log.info(f"weather_forecast: Success")
+        log.info("weather_forecast: Success")
     except Exception as e:
         log.error("An error occurred: %s", str(e))
-        log.debug(f"Exception traceback: \n {traceback.format_exc()}")
+        log.debug("Exception traceback", exc_info=True)
         count_instance_errors.labels(instance=instance_id).inc()
         await bot.send_message(message.chat.id, f"Error")
     except ValidationError as e:
         validation_error.labels(instance=instance_id).inc(0)
-        log.error(f"weather_forecast: Validation error {e}")
-        log.debug(f"Exception traceback: \n {traceback.format_exc()}")
+        log.error("weather_forecast: Validation error %s", e)
+        log.debug("Exception traceback", exc_info=True)
         await bot.send_message(message.chat.id, f"Error data validation, please try again later.")
 
 
-async def forecast_for_several_days(pool: Pool, message: Message, bot: AsyncTeleBot) -> None:
+async def forecast_for_several_days(message: Message, bot: AsyncTeleBot) -> None:
+    """
+    A function to send the user a picker for the number of days; the pressed button is answered by
+    `forecast_several` without any conversation state stored in the database.
     """
-            A function to send a weather forecast message for several days and update user state with the number of days.
-            """
     try:
         await bot.send_message(message.chat.id,
                                f'In this section, you can get the weather forecast for several days.\n'
-                               f'Enter the number of days (from 1 to 10):')
-        await sql_update_user_state_bd(bot, pool, message, "qty_days")
+                               f'Choose the number of days:', reply_markup=days_picker())
     except Exception as e:
         log.debug("An error occurred: %s", str(e))
-        log.debug(f"Exception traceback: \n {traceback.format_exc()}")
+        log.debug("Exception traceback", exc_info=True)
         await bot.send_message(message.chat.id, 'An error occurred. Please try again later.')
         count_instance_errors.labels(instance=instance_id).inc()
 
 
 async def get_forecast_several(message: Message, bot: AsyncTeleBot, config: Settings, status_user: dict) -> None:
     """
-    A function to get the weather forecast for several days based on user input.
+    A function to get the weather forecast for several days based on a number typed by the user.
+    Only reached by conversations started with the text prompt used before the days picker.
     """
     try:
         qty_days = int(message.text)
-        if 1 <= qty_days <= 10:
-            qty_days += 1
-        else:
-            await bot.send_message(message.chat.id, 'Number of days must be from 1 to 10')
-            count_user_errors.labels(instance=instance_id).inc()
-            return
     except ValueError:
         await bot.send_message(message.chat.id, f'Invalid input format please try again. {message.text}')
         count_user_errors.labels(instance=instance_id).inc()
-        log.error("forecast_for_several_days: Invalid input format" + message.text)
+        log.error("forecast_for_several_days: Invalid input format %s", message.text)
         return
-    except Exception as e:
-        log.error("An error occurred: %s", str(e))
-        log.debug(f"Exception traceback: \n {traceback.format_exc()}")
-        count_instance_errors.labels(instance=instance_id).inc()
+    await forecast_several(qty_days, message, bot, config, status_user)
+
+
+async def forecast_several(qty_days: int, message: Message, bot: AsyncTeleBot, config: Settings,
+                           status_user: dict) -> None:
+    """
+    A function to get the weather forecast for 1 to 10 days after today, as one chart with a short summary
+    when CHARTS_ENABLED, otherwise as a message per day.
+    """
+    if not 1 <= qty_days <= MAX_FORECAST_DAYS:
+        await bot.send_message(message.chat.id, 'Number of days must be from 1 to 10')
+        count_user_errors.labels(instance=instance_id).inc()
         return
+    qty_days += 1
 
-    url_forecast_several = (f'http://api.weatherapi.com/v1/forecast.json?key={config.API_KEY}&'
-                            f'q={status_user["city"]}&days={qty_days}&aqi=no&alerts=no')
     try:
-        data = await get_response(message, url_forecast_several, bot)
-        weather_data = WeatherData.model_validate(data)
-        for day_num in range(1, len(weather_data.forecast.forecastday)):
-            forecast = weather_data.forecast.forecastday[day_num]
-            date = forecast.date
-            max_temp = forecast.day.maxtemp_c
-            min_temp = forecast.day.mintemp_c
-            wind_speed = round(forecast.day.maxwind_kph / 3.6)
-            humidity = forecast.day.avghumidity
-            precipitation_probability = forecast.day.daily_chance_of_rain if forecast.day.avgtemp_c > 0 else forecast.day.daily_chance_of_snow
-            precipitation_text = forecast.day.condition.text
-
-            msg = (f"{weather_data.location.name} ({weather_data.location.region}):{date}\n"
-                   f"Maximum temperature: {max_temp}°C\n"
-                   f"Minimum temperature: {min_temp}°C\n"
-                   f"Wind up to {wind_speed} m/s\n"
-                   f"Humidity: {humidity}% \n"
-                   f"Precipitation probability: {precipitation_probability}%\n"
-                   f"{precipitation_text}")
+        language = language_of(message.from_user)
+        if config.CHARTS_ENABLED:
+            async def load() -> Optional[ChartSeries]:
+                data = await fetch_forecast(message, bot, config, status_user["city"], days=qty_days)
+                return forecast_series(data) if data else None
+
+            await ChartCache.send(bot, message.chat.id, status_user["city"], f"forecast:{qty_days}", date.today(),
+                                  load, lambda series: chart_caption(series, language, "forecast"))
+            return log.info("several forecast chart : Success")
+        data = await fetch_forecast(message, bot, config, status_user["city"], days=qty_days)
+        for msg in forecast_days_texts(status_user["city"], language, data, qty_days):
             await bot.send_message(message.chat.id, msg)
-        log.info(f"several forecast : Success")
+        log.info("several forecast : Success")
     except Exception as e:
         log.error("An error occurred: %s", str(e))
-        log.debug(f"Exception traceback: \n {traceback.format_exc()}")
+        log.debug("Exception traceback", exc_info=True)
         count_instance_errors.labels(instance=instance_id).inc()
         await bot.send_message(message.chat.id, f"Error requesting data. Please try again later.")
     except ValidationError as e:
         validation_error.labels(instance=instance_id).inc(0)
-        log.error(f"forecast_for_several_days: Validation error {e}")
-        log.debug(f"Exception traceback: \n {traceback.format_exc()}")
+        log.error("forecast_for_several_days: Validation error %s", e)
+        log.debug("Exception traceback", exc_info=True)
         await bot.send_message(message.chat.id, f"Error data validation, please try again later.")
 
 
+async def hourly(message: Message, bot: AsyncTeleBot, config: Settings, status_user: dict, hours: int = 24) -> None:
+    """
+    The forecast for the next 24 or 48 hours, hour by hour, with buttons to switch between the two.
+    Three forecast days cover 48 hours from any time of day; the payload is shared with /prediction.
+    """
+    if hours not in HOURLY_WINDOWS:
+        count_user_errors.labels(instance=instance_id).inc()
+        log.error("hourly: Invalid number of hours %s", hours)
+        return
+    try:
+        log.info("User requested hourly forecast %s h: %s", hours, status_user['city'])
+        data = await fetch_forecast(message, bot, config, status_user["city"], days=3)
+        if data is None:
+            return
+        msg = hourly_text(status_user["city"], language_of(message.from_user), data, int(time.time()), hours)
+        await bot.send_message(message.chat.id, msg, reply_markup=hourly_picker())
+        log.info("hourly : Success")
+    except Exception as e:
+        log.error("An error occurred: %s", str(e))
+        log.debug("Exception traceback", exc_info=True)
+        count_instance_errors.labels(instance=instance_id).inc()
+        await bot.send_message(message.chat.id, f"Error requesting data. Please try again later.")
+
+
 async def statistic(message: Message, bot: AsyncTeleBot, config: Settings, status_user: dict) -> None:
     """
     Retrieves and sends weather statistics for a given city for the past week.
@@ -360,37 +393,50 @@ async def statistic(message: Message, bot: AsyncTeleBot, config: Settings, statu
     - ValidationError: If there is a validation error in the received data.
 
     Notes:
-    - This function sends a separate message for each day of the past week, containing the temperature and precipitation information for that day.
-    - The function uses the `get_response` function to retrieve data from the weather API.
-    - The function uses the `DayDetails`, `Condition`, and `Location` models to validate and parse the received data.
+    - With CHARTS_ENABLED the week is sent as one chart with a short summary, drawn and uploaded once per city
+      and day (see `ChartCache`); otherwise a separate message is sent for each day of the past week,
+      containing the temperature and precipitation information for that day.
+    - The function uses `fetch_history`, which reads the weather cache before calling the weather API.
+      While the quota budget is at CACHE_ONLY or above, only cached days are shown.
+    - Each day is rendered by `history_day_text` in the user's language and kept in the render cache.
     """
 
     try:
-        log.info(f"User requested weather statistic: {status_user['city']}")
+        log.info("User requested weather statistic: %s", status_user['city'])
+        language = language_of(message.from_user)
         today_date = date.today()
+        if config.CHARTS_ENABLED:
+            async def load() -> Optional[ChartSeries]:
+                payloads = []
+                for days in range(7, 0, -1):
+                    data = await fetch_history(message, bot, config, status_user["city"],
+                                               today_date - timedelta(days=days), statistics_cache_only())
+                    if data is None:
+                        return None
+                    payloads.append(data)
+                return history_series(payloads)
+
+            await ChartCache.send(bot, message.chat.id, status_user["city"], "history:7", today_date,
+                                  load, lambda series: chart_caption(series, language, "history"))
+            return log.info("statistic chart : Success")
         for days in range(1, 8):
             statistic_date = today_date - timedelta(days=days)
-            url_statistic = f'https://api.weatherapi.com/v1/history.json?key={config.API_KEY}&q={status_user["city"]}&dt={statistic_date}'
-            data = await get_response(message, url_statistic, bot)
-            day_details = DayDetails.model_validate(data['forecast']['forecastday'][0]['day'])
-            day_details_data = data['forecast']['forecastday'][0]['date']
-            precipitation = Condition.model_validate(data['forecast']['forecastday'][0]['day']['condition'])
-            location = Location.model_validate(data['location'])
-            msg_statistic = (
-                f"{location.name} ({location.region}): {day_details_data}\n"
-                f"Temperature: Max: {day_details.maxtemp_c}°C, Min: {day_details.mintemp_c}°C, {precipitation.text} \n"
-            )
+            data = await fetch_history(message, bot, config, status_user["city"], statistic_date,
+                                       statistics_cache_only())
+            if data is None:
+                return
+            msg_statistic = history_day_text(status_user["city"], language, data, statistic_date)
             await bot.send_message(message.chat.id, msg_statistic)
-        log.info(f"statistic : Success")
+        log.info("statistic : Success")
     except Exception as e:
         log.error("An error occurred: %s", str(e))
-        log.debug(traceback.format_exc())
+        log.debug("Exception traceback", exc_info=True)
         await bot.send_message(message.chat.id, f"Error")
         count_instance_errors.labels(instance=instance_id).inc()
     except ValidationError as e:
         validation_error.labels(instance=instance_id).inc(0)
         await bot.send_message(message.chat.id, f"Error")
-        log.error(f"statistic : Validation error {e}")
+        log.error("statistic : Validation error %s", e)
 
 
 async def prediction(message: Message, bot: AsyncTeleBot, config: Settings, status_user: dict) -> None:
@@ -399,13 +445,17 @@ async def prediction(message: Message, bot: AsyncTeleBot, config: Settings, stat
     """
     try:
         today_date = date.today()
-        log.info(f"User requested weather prediction: {status_user['city']}")
+        log.info("User requested weather prediction: %s", status_user['city'])
 
         # Calculate average temperature for the last 7 days
         avgtemp_c_7days = await calculate_avg_temp_7days(message, today_date, status_user, config, bot)
+        if avgtemp_c_7days is None:
+            return
 
         # Calculate average temperature for the next 3 days
         avgtemp_c_3days = await calculate_avg_temp_3days(message, status_user, config, bot)
+        if avgtemp_c_3days is None:
+            return
 
         # Formulate the message to be sent
         if avgtemp_c_7days < avgtemp_c_3days:
@@ -422,13 +472,164 @@ async def prediction(message: Message, bot: AsyncTeleBot, config: Settings, stat
             await bot.send_message(message.chat.id,
                                    f"The average temperature in the next 3 days will be {avgtemp_c_3days}°C,"
                                    f" the temperature remains the same as in the last 7 days")
-        log.info(f"Prediction : Success")
+        log.info("Prediction : Success")
 
     except ZeroDivisionError as e:
         await bot.send_message(message.chat.id, f"Error, please try again")
-        log.error(f"statistic : Validation error {e}")
+        log.error("statistic : Validation error %s", e)
     except Exception as e:
         count_instance_errors.labels(instance=instance_id).inc()
         log.error("An error occurred: %s", str(e))
-        log.debug(f"Exception traceback: \n {traceback.format_exc()}")
+        log.debug("Exception traceback", exc_info=True)
         await bot.send_message(message.chat.id, f"Error, please try again later")
+
+
+async def subscribe(pool: Pool, message: Message, bot: AsyncTeleBot) -> None:
+    """
+    Asks the user for the local delivery time of the daily forecast and waits for the value.
+    """
+    try:
+        await bot.send_message(message.chat.id,
+                               'Enter the local time for your daily forecast in the format HH:MM, for example 07:30:')
+        await sql_update_user_state_bd(bot, pool, message, "subscribe_time")
+        log.info(" User %s waiting_value: subscribe_time", message.chat.id)
+    except Exception as e:
+        log.error("An error occurred: %s", str(e))
+        log.debug("Exception traceback", exc_info=True)
+        count_instance_errors.labels(instance=instance_id).inc()
+        await bot.send_message(message.chat.id, 'An error occurred. Please try again later.')
+
+
+async def add_subscription(pool: Pool, message: Message, bot: AsyncTeleBot, config: Settings,
+                           status_user: dict) -> None:
+    """
+    Subscribes the chat to a daily forecast for its current city at the entered local time.
+    The local time is converted to a UTC minute of the day using the city's current UTC offset.
+    """
+    try:
+        delivery_time = datetime.strptime(message.text.strip(), "%H:%M")
+    except ValueError:
+        await bot.send_message(message.chat.id, "Time must be in the format HH:MM.")
+        count_user_errors.labels(instance=instance_id).inc()
+        log.error("add_subscription: Does not match the format HH:MM.")
+        return
+    try:
+        data = await fetch_forecast(message, bot, config, status_user["city"])
+        if not data:
+            return
+        location = Location.model_validate(data["location"])
+        local_minute = delivery_time.hour * 60 + delivery_time.minute
+        due_minute = to_due_minute(local_minute, utc_offset_minutes(location))
+        await upsert_subscription(pool, message.chat.id, status_user["city"], local_minute, due_minute,
+                                  language_of(message.from_user))
+        await bot.send_message(message.chat.id,
+                               f"Every day at {delivery_time:%H:%M} ({location.name} time) you will receive "
+                               f"the forecast for {location.name}.\n/unsubscribe - stop the daily forecast")
+        log.info("User %s subscribed at %02d:%02d", message.chat.id, delivery_time.hour, delivery_time.minute)
+    except Exception as e:
+        log.error("An error occurred: %s", str(e))
+        log.debug("Exception traceback", exc_info=True)
+        count_instance_errors.labels(instance=instance_id).inc()
+        await bot.send_message(message.chat.id, 'An error occurred. Please try again later.')
+
+
+async def unsubscribe(pool: Pool, message: Message, bot: AsyncTeleBot) -> None:
+    try:
+        await delete_subscription(pool, message.chat.id)
+        await bot.send_message(message.chat.id, 'The daily forecast is turned off.')
+        log.info("User %s unsubscribed", message.chat.id)
+    except Exception as e:
+        log.error("An error occurred: %s", str(e))
+        log.debug("Exception traceback", exc_info=True)
+        count_instance_errors.labels(instance=instance_id).inc()
+        await bot.send_message(message.chat.id, 'An error occurred. Please try again later.')
+
+
+async def add_favorite_city(pool: Pool, message: Message, bot: AsyncTeleBot, config: Settings,
+                            status_user: dict) -> None:
+    """
+    Adds the current city to the chat's favorites, up to FAVORITES_MAX cities.
+    The city is stored as it is in user_state.city, so favorites share cache entries with /current_weather.
+    """
+    try:
+        favorites = status_user["favorites"]
+        if status_user["city"] in favorites:
+            await bot.send_message(message.chat.id, 'The city is already in your favorites.\n/my_cities')
+            return
+        if len(favorites) >= config.FAVORITES_MAX:
+            await bot.send_message(message.chat.id, f'You already have {config.FAVORITES_MAX} favorite cities. '
+                                                    f'Remove one with the buttons of /my_cities.')
+            return
+        if not favorite_fits(status_user["city"]):
+            # Only names stored before the location index; /change_city stores the canonical id
+            await bot.send_message(message.chat.id, 'Please choose the city again with /change_city, '
+                                                    'then add it with /add_favorite.')
+            return
+        data = await fetch_forecast(message, bot, config, status_user["city"])
+        if not data:
+            return
+        favorites = await add_favorite(pool, message.chat.id, status_user["city"], config.FAVORITES_MAX)
+        if favorites is None:
+            await bot.send_message(message.chat.id, 'The city could not be added, please try again.')
+            return
+        name = Location.model_validate(data["location"]).name
+        await bot.send_message(message.chat.id, f'{name} added to your favorites '
+                                                f'({len(favorites)}/{config.FAVORITES_MAX}).\n/my_cities')
+        log.info("User %s added favorite %s", message.chat.id, status_user["city"])
+    except Exception as e:
+        log.error("An error occurred: %s", str(e))
+        log.debug("Exception traceback", exc_info=True)
+        count_instance_errors.labels(instance=instance_id).inc()
+        await bot.send_message(message.chat.id, 'An error occurred. Please try again later.')
+
+
+async def my_cities(message: Message, bot: AsyncTeleBot, config: Settings, status_user: dict) -> None:
+    """
+    The current weather in every favorite city in one message, with a button per city that removes it.
+    Cities not in the weather cache are fetched together with one weatherapi bulk request.
+    """
+    favorites = status_user["favorites"]
+    if not favorites:
+        await bot.send_message(message.chat.id, 'You have no favorite cities yet. Choose a city with /change_city '
+                                                'and add it with /add_favorite.')
+        return
+    try:
+        log.info("User requested favorites: %s", favorites)
+        payloads = await fetch_forecasts(message, bot, config, favorites)
+        language = language_of(message.from_user)
+        texts = [current_weather_text(city, language, payloads[city]) for city in favorites if city in payloads]
+        if not texts:
+            return
+        await bot.send_message(message.chat.id, "\n\n".join(texts),
+                               reply_markup=favorites_editor(favorite_names(favorites, payloads)))
+        log.info("my_cities: %s of %s cities", len(texts), len(favorites))
+    except Exception as e:
+        log.error("An error occurred: %s", str(e))
+        log.debug("Exception traceback", exc_info=True)
+        count_instance_errors.labels(instance=instance_id).inc()
+        await bot.send_message(message.chat.id, "Error requesting data. Please try again later.")
+
+
+def favorite_names(favorites: List[str], payloads: Dict[str, Dict[str, Any]]) -> List[Tuple[str, str]]:
+    """(city, name) pairs for favorites_editor; a city without a payload is shown as stored."""
+    return [(city, payloads[city]["location"]["name"] if city in payloads else city) for city in favorites]
+
+
+async def remove_favorite_city(pool: Pool, city: str, message: Message, bot: AsyncTeleBot, config: Settings) -> None:
+    """
+    Removes a favorite city and updates the buttons of the /my_cities message that was pressed,
+    naming the remaining cities from the weather cache.
+    """
+    try:
+        left = await remove_favorite(pool, message.chat.id, city) or []
+        payloads = await fetch_forecasts(message, bot, config, left, cache_only=True)
+        await bot.edit_message_reply_markup(message.chat.id, message.message_id,
+                                            reply_markup=favorites_editor(favorite_names(left, payloads)))
+        await bot.send_message(message.chat.id, f'The city is removed from your favorites, '
+                                                f'{len(left)} left.\n/my_cities')
+        log.info("User %s removed favorite %s", message.chat.id, city)
+    except Exception as e:
+        log.error("An error occurred: %s", str(e))
+        log.debug("Exception traceback", exc_info=True)
+        count_instance_errors.labels(instance=instance_id).inc()
+        await bot.send_message(message.chat.id, 'An error occurred. Please try again later.')
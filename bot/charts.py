@@ -0,0 +1,164 @@
+import asyncio
+import logging
+import struct
+import zlib
+from collections import OrderedDict
+from datetime import date
+from typing import Any, Awaitable, Callable, Dict, List, NamedTuple, Optional, Tuple
+
+from telebot.async_telebot import AsyncTeleBot
+from telebot.asyncio_helper import ApiTelegramException
+
+from config.config import get_settings
+from prometheus.couters import instance_id, chart_cache_requests
+
+log = logging.getLogger(__name__)
+
+WIDTH, HEIGHT, MARGIN = 640, 320, 24
+BACKGROUND = (255, 255, 255)
+GRID = (225, 225, 225)
+ZERO_LINE = (150, 150, 150)
+MAX_COLOR = (214, 64, 52)  # daily maximum
+MIN_COLOR = (46, 104, 200)  # daily minimum
+
+
+class ChartSeries(NamedTuple):
+    city: str
+    region: str
+    dates: List[str]
+    max_temps: List[float]
+    min_temps: List[float]
+
+
+class ChartEntry(NamedTuple):
+    series: ChartSeries
+    png: bytes
+    file_id: str  # Telegram file_id of the uploaded png; sending it again costs no upload
+
+
+def history_series(payloads: List[Dict[str, Any]]) -> ChartSeries:
+    """Series of history.json payloads, one per day, in date order."""
+    days = [p["forecast"]["forecastday"][0] for p in payloads]
+    location = payloads[0]["location"]
+    return ChartSeries(location["name"], location["region"], [d["date"] for d in days],
+                       [d["day"]["maxtemp_c"] for d in days], [d["day"]["mintemp_c"] for d in days])
+
+
+def forecast_series(data: Dict[str, Any]) -> ChartSeries:
+    """Series of the days of a forecast.json payload after today."""
+    days = data["forecast"]["forecastday"][1:]
+    location = data["location"]
+    return ChartSeries(location["name"], location["region"], [d["date"] for d in days],
+                       [d["day"]["maxtemp_c"] for d in days], [d["day"]["mintemp_c"] for d in days])
+
+
+def _scale(values: List[float], low: float, high: float, start: int, end: int) -> List[int]:
+    """Maps a whole series to pixel coordinates between start and end in one pass."""
+    span = (high - low) or 1.0
+    return [round(start + (v - low) * (end - start) / span) for v in values]
+
+
+def render_png(series: ChartSeries) -> bytes:
+    """
+    Line chart of the daily maximum and minimum temperatures as a PNG.
+
+    Drawn straight into an RGB buffer and encoded with zlib, so no plotting library is needed;
+    dates and values go into the caption, the image carries the shape of the week.
+    """
+    pixels = bytearray(bytes(BACKGROUND) * (WIDTH * HEIGHT))
+
+    def dot(x: int, y: int, color: Tuple[int, int, int], radius: int) -> None:
+        for py in range(max(y - radius, 0), min(y + radius + 1, HEIGHT)):
+            row = py * WIDTH
+            for px in range(max(x - radius, 0), min(x + radius + 1, WIDTH)):
+                pixels[(row + px) * 3:(row + px) * 3 + 3] = bytes(color)
+
+    def line(x0: int, y0: int, x1: int, y1: int, color: Tuple[int, int, int], radius: int) -> None:
+        steps = max(abs(x1 - x0), abs(y1 - y0), 1)
+        for i in range(steps + 1):
+            dot(x0 + (x1 - x0) * i // steps, y0 + (y1 - y0) * i // steps, color, radius)
+
+    low = min(series.min_temps + series.max_temps)
+    high = max(series.min_temps + series.max_temps)
+    low, high = low - 1, high + 1
+    xs = _scale(list(range(len(series.dates))), 0, max(len(series.dates) - 1, 1), MARGIN, WIDTH - MARGIN)
+    for x in xs:
+        line(x, MARGIN, x, HEIGHT - MARGIN, GRID, 0)
+    if low < 0 < high:
+        zero = _scale([0], low, high, HEIGHT - MARGIN, MARGIN)[0]
+        line(MARGIN, zero, WIDTH - MARGIN, zero, ZERO_LINE, 0)
+    for temps, color in ((series.max_temps, MAX_COLOR), (series.min_temps, MIN_COLOR)):
+        ys = _scale(temps, low, high, HEIGHT - MARGIN, MARGIN)
+        for (x0, y0), (x1, y1) in zip(zip(xs, ys), zip(xs[1:], ys[1:])):
+            line(x0, y0, x1, y1, color, 1)
+        for x, y in zip(xs, ys):
+            dot(x, y, color, 4)
+
+    stride = WIDTH * 3
+    raw = b"".join(b"\x00" + pixels[y * stride:(y + 1) * stride] for y in range(HEIGHT))
+
+    def chunk(kind: bytes, body: bytes) -> bytes:
+        return struct.pack(">I", len(body)) + kind + body + struct.pack(">I", zlib.crc32(kind + body))
+
+    return (b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", struct.pack(">IIBBBBB", WIDTH, HEIGHT, 8, 2, 0, 0, 0))
+            + chunk(b"IDAT", zlib.compress(bytes(raw), 6)) + chunk(b"IEND", b""))
+
+
+class ChartCache:
+    """
+    Uploaded charts keyed by (location, window, day).
+
+    The first request for a key loads the series, draws the png and uploads it with its reply; everybody else
+    that day gets the same photo by Telegram file_id, without loading, drawing or uploading anything.
+    Concurrent first requests share one upload. Bounded by CHART_CACHE_MAX_ENTRIES.
+    """
+    _entries: "OrderedDict[Tuple[str, str, date], ChartEntry]" = OrderedDict()
+    _uploading: Dict[Tuple[str, str, date], "asyncio.Task[Optional[ChartEntry]]"] = {}
+
+    @classmethod
+    async def send(cls, bot: AsyncTeleBot, chat_id: int, location: str, window: str, day: date,
+                   load: Callable[[], Awaitable[Optional[ChartSeries]]],
+                   caption: Callable[[ChartSeries], str]) -> bool:
+        """
+        Sends the chart with its caption to chat_id.
+        Returns False if the series could not be loaded; load is expected to have told the user why.
+        """
+        key = (location.strip().lower(), window, day)
+        while True:
+            entry = cls._entries.get(key)
+            if entry is not None:
+                cls._entries.move_to_end(key)
+                chart_cache_requests.labels(instance=instance_id, result="hit").inc()
+                try:
+                    await bot.send_photo(chat_id, entry.file_id, caption=caption(entry.series))
+                except ApiTelegramException as e:
+                    log.warning("chart %s: file_id rejected (%s), uploading the png again", key, e)
+                    await bot.send_photo(chat_id, entry.png, caption=caption(entry.series))
+                return True
+            task = cls._uploading.get(key)
+            if task is None:
+                chart_cache_requests.labels(instance=instance_id, result="miss").inc()
+                task = cls._uploading[key] = asyncio.create_task(
+                    cls._upload(bot, chat_id, key, load, caption))
+                return await asyncio.shield(task) is not None
+            if await asyncio.shield(task) is None:
+                continue  # The other request could not load the series; try again with this one's load
+
+    @classmethod
+    async def _upload(cls, bot: AsyncTeleBot, chat_id: int, key: Tuple[str, str, date],
+                      load: Callable[[], Awaitable[Optional[ChartSeries]]],
+                      caption: Callable[[ChartSeries], str]) -> Optional[ChartEntry]:
+        try:
+            series = await load()
+            if series is None or not series.dates:
+                return None
+            png = await asyncio.to_thread(render_png, series)  # tens of ms of pure Python drawing
+            sent = await bot.send_photo(chat_id, png, caption=caption(series))
+            entry = ChartEntry(series, png, sent.photo[-1].file_id)
+            cls._entries[key] = entry
+            while len(cls._entries) > get_settings().CHART_CACHE_MAX_ENTRIES:
+                cls._entries.popitem(last=False)
+            log.debug("chart %s uploaded, %s bytes", key, len(png))
+            return entry
+        finally:
+            cls._uploading.pop(key, None)
@@ -0,0 +1,113 @@
+import logging
+import sys
+from array import array
+from bisect import bisect_right
+from collections import OrderedDict
+from itertools import accumulate
+from typing import Any, Dict, List, NamedTuple, Tuple
+
+from config.config import get_settings
+from helpers.helpers import utc_offset_minutes
+from helpers.models_weather import Astro, Hour, Location
+from prometheus.couters import instance_id, hourly_cache_requests, hourly_cache_bytes, hourly_cache_entries
+
+log = logging.getLogger(__name__)
+
+
+class HourlyRows(NamedTuple):
+    """A window of an HourlySeries; every column is an array of the same length."""
+    epochs: array  # 'q': unix time of the hour
+    temps: array  # 'f': °C
+    chances: array  # 'B': chance of rain, or of snow at or below 0°C, %
+    winds: array  # 'f': km/h
+    conditions: array  # 'B': index into HourlySeries.condition_names
+
+
+class HourlySeries:
+    """
+    The hourly forecast of one payload as typed columns, one array per field plus the epoch column.
+
+    An hour takes 18 bytes instead of a dict of about 30 keys, and windows are array slices, so no
+    per-hour object is built after the payload is read. Conditions are dictionary-encoded:
+    weatherapi uses a few dozen (code, text) pairs, which are translated once per render, not once per hour.
+    """
+    __slots__ = ("city", "region", "utc_offset", "dates", "astro", "day_starts", "epochs", "temps", "chances",
+                 "winds", "conditions", "condition_names")
+
+    def __init__(self, data: Dict[str, Any]):
+        location = Location.model_validate(data["location"])
+        days = data["forecast"]["forecastday"]
+        self.city, self.region = location.name, location.region
+        self.utc_offset = utc_offset_minutes(location) * 60  # seconds, for local hours without a tz database
+        self.dates: List[str] = [d["date"] for d in days]
+        self.astro: List[Astro] = [Astro.model_validate(d["astro"]) for d in days]
+        for d in days:
+            if d.get("hour"):
+                Hour.model_validate(d["hour"][0])  # the payload shape, checked once per day
+        hours = [h for d in days for h in d.get("hour", [])]
+        self.day_starts: List[int] = list(accumulate([len(d.get("hour", [])) for d in days], initial=0))
+        names: Dict[Tuple[int, str], int] = {}
+        self.epochs = array("q", [h["time_epoch"] for h in hours])
+        self.temps = array("f", [h["temp_c"] for h in hours])
+        self.chances = array("B", [h["chance_of_rain"] if h["temp_c"] > 0 else h["chance_of_snow"] for h in hours])
+        self.winds = array("f", [h["wind_kph"] for h in hours])
+        self.conditions = array("B", [names.setdefault((h["condition"]["code"], h["condition"]["text"]), len(names))
+                                      for h in hours])
+        self.condition_names: List[Tuple[int, str]] = list(names)
+
+    def _rows(self, start: int, end: int, step: int) -> HourlyRows:
+        return HourlyRows(self.epochs[start:end:step], self.temps[start:end:step], self.chances[start:end:step],
+                          self.winds[start:end:step], self.conditions[start:end:step])
+
+    def window(self, start: int, hours: int, step: int = 1) -> HourlyRows:
+        """Every step-th hour of the `hours` hours from the one containing unix time start."""
+        first = max(bisect_right(self.epochs, start) - 1, 0)
+        return self._rows(first, first + hours, step)
+
+    def day(self, index: int, step: int = 1) -> HourlyRows:
+        """Every step-th hour of the index-th forecast day."""
+        return self._rows(self.day_starts[index], self.day_starts[index + 1], step)
+
+    def day_of(self, epoch: int) -> int:
+        """Index of the forecast day an hour belongs to."""
+        return max(bisect_right(self.day_starts, bisect_right(self.epochs, epoch) - 1) - 1, 0)
+
+    @property
+    def nbytes(self) -> int:
+        """Memory held by the series, as counted by sys.getsizeof (the astro models are counted shallowly)."""
+        columns = (self.epochs, self.temps, self.chances, self.winds, self.conditions)
+        containers = (self.dates, self.astro, self.day_starts, self.condition_names)
+        return (sys.getsizeof(self) + sum(sys.getsizeof(c) for c in columns + containers)
+                + sum(sys.getsizeof(text) for _, text in self.condition_names))
+
+
+class HourlyCache:
+    """
+    HourlySeries by location and number of forecast days, rebuilt when weatherapi updates the payload
+    (its data_version changes). Bounded by HOURLY_CACHE_MAX_ENTRIES.
+    The hourly_cache_bytes and hourly_cache_entries gauges give the memory cost per city.
+    """
+    _entries: "OrderedDict[Tuple[str, int], Tuple[int, HourlySeries]]" = OrderedDict()
+    _bytes: int = 0
+
+    @classmethod
+    def get(cls, city: str, version: int, data: Dict[str, Any]) -> HourlySeries:
+        key = (city.strip().lower(), len(data["forecast"]["forecastday"]))
+        entry = cls._entries.get(key)
+        if entry and entry[0] == version:
+            cls._entries.move_to_end(key)
+            hourly_cache_requests.labels(instance=instance_id, result="hit").inc()
+            return entry[1]
+        hourly_cache_requests.labels(instance=instance_id, result="miss").inc()
+        series = HourlySeries(data)
+        if entry:
+            cls._bytes -= entry[1].nbytes
+        cls._entries[key] = (version, series)
+        cls._entries.move_to_end(key)
+        cls._bytes += series.nbytes
+        while len(cls._entries) > get_settings().HOURLY_CACHE_MAX_ENTRIES:
+            cls._bytes -= cls._entries.popitem(last=False)[1][1].nbytes
+        hourly_cache_bytes.labels(instance=instance_id).set(cls._bytes)
+        hourly_cache_entries.labels(instance=instance_id).set(len(cls._entries))
+        log.debug("hourly cache: %s %s hours, %s bytes", key, len(series.epochs), series.nbytes)
+        return series
@@ -0,0 +1,65 @@
+from datetime import date, timedelta
+from typing import List, Optional, Tuple
+
+from telebot.types import InlineKeyboardButton, InlineKeyboardMarkup
+
+# Callback data prefixes; the data carries every parameter, so answering a button needs no stored state
+FORECAST_DAY = "fd"  # fd:<YYYY-MM-DD>
+FORECAST_DAYS = "fs"  # fs:<number of days>
+HOURLY = "hr"  # hr:<number of hours>
+FAVORITE_REMOVE = "fr"  # fr:<city as stored in user_state.favorites>
+
+CALLBACK_DATA_MAX_BYTES = 64  # Telegram's limit
+
+MAX_FORECAST_DAYS = 10
+HOURLY_WINDOWS = (24, 48)
+
+
+def date_picker(today: date) -> InlineKeyboardMarkup:
+    """Buttons for today and the next MAX_FORECAST_DAYS days, three per row."""
+    markup = InlineKeyboardMarkup(row_width=3)
+    days = [today + timedelta(days=i) for i in range(MAX_FORECAST_DAYS + 1)]
+    markup.add(*[InlineKeyboardButton(d.strftime("%a %d.%m"), callback_data=f"{FORECAST_DAY}:{d.isoformat()}")
+                 for d in days])
+    return markup
+
+
+def days_picker() -> InlineKeyboardMarkup:
+    """Buttons for 1 to MAX_FORECAST_DAYS days, five per row."""
+    markup = InlineKeyboardMarkup(row_width=5)
+    markup.add(*[InlineKeyboardButton(str(n), callback_data=f"{FORECAST_DAYS}:{n}")
+                 for n in range(1, MAX_FORECAST_DAYS + 1)])
+    return markup
+
+
+def hourly_picker() -> InlineKeyboardMarkup:
+    """Buttons for the next 24 and 48 hours."""
+    markup = InlineKeyboardMarkup(row_width=2)
+    markup.add(*[InlineKeyboardButton(f"{hours} h", callback_data=f"{HOURLY}:{hours}") for hours in HOURLY_WINDOWS])
+    return markup
+
+
+def favorite_fits(city: str) -> bool:
+    """True if the remove button of a city fits in the callback data; canonical ids and grid cells always do."""
+    return len(f"{FAVORITE_REMOVE}:{city}".encode()) <= CALLBACK_DATA_MAX_BYTES
+
+
+def favorites_editor(favorites: List[Tuple[str, str]]) -> Optional[InlineKeyboardMarkup]:
+    """
+    A button per (city, name) that removes the city. The button carries the city itself, so the buttons
+    left after a removal still point at their own cities. None when there is nothing left to remove.
+    """
+    if not favorites:
+        return None
+    markup = InlineKeyboardMarkup(row_width=2)
+    markup.add(*[InlineKeyboardButton(f"✖ {name}", callback_data=f"{FAVORITE_REMOVE}:{city}")
+                 for city, name in favorites])
+    return markup
+
+
+def parse_callback(data: Optional[str]) -> Tuple[str, str]:
+    """Splits callback data into (prefix, value); unknown data gives an empty prefix."""
+    prefix, _, value = (data or "").partition(":")
+    if prefix not in (FORECAST_DAY, FORECAST_DAYS, HOURLY, FAVORITE_REMOVE):
+        return "", ""
+    return prefix, value
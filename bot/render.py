@@ -0,0 +1,205 @@
+import logging
+import time
+from collections import OrderedDict
+from datetime import date
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from bot.charts import ChartSeries
+from bot.hourly import HourlyCache, HourlyRows, HourlySeries
+from config.config import get_settings
+from helpers.helpers import condition_text, wind
+from helpers.model_message import User
+from helpers.models_weather import Condition, DayDetails, Location, WeatherData
+from helpers.translations import DEFAULT_LANGUAGE, LANGUAGES, TEMPLATES
+from prometheus.couters import instance_id, render_cache_requests
+
+log = logging.getLogger(__name__)
+
+
+def language_of(user: Optional[User]) -> str:
+    """The reply language for a Telegram user: 'ru' for ru and ru-RU, DEFAULT_LANGUAGE for anything unsupported."""
+    code = ((user.language_code if user else None) or "").split("-")[0].lower()
+    return code if code in LANGUAGES else DEFAULT_LANGUAGE
+
+
+def data_version(data: Dict[str, Any]) -> int:
+    """Changes whenever weatherapi updates a forecast payload; history payloads never change and have version 0."""
+    return data.get("current", {}).get("last_updated_epoch", 0)
+
+
+class RenderCache:
+    """
+    Rendered replies keyed by (location, day, language, command).
+
+    An entry is reused while the payload it was rendered from keeps the same data_version, so a popular
+    city is formatted once per weatherapi update instead of once per user. Bounded by RENDER_CACHE_MAX_ENTRIES.
+    """
+    _entries: "OrderedDict[Tuple[str, date, str, str], Tuple[int, Any]]" = OrderedDict()
+
+    @classmethod
+    def get_or_render(cls, location: str, day: date, language: str, command: str, data: Dict[str, Any],
+                      render: Callable[[], Any]) -> Any:
+        key = (location.strip().lower(), day, language, command)
+        version = data_version(data)
+        entry = cls._entries.get(key)
+        if entry and entry[0] == version:
+            cls._entries.move_to_end(key)
+            render_cache_requests.labels(instance=instance_id, result="hit").inc()
+            return entry[1]
+        render_cache_requests.labels(instance=instance_id, result="miss").inc()
+        result = render()
+        cls._entries[key] = (version, result)
+        cls._entries.move_to_end(key)
+        while len(cls._entries) > get_settings().RENDER_CACHE_MAX_ENTRIES:
+            cls._entries.popitem(last=False)
+        return result
+
+
+def render_current(weather_data: WeatherData, language: str) -> str:
+    """The current weather and today's forecast; shared by /current_weather and daily subscriptions."""
+    forecast = weather_data.forecast.forecastday[0].day
+    current = weather_data.current
+    return TEMPLATES[language]["current"].format(
+        city=weather_data.location.name,
+        region=weather_data.location.region,
+        local_time=weather_data.location.localtime,
+        temperature=current.temp_c,
+        feels_like=current.feelslike_c,
+        max_temp=forecast.maxtemp_c,
+        min_temp=forecast.mintemp_c,
+        wind=wind(current.wind_dir, current.wind_kph, forecast.maxwind_kph, language),
+        humidity=current.humidity,
+        precipitation=forecast.daily_chance_of_rain if current.temp_c > 0 else forecast.daily_chance_of_snow,
+        condition=condition_text(forecast.condition.code, forecast.condition.text, language),
+    )
+
+
+def render_forecast_day(weather_data: WeatherData, index: int, language: str) -> str:
+    """One day of a forecast, as answered to /weather_forecast."""
+    forecast_day = weather_data.forecast.forecastday[index]
+    precipitation = forecast_day.day.daily_chance_of_rain if weather_data.current.temp_c > 0 else \
+        weather_data.forecast.forecastday[1].day.daily_chance_of_snow
+    return TEMPLATES[language]["forecast_day"].format(
+        city=weather_data.location.name,
+        region=weather_data.location.region,
+        date=forecast_day.date,
+        max_temp=forecast_day.day.maxtemp_c,
+        min_temp=forecast_day.day.mintemp_c,
+        wind_speed=round(forecast_day.day.maxwind_kph / 3.6),
+        precipitation=precipitation,
+        condition=condition_text(forecast_day.day.condition.code, forecast_day.day.condition.text, language),
+    )
+
+
+def render_forecast_days(weather_data: WeatherData, language: str) -> List[str]:
+    """Every day of a forecast after today, one message per day, as answered to /forecast_for_several_days."""
+    messages = []
+    for forecast in weather_data.forecast.forecastday[1:]:
+        day = forecast.day
+        messages.append(TEMPLATES[language]["forecast_days"].format(
+            city=weather_data.location.name,
+            region=weather_data.location.region,
+            date=forecast.date,
+            max_temp=day.maxtemp_c,
+            min_temp=day.mintemp_c,
+            wind_speed=round(day.maxwind_kph / 3.6),
+            humidity=day.avghumidity,
+            precipitation=day.daily_chance_of_rain if day.avgtemp_c > 0 else day.daily_chance_of_snow,
+            condition=condition_text(day.condition.code, day.condition.text, language),
+        ))
+    return messages
+
+
+def render_history_day(data: Dict[str, Any], language: str) -> str:
+    """One past day of a history payload, as answered to /weather_statistic."""
+    forecast_day = data['forecast']['forecastday'][0]
+    day_details = DayDetails.model_validate(forecast_day['day'])
+    condition = Condition.model_validate(forecast_day['day']['condition'])
+    location = Location.model_validate(data['location'])
+    return TEMPLATES[language]["history_day"].format(
+        city=location.name,
+        region=location.region,
+        date=forecast_day['date'],
+        max_temp=day_details.maxtemp_c,
+        min_temp=day_details.mintemp_c,
+        condition=condition_text(condition.code, condition.text, language),
+    )
+
+
+def chart_caption(series: ChartSeries, language: str, period: str) -> str:
+    """Short summary sent with a chart; period is 'history' or 'forecast'."""
+    hottest = max(range(len(series.dates)), key=series.max_temps.__getitem__)
+    coldest = min(range(len(series.dates)), key=series.min_temps.__getitem__)
+    templates = TEMPLATES[language]
+    return templates["chart"].format(
+        city=series.city,
+        region=series.region,
+        period=templates[f"period_{period}"].format(days=len(series.dates)),
+        first=series.dates[0],
+        last=series.dates[-1],
+        max_temp=series.max_temps[hottest],
+        max_date=series.dates[hottest],
+        min_temp=series.min_temps[coldest],
+        min_date=series.dates[coldest],
+    )
+
+
+def render_hours(series: HourlySeries, rows: HourlyRows, language: str) -> List[str]:
+    """
+    One line per hour in the location's local time, with a date line where a day starts.
+    A single pass over the zipped columns; condition names are translated once per series.
+    """
+    template = TEMPLATES[language]["hour"]
+    names = [condition_text(code, text, language) for code, text in series.condition_names]
+    lines = []
+    current_day = None
+    for epoch, temp, chance, wind_kph, condition in zip(*rows):
+        local = time.gmtime(epoch + series.utc_offset)
+        if local.tm_yday != current_day:
+            current_day = local.tm_yday
+            lines.append(time.strftime("%Y-%m-%d", local))
+        lines.append(template.format(time=f"{local.tm_hour:02d}:{local.tm_min:02d}", temp=round(temp), chance=chance,
+                                     wind=round(wind_kph / 3.6), condition=names[condition]))
+    return lines
+
+
+def render_hourly(series: HourlySeries, start: int, hours: int, language: str) -> str:
+    """The next hours from unix time start, as answered to /hourly; beyond 24 hours every second hour is shown."""
+    rows = series.window(start, hours, step=max(hours // 24, 1))
+    astro = series.astro[series.day_of(start)]
+    header = TEMPLATES[language]["hourly"].format(city=series.city, region=series.region, hours=hours,
+                                                  sunrise=astro.sunrise, sunset=astro.sunset)
+    return "\n".join([header, *render_hours(series, rows, language)])
+
+
+def current_weather_text(city: str, language: str, data: Dict[str, Any]) -> str:
+    return RenderCache.get_or_render(city, date.today(), language, "/current_weather", data,
+                                     lambda: render_current(WeatherData.model_validate(data), language))
+
+
+def forecast_day_text(city: str, language: str, data: Dict[str, Any], index: int) -> str:
+    """The forecast of one day followed by every third hour of it."""
+    def render() -> str:
+        text = render_forecast_day(WeatherData.model_validate(data), index, language)
+        series = HourlyCache.get(city, data_version(data), data)
+        lines = render_hours(series, series.day(index, step=3), language)[1:]  # the date is in the day text
+        return "\n\n".join([text, "\n".join([TEMPLATES[language]["hourly_detail"], *lines])]) if lines else text
+
+    return RenderCache.get_or_render(city, date.today(), language, f"/weather_forecast:{index}", data, render)
+
+
+def forecast_days_texts(city: str, language: str, data: Dict[str, Any], days: int) -> List[str]:
+    return RenderCache.get_or_render(city, date.today(), language, f"/forecast_for_several_days:{days}", data,
+                                     lambda: render_forecast_days(WeatherData.model_validate(data), language))
+
+
+def history_day_text(city: str, language: str, data: Dict[str, Any], day: date) -> str:
+    return RenderCache.get_or_render(city, day, language, "/weather_statistic", data,
+                                     lambda: render_history_day(data, language))
+
+
+def hourly_text(city: str, language: str, data: Dict[str, Any], start: int, hours: int) -> str:
+    """Cached per hour of start, so everyone asking for a city within the same hour shares one render."""
+    return RenderCache.get_or_render(city, date.today(), language, f"/hourly:{hours}:{start // 3600}", data,
+                                     lambda: render_hourly(HourlyCache.get(city, data_version(data), data),
+                                                           start, hours, language))
@@ -0,0 +1,154 @@
+import asyncio
+import logging
+from collections import defaultdict
+from datetime import date, datetime, time, timedelta, timezone
+from typing import Dict, List, Optional, Set, Tuple
+
+from asyncpg import Pool, Record
+from telebot.async_telebot import AsyncTeleBot
+from telebot.asyncio_helper import ApiTelegramException
+
+from bot.render import current_weather_text
+from config.config import get_settings, get_bot, worker_share
+from helpers.helpers import utc_offset_minutes, to_due_minute
+from helpers.models_weather import Location
+from helpers.weather_api import fetch_forecast
+from postgres.database_adapters import claim_due_subscriptions, rebucket_subscriptions, release_subscriptions
+from postgres.pool import DbPool
+from prometheus.couters import instance_id, subscription_deliveries
+
+log = logging.getLogger(__name__)
+
+# UTC minute of the day handled by the previous tick; missed minutes are caught up on the next one
+_last_minute: Optional[int] = None
+# (day, UTC minute) of deliveries that failed and were released; claimed again while within the catch-up window
+_retry: Set[Tuple[date, int]] = set()
+
+
+async def send_bulk(bot: AsyncTeleBot, chat_ids: List[int], text: str, rate: float, concurrency: int) -> List[int]:
+    """
+    Sends the same text to many chats, starting at most `rate` sends per second with `concurrency` in flight.
+    A chat answered with 429 is retried once after the retry_after Telegram asks for.
+    Returns the chats that failed for a reason that may pass (429, 5xx, network); a chat that blocked the bot
+    or no longer exists is not returned.
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+    retry = []
+
+    async def send(chat_id: int) -> None:
+        async with semaphore:
+            for attempt in range(2):
+                try:
+                    await bot.send_message(chat_id, text)
+                    subscription_deliveries.labels(instance=instance_id, result="sent").inc()
+                    return
+                except ApiTelegramException as e:
+                    if e.error_code == 429 and attempt == 0:
+                        await asyncio.sleep(e.result_json.get("parameters", {}).get("retry_after", 1))
+                        continue
+                    log.error("Daily forecast to %s failed: %s", chat_id, e.description)
+                    if e.error_code == 429 or e.error_code >= 500:
+                        retry.append(chat_id)
+                    break
+                except Exception as e:
+                    log.error("Daily forecast to %s failed: %s", chat_id, str(e))
+                    retry.append(chat_id)
+                    break
+            subscription_deliveries.labels(instance=instance_id, result="failed").inc()
+
+    tasks = []
+    for chat_id in chat_ids:
+        tasks.append(asyncio.create_task(send(chat_id)))
+        await asyncio.sleep(1 / rate)
+    await asyncio.gather(*tasks)
+    return retry
+
+
+def due_minutes(now: datetime, catchup: int) -> Dict[date, List[int]]:
+    """
+    UTC minutes to claim on this tick, grouped by the day they belong to.
+    Minutes before midnight caught up after it stay on the previous day, so they are not sent twice.
+    The current minute is always claimed, even by a second tick within the same minute: claiming is
+    idempotent, and subscriptions added between the two ticks would be skipped otherwise.
+    Minutes of released deliveries are claimed again until they are more than catchup minutes old.
+    """
+    global _last_minute, _retry
+    minute = now.hour * 60 + now.minute
+    steps = 1 if _last_minute is None else max(1, min((minute - _last_minute) % 1440, catchup))
+    _last_minute = minute
+    buckets = defaultdict(list)
+    for back in range(steps):
+        m = minute - back
+        buckets[now.date() if m >= 0 else now.date() - timedelta(days=1)].append(m % 1440)
+    oldest = now.replace(second=0, microsecond=0, tzinfo=None) - timedelta(minutes=catchup)
+    for day, m in sorted(_retry):
+        if datetime.combine(day, time()) + timedelta(minutes=m) >= oldest and m not in buckets[day]:
+            buckets[day].append(m)
+    _retry = set()
+    return buckets
+
+
+async def deliver_due_subscriptions() -> None:
+    """
+    Sends the daily forecast to every subscription due since the previous tick.
+
+    Due chats are claimed through the due_minute index and grouped by city, so each city costs one
+    (usually cached) upstream fetch and one rendering per language however many chats are subscribed to it.
+    Claiming marks a chat as sent for the day; when the forecast cannot be fetched or the message fails for a
+    reason that may pass, the claim is released and the chat is tried again on the next ticks.
+    """
+    config = get_settings()
+    pool = await DbPool.get_pool()
+    bot = get_bot()
+    # Every worker runs this tick, so each sends at its share of the replica's budget (see worker_share)
+    rate = config.SUBSCRIPTION_SEND_RATE / max(1, config.WORKERS)
+    concurrency = worker_share(config.SUBSCRIPTION_SEND_CONCURRENCY)
+    by_city = defaultdict(list)
+    for day, minutes in due_minutes(datetime.now(timezone.utc), config.SUBSCRIPTION_CATCHUP_MINUTES).items():
+        for row in await claim_due_subscriptions(pool, minutes, day):
+            by_city[row["city"].strip().lower()].append((day, row))
+
+    for city, claimed in by_city.items():
+        rows = [row for _, row in claimed]
+        pending = {row["chat_id"] for row in rows}  # not handed to send_bulk yet
+        retry = []
+        try:
+            data = await fetch_forecast(None, bot, config, city)
+            if not data:
+                subscription_deliveries.labels(instance=instance_id, result="failed").inc(len(rows))
+            else:
+                # Follow DST: chats whose bucket no longer matches the city's offset move to the new one
+                offset = utc_offset_minutes(Location.model_validate(data["location"]))
+                moved = [r["chat_id"] for r in rows if to_due_minute(r["local_minute"], offset) != r["due_minute"]]
+                if moved:
+                    await rebucket_subscriptions(pool, moved, offset)
+                by_language = defaultdict(list)
+                for row in rows:
+                    by_language[row["language"]].append(row["chat_id"])
+                for language, chat_ids in by_language.items():
+                    text = current_weather_text(city, language, data)
+                    pending.difference_update(chat_ids)
+                    retry += await send_bulk(bot, chat_ids, text, rate, concurrency)
+                log.info("Daily forecast for %s sent to %s chats", city, len(rows) - len(retry))
+        except Exception as e:
+            subscription_deliveries.labels(instance=instance_id, result="failed").inc(len(pending))
+            log.error("Daily forecast for %s failed: %s", city, str(e))
+            log.debug("Exception traceback", exc_info=True)
+        failed = pending.union(retry)
+        if failed:
+            await release_failed(pool, [(day, row) for day, row in claimed if row["chat_id"] in failed])
+
+
+async def release_failed(pool: Pool, claimed: List[Tuple[date, Record]]) -> None:
+    """Releases failed claims and remembers their minutes for the next ticks."""
+    by_day = defaultdict(list)
+    for day, row in claimed:
+        by_day[day].append(row["chat_id"])
+        _retry.add((day, row["due_minute"]))
+    try:
+        for day, chat_ids in by_day.items():
+            await release_subscriptions(pool, chat_ids, day)
+        subscription_deliveries.labels(instance=instance_id, result="retried").inc(len(claimed))
+    except Exception as e:
+        log.error("Releasing %s failed daily forecasts failed: %s", len(claimed), str(e))
+        log.debug("Exception traceback", exc_info=True)
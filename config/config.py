@@ -1,5 +1,6 @@
 from functools import lru_cache
 from pydantic_settings import BaseSettings, SettingsConfigDict
+from telebot import asyncio_helper
 from telebot.async_telebot import AsyncTeleBot
 import logging
 
@@ -11,7 +12,10 @@ class Settings(BaseSettings):
     API_KEY: str
     TG_BOT_API_URL: str
     APP_DOMAIN: str
-    LOG_LEVEL: str = 'DEBUG'
+    LOG_LEVEL: str = 'INFO'
+    LOG_FORMAT: str = 'json'  # 'json' for Loki, 'text' for reading a terminal
+    LOG_RATE_LIMIT: int = 20  # records per message template and LOG_RATE_WINDOW; the rest are dropped
+    LOG_RATE_WINDOW: float = 60.0
     SECRET_TOKEN_TG_WEBHOOK: str
     POSTGRES_USER: str
     POSTGRES_PASSWORD: str
@@ -24,6 +28,62 @@ class Settings(BaseSettings):
     NGROK_AUTHTOKEN: str
     LISTEN_PORT: int
     LOG_LEVEL_UVICORN: str
+    SKIP_STARTUP_CHECKS: bool = False  # skip the token and API key checks, e.g. on restarts
+    STARTUP_TIMEOUT: float = 10.0
+    WORKERS: int = 1
+    DB_POOL_MIN_SIZE: int = 3
+    DB_POOL_MAX_SIZE: int = 100  # total across all workers
+    HTTP_MAX_CONNECTIONS: int = 100  # total across all workers
+    PROMETHEUS_MULTIPROC_DIR: str = "/tmp/prometheus_multiproc"
+    CACHE_TTL_FORECAST: int = 900
+    CACHE_TTL_HISTORY: int = 604800  # past days never change
+    CACHE_L1_MAX_ENTRIES: int = 1000
+    CACHE_CLEANUP_INTERVAL: int = 300
+    CACHE_STALE_SECONDS: int = 21600  # expired entries are still served for this long while being refreshed
+    UPSTREAM_TIMEOUT: float = 3.0  # per attempt
+    UPSTREAM_DEADLINE: float = 8.0  # whole call, retries and backoff included
+    UPSTREAM_RETRIES: int = 2
+    UPSTREAM_BACKOFF_BASE: float = 0.2
+    UPSTREAM_BACKOFF_MAX: float = 2.0
+    BREAKER_FAILURE_THRESHOLD: int = 5
+    BREAKER_RESET_TIMEOUT: float = 30.0
+    QUOTA_MONTHLY_CALLS: int = 1000000  # calls included in the weatherapi plan
+    QUOTA_FLUSH_INTERVAL: int = 60
+    ACTIVITY_FLUSH_INTERVAL: int = 30
+    ACTIVE_USERS_WINDOW: int = 300  # a chat is active if it sent an update within this many seconds
+    RENDER_CACHE_MAX_ENTRIES: int = 5000
+    CHARTS_ENABLED: bool = True  # one chart and a summary instead of a message per day
+    CHART_CACHE_MAX_ENTRIES: int = 2000
+    HOURLY_CACHE_MAX_ENTRIES: int = 2000
+    FAVORITES_MAX: int = 5  # cities per chat; /my_cities answers all of them with one weatherapi call
+    ANALYTICS_FLUSH_INTERVAL: int = 30
+    ANALYTICS_CACHE_TTL: int = 10
+    LOOP_MONITOR_INTERVAL: float = 0.5  # seconds between event loop lag measurements
+    LOOP_STALL_THRESHOLD: float = 0.25  # a loop blocked longer than this has its stack logged
+    PROFILE_MAX_SECONDS: int = 60  # longest profile /admin/profile runs
+    PROFILE_SAMPLE_INTERVAL: float = 0.005
+    STATISTIC_RETENTION_DAYS: int = 90
+    STATISTIC_RETENTION_INTERVAL: int = 3600
+    STATISTIC_RETENTION_BATCH: int = 1000
+    STATISTIC_RETENTION_PAUSE: float = 0.5  # seconds between batches
+    STATISTIC_RETENTION_MAX_BATCHES: int = 100  # per run
+    RATE_LIMIT_CAPACITY: float = 10.0  # burst per chat, in command weights
+    RATE_LIMIT_REFILL_PER_SEC: float = 0.2
+    RATE_LIMIT_MAX_CHATS: int = 100000
+    QUOTA_TTL_MULTIPLIER: int = 4  # TTL stretch once the month-end projection exceeds the quota
+    PREWARM_INTERVAL: int = 60
+    PREWARM_LEAD_SECONDS: int = 180  # refresh entries expiring sooner than this; keep above PREWARM_INTERVAL
+    PREWARM_TOP_CITIES: int = 50
+    PREWARM_ACTIVITY_WINDOW: int = 86400
+    PREWARM_MAX_CALLS: int = 30  # upstream calls per refresh cycle
+    LOCATION_ALIAS_CACHE_SIZE: int = 10000
+    LOCATION_NEGATIVE_TTL: int = 86400  # how long an unknown city name is answered without asking weatherapi
+    LOCATION_INDEX_MAX_NAMES: int = 100000
+    LOCATION_GRID_DEG: float = 0.1  # grid cell of shared GPS positions, about 11 km
+    SUBSCRIPTION_TICK: int = 30
+    SUBSCRIPTION_CATCHUP_MINUTES: int = 30
+    SUBSCRIPTION_SEND_RATE: float = 25.0  # msg/s per replica, split between workers; Telegram allows ~30 per bot
+    SUBSCRIPTION_SEND_CONCURRENCY: int = 10  # per replica, split between its workers
 
     model_config = SettingsConfigDict(env_file="../.env")
 
@@ -33,8 +93,22 @@ def get_settings() -> Settings:
     return Settings()
 
 
+def worker_share(total: int, minimum: int = 1) -> int:
+    """
+    Split a process-wide budget (connections, pool size) evenly between the uvicorn workers.
+    Args:
+        total (int): The budget for the whole application.
+        minimum (int): The lowest share a single worker may get.
+    Returns:
+        int: The share of a single worker.
+    """
+    return max(minimum, total // max(1, get_settings().WORKERS))
+
+
 @lru_cache
 def get_bot() -> AsyncTeleBot:
     token = get_settings().TOKEN
+    # telebot sizes its aiohttp connector from this module constant when the session is first created
+    asyncio_helper.REQUEST_LIMIT = worker_share(get_settings().HTTP_MAX_CONNECTIONS)
     bot = AsyncTeleBot(token)
     return bot
@@ -0,0 +1,47 @@
+import os
+import time
+import logging
+from typing import Literal
+from fastapi import APIRouter, Depends, HTTPException, Query, Response, Security
+from fastapi.security import HTTPBasicCredentials
+from config.config import get_settings, Settings
+from handlers.db_handlers import verify_credentials
+from helpers.profiler import Profiler, ProfilerBusyError
+
+log = logging.getLogger(__name__)
+admin_router = APIRouter()
+
+
+@admin_router.get("/admin/profile", include_in_schema=False)
+async def profile(seconds: int = Query(10, ge=1),
+                  mode: Literal["sample", "cprofile"] = Query("sample"),
+                  credentials: HTTPBasicCredentials = Security(verify_credentials),
+                  settings: Settings = Depends(get_settings)) -> Response:
+    """
+    Profiles the event loop of the worker that receives the request for `seconds` seconds.
+
+    Args:
+        seconds (int): Duration, at most PROFILE_MAX_SECONDS.
+        mode (str): 'sample' returns collapsed stacks (flamegraph.pl, speedscope);
+            'cprofile' returns a pstats file (python -m pstats, snakeviz).
+        credentials (HTTPBasicCredentials): Security credentials, checked by verify_credentials.
+    Returns:
+        Response: The profile as a file attachment; the X-Worker-Pid header names the profiled worker.
+    Raises:
+        HTTPException: 422 if seconds exceeds PROFILE_MAX_SECONDS, 409 if a profile is already running.
+    """
+    if seconds > settings.PROFILE_MAX_SECONDS:
+        raise HTTPException(status_code=422, detail=f"seconds must be at most {settings.PROFILE_MAX_SECONDS}")
+    name = f"profile-{os.getpid()}-{int(time.time())}"
+    log.info("Profiling worker %s for %ss (%s)", os.getpid(), seconds, mode)
+    try:
+        if mode == "sample":
+            body = (await Profiler.sample(seconds, settings.PROFILE_SAMPLE_INTERVAL)).encode()
+            media_type, name = "text/plain", f"{name}.collapsed"
+        else:
+            body = await Profiler.cprofile(seconds)
+            media_type, name = "application/octet-stream", f"{name}.pstats"
+    except ProfilerBusyError as e:
+        raise HTTPException(status_code=409, detail=e.message)
+    return Response(body, media_type=media_type,
+                    headers={"Content-Disposition": f'attachment; filename="{name}"', "X-Worker-Pid": str(os.getpid())})
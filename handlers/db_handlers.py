@@ -1,6 +1,9 @@
-import traceback
-from fastapi import APIRouter, Depends, Security
-from handlers.db_query_builder import execute_users_actions, execute_actions_count
+import secrets
+from datetime import timedelta
+from fastapi import APIRouter, Depends, Query, Request, Response, Security
+from handlers.db_query_builder import (execute_users_actions, execute_actions_count, select_top_cities,
+                                       select_command_mix, select_active_users, select_error_rate)
+from helpers.analytics import ResponseCache, utc_today
 import logging
 from asyncpg import Pool
 from postgres.pool import DbPool
@@ -26,17 +29,17 @@ def verify_credentials(credentials: HTTPBasicCredentials = Depends(security),
     Raises:
         HTTPException: If the credentials are incorrect.
     """
-    try:
-        correct_username = settings.GET_USER
-        correct_password = settings.GET_PASSWORD
-        # Check if the provided credentials match the correct username and password
-        if credentials.username == correct_username and credentials.password == correct_password:
-            log.info("Credentials verified successfully")
-            return credentials
-    except HTTPException as e:
-        log.debug("An error occurred: %s", str(e))
-        log.debug("Exception traceback", traceback.format_exc())
-        raise HTTPException(status_code=401, detail="Incorrect username or password")
+    correct_username = settings.GET_USER
+    correct_password = settings.GET_PASSWORD
+    # Check if the provided credentials match the correct username and password, in constant time
+    username_ok = secrets.compare_digest(credentials.username.encode(), correct_username.encode())
+    password_ok = secrets.compare_digest(credentials.password.encode(), correct_password.encode())
+    if username_ok and password_ok:
+        log.info("Credentials verified successfully")
+        return credentials
+    log.warning("Incorrect credentials for user %s", credentials.username)
+    raise HTTPException(status_code=401, detail="Incorrect username or password",
+                        headers={"WWW-Authenticate": "Basic"})
 
 
 @bd_router.get("/users_actions")
@@ -66,7 +69,7 @@ async def ex_users_actions(chat_id: int = None,
         return res
     except Exception as e:
         log.error("An error occurred: %s", str(e))
-        log.debug(f"Exception traceback:\n{traceback.format_exc()}")
+        log.debug("Exception traceback", exc_info=True)
         raise HTTPException(status_code=500, detail="Internal Server Error")
 
 
@@ -93,5 +96,64 @@ async def get_actions_count(chat_id: int,
         return res
     except Exception as e:
         log.error("An error occurred: %s", str(e))
-        log.debug(f"Exception traceback:\n{traceback.format_exc()}")
+        log.debug("Exception traceback", exc_info=True)
+        raise HTTPException(status_code=500, detail="Internal Server Error")
+
+
+@bd_router.get("/analytics/top_cities")
+async def analytics_top_cities(request: Request,
+                               days: int = Query(7, ge=1, le=90),
+                               limit: int = Query(10, ge=1, le=100),
+                               credentials: HTTPBasicCredentials = Security(verify_credentials),
+                               pool: Pool = Depends(DbPool.get_pool)) -> Response:
+    """
+    Most requested cities over the last `days` days, including today.
+    Served from the analytics_daily aggregates through the response cache (see analytics_response).
+    """
+    since = utc_today() - timedelta(days=days - 1)
+    return await analytics_response(request, ("top_cities", since, limit),
+                                    lambda: select_top_cities(pool, since, limit))
+
+
+@bd_router.get("/analytics/commands")
+async def analytics_commands(request: Request,
+                             days: int = Query(7, ge=1, le=90),
+                             credentials: HTTPBasicCredentials = Security(verify_credentials),
+                             pool: Pool = Depends(DbPool.get_pool)) -> Response:
+    """Number of requests of every command over the last `days` days, including today."""
+    since = utc_today() - timedelta(days=days - 1)
+    return await analytics_response(request, ("commands", since), lambda: select_command_mix(pool, since))
+
+
+@bd_router.get("/analytics/active_users")
+async def analytics_active_users(request: Request,
+                                 credentials: HTTPBasicCredentials = Security(verify_credentials),
+                                 pool: Pool = Depends(DbPool.get_pool)) -> Response:
+    """Daily (today, UTC) and weekly (last 7 days) active chats: {"dau": ..., "wau": ...}."""
+    today = utc_today()
+    return await analytics_response(request, ("active_users", today), lambda: select_active_users(pool, today))
+
+
+@bd_router.get("/analytics/error_rate")
+async def analytics_error_rate(request: Request,
+                               days: int = Query(1, ge=1, le=90),
+                               credentials: HTTPBasicCredentials = Security(verify_credentials),
+                               pool: Pool = Depends(DbPool.get_pool)) -> Response:
+    """Handled updates, errors by kind and the share of updates that failed over the last `days` days."""
+    since = utc_today() - timedelta(days=days - 1)
+    return await analytics_response(request, ("error_rate", since), lambda: select_error_rate(pool, since))
+
+
+async def analytics_response(request: Request, key: tuple, loader) -> Response:
+    """
+    Answers an analytics route from the response cache.
+
+    Bodies are rebuilt at most every ANALYTICS_CACHE_TTL seconds and carry an ETag, so dashboards polling
+    with If-None-Match get 304 without touching Postgres.
+    """
+    try:
+        return await ResponseCache.respond(request, key, loader)
+    except Exception as e:
+        log.error("An error occurred: %s", str(e))
+        log.debug("Exception traceback", exc_info=True)
         raise HTTPException(status_code=500, detail="Internal Server Error")
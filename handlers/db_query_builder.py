@@ -3,7 +3,8 @@ from postgres.sqlfactory import SQLQueryBuilder
 from postgres.database_adapters import execute_query
 from asyncpg import Pool
 import logging
-import traceback
+from datetime import date, timedelta
+from typing import List
 
 log = logging.getLogger(__name__)
 
@@ -17,22 +18,25 @@ async def execute_users_actions(pool: Pool, chat_id: int = None, from_ts: int =
     conditions = {}
     if chat_id is not None:
         conditions["chat_id"] = ("=", chat_id)
+    ts_range = []
     if from_ts is not None:
-        conditions["ts"] = (">", from_ts)
+        ts_range.append((">", from_ts))
     if until_ts is not None:
-        conditions["ts"] = ("<", until_ts)
+        ts_range.append(("<", until_ts))
+    if ts_range:
+        conditions["ts"] = ts_range
     try:
         builder = SQLQueryBuilder("statistic")
         builder.select().where(conditions).order_by("ts", "DESC").limit(limits)
     except Exception as e:
         log.error("execute_users_actions: An error occurred: %s", str(e))
-        log.debug(f"execute_users_actions: Exception traceback: \n {traceback.format_exc()}")
+        log.debug("execute_users_actions: Exception traceback", exc_info=True)
         raise
     try:
         res = await execute_query(pool, builder.sql, *builder.args, fetch=True)
     except Exception as e:
         log.error("execute_users_actions:An error occurred: %s", str(e))
-        log.debug(f"execute_users_actions: Exception traceback: \n {traceback.format_exc()}")
+        log.debug("execute_users_actions: Exception traceback", exc_info=True)
         raise
 
     return res
@@ -40,19 +44,75 @@ async def execute_users_actions(pool: Pool, chat_id: int = None, from_ts: int =
 
 @log_database_query
 async def execute_actions_count(pool: Pool, chat_id: int):
-    """ SELECT chat_id, DATE_TRUNC('month', to_timestamp(ts)) AS month, COUNT(*) AS actions_count FROM statistic
+    """ SELECT chat_id, month, SUM(actions) AS actions_count FROM (statistic UNION ALL statistic_daily) AS actions
     WHERE chat_id = $1 GROUP BY chat_id, month
+    Rows moved to statistic_daily by the retention job are still counted.
     """
     try:
         fields_select = [
             "chat_id",
-            "DATE_TRUNC('month', to_timestamp(ts)) AS month",
-            "COUNT(*) AS actions_count"
+            "month",
+            "SUM(actions) AS actions_count"
         ]
-        bilder = SQLQueryBuilder("statistic")
+        actions = ("(SELECT chat_id, DATE_TRUNC('month', to_timestamp(ts)) AS month, 1 AS actions FROM statistic "
+                   "UNION ALL SELECT chat_id, DATE_TRUNC('month', day::timestamptz) AS month, count AS actions "
+                   "FROM statistic_daily) AS actions")
+        bilder = SQLQueryBuilder(actions)
         bilder.select(fields_select).where({"chat_id": ("=", chat_id)}).group_by(["chat_id", "month"])
         res = await execute_query(pool, bilder.sql, *bilder.args, fetch=True)
         return res
     except Exception as e:
         log.error("An error occurred: %s", str(e))
-        log.debug(f"Exception traceback:\n{traceback.format_exc()}")
+        log.debug("Exception traceback", exc_info=True)
+
+
+@log_database_query
+async def select_top_cities(pool: Pool, since: date, limit: int) -> List[dict]:
+    """ Most requested cities since a day, from analytics_daily; canonical ids are shown with their names. """
+    sql = """
+        SELECT COALESCE(locations.name || ', ' || locations.country, analytics_daily.key) AS city,
+               SUM(analytics_daily.count) AS requests
+        FROM analytics_daily
+        LEFT JOIN locations ON analytics_daily.key = 'id:' || locations.id
+        WHERE analytics_daily.metric = 'city' AND analytics_daily.day >= $1
+        GROUP BY 1 ORDER BY requests DESC LIMIT $2
+    """
+    res = await execute_query(pool, sql, since, limit, fetch=True)
+    return [dict(r) for r in res or []]
+
+
+@log_database_query
+async def select_command_mix(pool: Pool, since: date) -> List[dict]:
+    """ SELECT key AS command, SUM(count) AS requests FROM analytics_daily
+    WHERE metric = 'command' AND day >= $1 GROUP BY key
+    """
+    builder = SQLQueryBuilder("analytics_daily")
+    builder.select(["key AS command", "SUM(count) AS requests"]).where(
+        {"metric": ("=", "command"), "day": (">=", since)}).group_by(["key"]).order_by("requests", "DESC")
+    res = await execute_query(pool, builder.sql, *builder.args, fetch=True)
+    return [dict(r) for r in res or []]
+
+
+@log_database_query
+async def select_active_users(pool: Pool, today: date) -> dict:
+    """ Distinct chats active today (DAU) and in the last 7 days including today (WAU), from chat_days. """
+    sql = """
+        SELECT COUNT(DISTINCT chat_id) FILTER (WHERE day = $1) AS dau, COUNT(DISTINCT chat_id) AS wau
+        FROM chat_days WHERE day > $2
+    """
+    res = await execute_query(pool, sql, today, today - timedelta(days=7), fetchrow=True)
+    return dict(res) if res else {}
+
+
+@log_database_query
+async def select_error_rate(pool: Pool, since: date) -> dict:
+    """ Handled updates and errors by kind since a day, from analytics_daily. """
+    sql = """
+        SELECT metric, key, SUM(count) AS count FROM analytics_daily
+        WHERE metric IN ('updates', 'errors') AND day >= $1 GROUP BY metric, key
+    """
+    res = await execute_query(pool, sql, since, fetch=True) or []
+    updates = sum(r["count"] for r in res if r["metric"] == "updates")
+    errors = {r["key"]: r["count"] for r in res if r["metric"] == "errors"}
+    return {"updates": updates, "errors": errors,
+            "error_rate": round(sum(errors.values()) / updates, 4) if updates else 0.0}
@@ -0,0 +1,33 @@
+from fastapi import APIRouter, HTTPException
+
+from helpers.http_client import HttpSession
+from postgres.pool import DbPool
+
+health_router = APIRouter()
+
+
+class Readiness:
+    _started: bool = False
+
+    @classmethod
+    def mark_started(cls) -> None:
+        cls._started = True
+
+    @classmethod
+    def is_ready(cls) -> bool:
+        """True once startup finished and the database pool and HTTP session are open."""
+        try:
+            HttpSession.get_session()
+        except Exception:
+            return False
+        return cls._started and DbPool._db_pool is not None and not DbPool._db_pool.is_closing()
+
+
+@health_router.get("/ready", include_in_schema=False)
+async def ready():
+    """
+    Readiness probe: 200 once startup finished and the database pool and HTTP session are warm, 503 before.
+    """
+    if not Readiness.is_ready():
+        raise HTTPException(status_code=503, detail="Not ready")
+    return {"status": "ready"}
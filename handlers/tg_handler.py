@@ -1,16 +1,21 @@
 import logging
-import traceback
 from telebot.async_telebot import AsyncTeleBot
 from asyncpg.pool import Pool
 from config.config import get_settings, Settings, get_bot
-import json
-from helpers.model_message import Message
-from helpers.check_values import check_chat_id, check_waiting, handlers
+from helpers.model_message import decode_update
+from helpers.check_values import check_chat_id, check_waiting, handlers, callback_handlers
+from helpers.activity import ActivityTracker
+from helpers.logging_pipeline import bind_log_context
+from helpers.analytics import Analytics
+from helpers.rate_limit import ChatRateLimiter, ALLOWED, LIMITED, RATE_LIMITED_TEXT
+from bot.actions import set_location
 from pydantic import ValidationError
 from typing import Annotated
 from fastapi import Request, HTTPException, Depends, APIRouter
+from fastapi.responses import JSONResponse
+from postgres.database_adapters import unit_of_work
 from postgres.pool import DbPool
-from prometheus.couters import instance_id, count_instance_errors, validation_error
+from prometheus.couters import instance_id, count_instance_errors, validation_error, unsupported_update_counter
 
 log = logging.getLogger(__name__)
 
@@ -34,14 +39,22 @@ async def tg_webhooks(request: Request, config: Annotated[Settings, Depends(get_
 
     This function handles incoming Telegram webhook requests and processes the received message.
     It first validates the `X-Telegram-Bot-Api-Secret-Token` header to ensure that the request is authorized.
-    If the token is valid, it checks if the request method is `POST`. If it is, it parses the request body as JSON.
-    It then creates a `Message` object from the JSON data and checks the chat ID.
+    If the token is valid, it checks if the request method is `POST`. If it is, it decodes the request body
+    into an `Update` object in a single pass. Updates without a text or location message or an inline
+    button press are acknowledged and skipped before any database or upstream work. A button press is handled
+    as a message whose text is the callback data. The chat's last-seen time is recorded in memory
+    for users_online. Then the per-chat rate limiter is checked: a chat over
+    its limit gets a short reply in the webhook response (or nothing, if it got one recently).
+    Otherwise it checks the chat ID. State changes and statistic records made while the update is handled
+    are collected in a unit of work and written with one statement when handling finishes.
+    A button press is answered by `callback_handlers`, and the webhook response acknowledges it.
+    A shared location is stored as the user's city via `set_location`.
     If the user is waiting for a value to be entered, it calls the `check_waiting` function.
     Otherwise, it calls the `handlers` function to process the message.
     If any exceptions occur during processing, it logs the error and sends a Telegram message with an error message.
     If the request method is not `POST`, it returns an HTTPException with a 405 status code.
     If the `X-Telegram-Bot-Api-Secret-Token` is invalid, it returns an HTTPException with a 401 status code.
-    If there is a JSON decoding error or validation error, it returns an HTTPException with a 400 status code.
+    If the body is not valid JSON or fails validation, it returns an HTTPException with a 400 status code.
     """
     # Get X-Telegram-Bot-Api-Secret-Token from headers
     x_telegram_bot_api_secret_token = request.headers.get('X-Telegram-Bot-Api-Secret-Token')
@@ -49,42 +62,62 @@ async def tg_webhooks(request: Request, config: Annotated[Settings, Depends(get_
     if x_telegram_bot_api_secret_token == config.SECRET_TOKEN_TG_WEBHOOK:
         if request.method == 'POST':
             try:
-                json_dict = await request.json()
-
-            except json.JSONDecodeError:
-                log.error("Telegram webhook request body: JSONDecodeError")
-                log.debug("Exception traceback", traceback.format_exc())
-                raise HTTPException(status_code=400,
-                                    detail="JSONDecodeError: An error occurred, please try again later")
-            try:
-                # Adjust JSON data and create a Message object
-                json_dict['message']['from_user'] = json_dict['message'].pop('from')
-                message = Message(**json_dict['message'])
+                # Decode the raw body straight into a typed Update
+                update = decode_update(await request.body())
             except ValidationError:
-                log.error("ValidationError occurred Message")
-                log.debug(traceback.format_exc())
+                log.error("ValidationError occurred Update")
+                log.debug("Exception traceback", exc_info=True)
                 validation_error.labels(instance=instance_id).inc(0)
                 raise HTTPException(status_code=400,
                                     detail="ValidationError: An error occurred, please try again later")
+            if not update.is_supported:
+                # Acknowledge updates we do not handle so Telegram does not redeliver them
+                log.debug("Skipping unsupported update %s", update.update_id)
+                unsupported_update_counter.labels(instance=instance_id).inc()
+                return
+            callback = update.callback_query
+            message = update.message if callback is None else callback.as_message()
+            bind_log_context(str(update.update_id), message.chat.id)  # trace_id and chat_id of every record below
+            ActivityTracker.touch(message.chat.id, message.date)
+            verdict = ChatRateLimiter.acquire(message)
+            if verdict != ALLOWED:
+                # The reply rides on the webhook response, so flooding costs no Bot API call either
+                if callback is not None:
+                    return JSONResponse({"method": "answerCallbackQuery", "callback_query_id": callback.id,
+                                         "text": RATE_LIMITED_TEXT if verdict == LIMITED else ""})
+                if verdict == LIMITED:
+                    return JSONResponse({"method": "sendMessage", "chat_id": message.chat.id,
+                                         "text": RATE_LIMITED_TEXT})
+                return
             try:
-                # Check the chat ID and process the message accordingly
-                status_user = await check_chat_id(pool, message)
-                # Check if user is waiting for a value to be entered
-                if "waiting_value" in status_user.values():
-                    await check_waiting(status_user, pool, message, bot,
-                                        config)  # Check if user is waiting for a value to be entered
-                else:
-                    await handlers(pool, message, bot, config,
-                                   status_user)  # Process the message if user is not waiting for a value to be entered
+                # Writes to user_state and statistic made while handling go out in one statement at the end
+                async with unit_of_work(pool):
+                    # Check the chat ID and process the message accordingly
+                    status_user = await check_chat_id(pool, message)
+                    Analytics.record_update(message, status_user)
+                    if callback is not None:
+                        # A button press carries its parameters; answering it also stops the button's spinner
+                        await callback_handlers(pool, message, bot, config, status_user)
+                        return JSONResponse({"method": "answerCallbackQuery", "callback_query_id": callback.id})
+                    if message.location is not None:
+                        await set_location(pool, message, bot, config)  # A shared position replaces the city
+                    # Check if user is waiting for a value to be entered
+                    elif "waiting_value" in status_user.values():
+                        await check_waiting(status_user, pool, message, bot,
+                                            config)  # Check if user is waiting for a value to be entered
+                    else:
+                        await handlers(pool, message, bot, config,
+                                       status_user)  # Process the message if user is not waiting for a value to be entered
             except Exception as exc:
                 log.error("An error occurred: %s", str(exc))
-                log.debug("Exception traceback", traceback.format_exc())
+                log.debug("Exception traceback", exc_info=True)
                 count_instance_errors.labels(instance=instance_id).inc()
+                Analytics.record_error("handler")
                 return bot.send_message(message.chat.id, "An error occurred, please try again later")
         else:
-            log.error(f"Invalid request method: {request.method}")
-            log.debug("Exception traceback", traceback.format_exc())
+            log.error("Invalid request method: %s", request.method)
+            log.debug("Exception traceback", exc_info=True)
             return HTTPException(status_code=405, detail="Method not allowed")
     else:
-        log.error(f"Invalid X-Telegram-Bot-Api-Secret-Token: {x_telegram_bot_api_secret_token}")
+        log.error("Invalid X-Telegram-Bot-Api-Secret-Token: %s", x_telegram_bot_api_secret_token)
         return HTTPException(status_code=401, detail="Unauthorized")
@@ -0,0 +1,42 @@
+import logging
+import time
+from typing import Dict
+
+from config.config import get_settings
+from postgres.database_adapters import upsert_users_online, count_users_online
+from postgres.pool import DbPool
+from prometheus.couters import instance_id, active_users
+
+log = logging.getLogger(__name__)
+
+
+class ActivityTracker:
+    """
+    Last-seen time of every chat, collected in memory and written to users_online in batches.
+
+    Webhook updates only touch a dict; every ACTIVITY_FLUSH_INTERVAL seconds the chats seen since
+    the previous flush are stored with one multi-row upsert, instead of one write per update.
+    """
+    _last_seen: Dict[int, int] = {}
+
+    @classmethod
+    def touch(cls, chat_id: int, timestamp: int) -> None:
+        if timestamp > cls._last_seen.get(chat_id, 0):
+            cls._last_seen[chat_id] = timestamp
+
+    @classmethod
+    async def flush(cls) -> None:
+        """Stores the pending timestamps and refreshes the active_users gauge from the shared table."""
+        pool = await DbPool.get_pool()
+        pending, cls._last_seen = cls._last_seen, {}
+        if pending:
+            try:
+                await upsert_users_online(pool, pending)
+            except Exception:
+                for chat_id, timestamp in pending.items():
+                    cls.touch(chat_id, timestamp)  # retried on the next flush
+                raise
+            log.debug("users_online: %s chats flushed", len(pending))
+        count = await count_users_online(pool, int(time.time()) - get_settings().ACTIVE_USERS_WINDOW)
+        if count is not None:
+            active_users.labels(instance=instance_id).set(count)
@@ -0,0 +1,108 @@
+import asyncio
+import hashlib
+import json
+import logging
+import time
+from collections import Counter
+from datetime import date, datetime, timezone
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional, Set, Tuple
+
+from fastapi import Request, Response
+
+from config.config import get_settings
+from helpers.model_message import Message
+from postgres.database_adapters import VALID_COMMANDS, add_analytics
+from postgres.pool import DbPool
+
+log = logging.getLogger(__name__)
+
+# Commands that read weather for the user's city; they feed the top cities
+WEATHER_COMMANDS = {"/current_weather", "/weather_forecast", "/forecast_for_several_days",
+                    "/weather_statistic", "/prediction", "/hourly"}
+
+
+def utc_today() -> date:
+    return datetime.now(timezone.utc).date()
+
+
+class Analytics:
+    """
+    Daily analytics aggregates, counted in memory as updates are handled.
+
+    Every ANALYTICS_FLUSH_INTERVAL seconds the counts are added to analytics_daily and the active chats
+    to chat_days, so the analytics routes read small pre-aggregated tables instead of scanning
+    statistic and user_state.
+    """
+    _counts: Counter = Counter()
+    _chat_days: Set[Tuple[date, int]] = set()
+
+    @classmethod
+    def record_update(cls, message: Message, status_user: Optional[dict]) -> None:
+        day = utc_today()
+        cls._counts[(day, "updates", "total")] += 1
+        cls._chat_days.add((day, message.chat.id))
+        if message.text not in VALID_COMMANDS:
+            return
+        cls._counts[(day, "command", message.text)] += 1
+        city = (status_user or {}).get("city")
+        if message.text in WEATHER_COMMANDS and city and city != "None":
+            cls._counts[(day, "city", city.strip().lower()[:100])] += 1
+
+    @classmethod
+    def record_error(cls, kind: str) -> None:
+        cls._counts[(utc_today(), "errors", kind)] += 1
+
+    @classmethod
+    async def flush(cls) -> None:
+        counts, chat_days = cls._counts, cls._chat_days
+        cls._counts, cls._chat_days = Counter(), set()
+        if not counts and not chat_days:
+            return
+        try:
+            await add_analytics(await DbPool.get_pool(), dict(counts), chat_days)
+        except Exception:
+            cls._counts.update(counts)  # added on the next flush
+            cls._chat_days |= chat_days
+            raise
+        log.debug("analytics: %s counters and %s active chats flushed", len(counts), len(chat_days))
+
+
+class ResponseCache:
+    """
+    Short-lived cache of JSON responses of the analytics routes, with ETag support.
+
+    A body is built at most once per ANALYTICS_CACHE_TTL seconds and key, even when several requests
+    miss at the same time; a client sending the current ETag in If-None-Match gets 304 without a body.
+    """
+    # key -> (expires at (monotonic), body, etag)
+    _entries: Dict[Hashable, Tuple[float, bytes, str]] = {}
+    _loading: Dict[Hashable, "asyncio.Task[Tuple[float, bytes, str]]"] = {}
+
+    @classmethod
+    async def respond(cls, request: Request, key: Hashable, loader: Callable[[], Awaitable[Any]]) -> Response:
+        ttl = get_settings().ANALYTICS_CACHE_TTL
+        entry = cls._entries.get(key)
+        if entry is None or entry[0] <= time.monotonic():
+            task = cls._loading.get(key)
+            if task is None:
+                task = cls._loading[key] = asyncio.create_task(cls._load(key, loader, ttl))
+            try:
+                entry = await asyncio.shield(task)
+            finally:
+                cls._loading.pop(key, None)
+        _, body, etag = entry
+        headers = {"ETag": etag, "Cache-Control": f"private, max-age={ttl}"}
+        if request.headers.get("if-none-match") == etag:
+            return Response(status_code=304, headers=headers)
+        return Response(body, media_type="application/json", headers=headers)
+
+    @classmethod
+    async def _load(cls, key: Hashable, loader: Callable[[], Awaitable[Any]],
+                    ttl: float) -> Tuple[float, bytes, str]:
+        body = json.dumps(await loader(), default=str, separators=(",", ":")).encode()
+        entry = (time.monotonic() + ttl, body, f'"{hashlib.sha1(body).hexdigest()[:16]}"')
+        now = time.monotonic()
+        for stale in [k for k, (expires_at, _, _) in cls._entries.items() if expires_at <= now]:
+            del cls._entries[stale]
+        cls._entries[key] = entry
+        return entry
@@ -0,0 +1,65 @@
+import asyncio
+import logging
+from typing import Awaitable, Callable, Coroutine, List
+
+from prometheus.couters import instance_id, count_instance_errors
+
+log = logging.getLogger(__name__)
+
+_tasks: List[asyncio.Task] = []
+
+
+async def _run_periodic(name: str, interval: float, func: Callable[[], Awaitable[None]]) -> None:
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await func()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            count_instance_errors.labels(instance=instance_id).inc()
+            log.error("Background task %s failed: %s", name, str(e))
+            log.debug("Exception traceback", exc_info=True)
+
+
+def start_periodic(name: str, interval: float, func: Callable[[], Awaitable[None]]) -> None:
+    """
+    Runs func every interval seconds on the event loop until stop_background_tasks is called.
+    A failing run is logged and counted, the next run still happens.
+    """
+    _tasks.append(asyncio.create_task(_run_periodic(name, interval, func), name=name))
+    log.info("Background task %s started (every %ss)", name, interval)
+
+
+def run_once(name: str, coro: Coroutine) -> None:
+    """
+    Runs coro on the event loop without awaiting it; the task is cancelled by stop_background_tasks.
+    A failure is logged and counted.
+    """
+    task = asyncio.create_task(_run_once(name, coro), name=name)
+    _tasks.append(task)
+    task.add_done_callback(_forget)
+
+
+async def _run_once(name: str, coro: Coroutine) -> None:
+    try:
+        await coro
+    except asyncio.CancelledError:
+        raise
+    except Exception as e:
+        count_instance_errors.labels(instance=instance_id).inc()
+        log.error("Background task %s failed: %s", name, str(e))
+        log.debug("Exception traceback", exc_info=True)
+
+
+def _forget(task: asyncio.Task) -> None:
+    if task in _tasks:
+        _tasks.remove(task)
+
+
+async def stop_background_tasks() -> None:
+    """Cancels every background task and waits for them to finish."""
+    for task in _tasks:
+        task.cancel()
+    await asyncio.gather(*list(_tasks), return_exceptions=True)
+    _tasks.clear()
@@ -1,15 +1,18 @@
+from datetime import date
+
 from bot.actions import (add_city, start_message, change_city, weather, weather_forecast,
-                         help_message, add_day, forecast_for_several_days, get_forecast_several, statistic, prediction)
+                         help_message, add_day, forecast_for_several_days, get_forecast_several, statistic, prediction,
+                         subscribe, add_subscription, unsubscribe, forecast_for_date, forecast_several, hourly,
+                         add_favorite_city, my_cities, remove_favorite_city)
+from bot.keyboards import FORECAST_DAY, FORECAST_DAYS, HOURLY, FAVORITE_REMOVE, parse_callback
 from config.config import Settings
 from telebot.async_telebot import AsyncTeleBot
 import logging
-import traceback
 from postgres.decorators import log_database_query
 from helpers.model_message import Message
-from postgres.database_adapters import execute_query, add_statistic_bd, sql_update_user_state_bd
+from postgres.database_adapters import add_statistic_bd, sql_update_user_state_bd, select_or_create_user_state
 from asyncpg.pool import Pool
-from postgres.sqlfactory import SQLQueryBuilder
-from prometheus.couters import (unknown_command_counter, instance_id, count_instance_errors)
+from prometheus.couters import (unknown_command_counter, instance_id, count_instance_errors, count_user_errors)
 
 log = logging.getLogger(__name__)
 
@@ -17,7 +20,8 @@ log = logging.getLogger(__name__)
 @log_database_query
 async def check_chat_id(pool: Pool, message: Message) -> dict:
     """
-     Checks the chat_id in the user_state table, inserts if not present, and retrieves the data.
+     Checks the chat_id in the user_state table, inserts if not present, and retrieves the data,
+     in one query.
      Args:
          pool (Pool): The asyncpg Pool.
          message: The message object containing chat information.
@@ -30,25 +34,17 @@ async def check_chat_id(pool: Pool, message: Message) -> dict:
             "city": "Moskva",
             "date_difference": "None",
             "qty_days": "None",
+            "subscribe_time": "None",
+            "favorites": [],
         }
 
-        on_conflict = "chat_id"
-        bulder = SQLQueryBuilder("user_state")
-        bulder.insert(fields, on_conflict=on_conflict)
-        sql, args = bulder.build()
-        await execute_query(pool, sql, *args, fetch=True)
-
-        builder1 = SQLQueryBuilder("user_state")
-        builder1.select(["city", "date_difference", "qty_days"]).where({"chat_id": ("=", message.chat.id)})
-        sql1, args1 = builder1.build()
-        res = await execute_query(pool, sql1, *args1, fetch=True)
-        decoded_result = [dict(r) for r in res][0]
+        decoded_result = dict(await select_or_create_user_state(pool, fields))
         log.debug("user_state table updated successfully")
         return decoded_result
     except Exception as e:
         count_instance_errors.labels(instance=instance_id).inc()
         log.error("An error occurred: %s", str(e))
-        log.debug(f"Exception traceback: \n {traceback.format_exc()}")
+        log.debug("Exception traceback", exc_info=True)
 
 
 async def check_waiting(status_user: dict, pool, message, bot: AsyncTeleBot, config: Settings):
@@ -67,16 +63,19 @@ async def check_waiting(status_user: dict, pool, message, bot: AsyncTeleBot, con
         if status_user["city"] == "waiting_value":
             await add_city(pool, message, bot, config)
         if status_user["date_difference"] == "waiting_value":
-            await add_day(pool, message, bot, config, status_user)
+            await add_day(message, bot, config, status_user)
             await sql_update_user_state_bd(bot, pool, message, "date_difference", "None")
         if status_user["qty_days"] == "waiting_value":
             await get_forecast_several(message, bot, config, status_user)
             await sql_update_user_state_bd(bot, pool, message, "qty_days", "None")
+        if status_user["subscribe_time"] == "waiting_value":
+            await add_subscription(pool, message, bot, config, status_user)
+            await sql_update_user_state_bd(bot, pool, message, "subscribe_time", "None")
     except Exception as e:
         count_instance_errors.labels(instance=instance_id).inc()
         await bot.send_message(message.chat.id, 'An error occurred. Please try again later.')
         log.error("An error occurred: %s", str(e))
-        log.debug("Exception traceback", traceback.format_exc())
+        log.debug("Exception traceback", exc_info=True)
 
 
 async def handlers(pool: Pool, message: Message, bot: AsyncTeleBot, config: Settings, status_user: dict):
@@ -104,10 +103,19 @@ async def handlers(pool: Pool, message: Message, bot: AsyncTeleBot, config: Sett
             await weather(message, bot, config, status_user)
             await add_statistic_bd(pool, message)
         elif message.text == '/weather_forecast':
-            await weather_forecast(pool, message, bot)
+            await weather_forecast(message, bot)
             await add_statistic_bd(pool, message)
         elif message.text == '/forecast_for_several_days':
-            await forecast_for_several_days(pool, message, bot)
+            await forecast_for_several_days(message, bot)
+            await add_statistic_bd(pool, message)
+        elif message.text == '/hourly':
+            await hourly(message, bot, config, status_user)
+            await add_statistic_bd(pool, message)
+        elif message.text == '/add_favorite':
+            await add_favorite_city(pool, message, bot, config, status_user)
+            await add_statistic_bd(pool, message)
+        elif message.text == '/my_cities':
+            await my_cities(message, bot, config, status_user)
             await add_statistic_bd(pool, message)
         elif message.text == '/weather_statistic':
             await statistic(message, bot, config, status_user)
@@ -115,6 +123,12 @@ async def handlers(pool: Pool, message: Message, bot: AsyncTeleBot, config: Sett
         elif message.text == '/prediction':
             await prediction(message, bot, config, status_user)
             await add_statistic_bd(pool, message)
+        elif message.text == '/subscribe':
+            await subscribe(pool, message, bot)
+            await add_statistic_bd(pool, message)
+        elif message.text == '/unsubscribe':
+            await unsubscribe(pool, message, bot)
+            await add_statistic_bd(pool, message)
         else:
             unknown_command_counter.labels(instance=instance_id).inc()  # Count the number of unknown commands
             await bot.send_message(message.chat.id, 'Unknown command. Please try again\n/help')
@@ -123,4 +137,40 @@ async def handlers(pool: Pool, message: Message, bot: AsyncTeleBot, config: Sett
         await bot.send_message(message.chat.id,
                                'An error occurred. Please send administrators a message or contact support.')
         log.error("An error occurred: %s", str(e))
-        log.debug("Exception traceback", traceback.format_exc())
+        log.debug("Exception traceback", exc_info=True)
+
+
+async def callback_handlers(pool: Pool, message: Message, bot: AsyncTeleBot, config: Settings, status_user: dict):
+    """
+    This function answers a press on an inline keyboard button.
+    The callback data carries every parameter, so no conversation state is read or written;
+    only the remove buttons of /my_cities change the favorites.
+
+    Args:
+        pool: The asyncpg Pool.
+        message: The button press as a message (see CallbackQuery.as_message); its text is the callback data.
+        bot (AsyncTeleBot): The asynchronous Telegram bot instance.
+        config (Settings): The settings configuration.
+        status_user (dict): Dictionary containing user status information.
+    """
+    try:
+        prefix, value = parse_callback(message.text)
+        if prefix == FORECAST_DAY:
+            await forecast_for_date(date.fromisoformat(value), message, bot, config, status_user)
+        elif prefix == FORECAST_DAYS:
+            await forecast_several(int(value), message, bot, config, status_user)
+        elif prefix == HOURLY:
+            await hourly(message, bot, config, status_user, int(value))
+        elif prefix == FAVORITE_REMOVE:
+            await remove_favorite_city(pool, value, message, bot, config)
+        else:
+            unknown_command_counter.labels(instance=instance_id).inc()
+            log.debug("Unknown callback data: %s", message.text)
+    except ValueError:
+        count_user_errors.labels(instance=instance_id).inc()
+        log.error("Malformed callback data: %s", message.text)
+    except Exception as e:
+        count_instance_errors.labels(instance=instance_id).inc()
+        await bot.send_message(message.chat.id, 'An error occurred. Please try again later.')
+        log.error("An error occurred: %s", str(e))
+        log.debug("Exception traceback", exc_info=True)
@@ -0,0 +1,43 @@
+import aiohttp
+import logging
+from typing import Optional
+
+from config.config import get_settings, worker_share
+
+log = logging.getLogger(__name__)
+
+
+class UninitializedHttpSessionError(Exception):
+    def __init__(
+            self,
+            message="The HTTP client session has not been properly initialized.Please ensure setup is called",
+    ):
+        self.message = message
+        super().__init__(self.message)
+
+
+class HttpSession:
+    _session: Optional[aiohttp.ClientSession] = None
+
+    @classmethod
+    async def create_session(cls) -> None:
+        """
+        Creates the process-wide aiohttp session used for upstream API calls.
+        The connector limit is the worker's share of HTTP_MAX_CONNECTIONS.
+        """
+        limit = worker_share(get_settings().HTTP_MAX_CONNECTIONS)
+        cls._session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=limit))
+        log.info("HTTP client session created with %s connections", limit)
+
+    @classmethod
+    def get_session(cls) -> aiohttp.ClientSession:
+        if not cls._session:
+            raise UninitializedHttpSessionError()
+        return cls._session
+
+    @classmethod
+    async def close_session(cls) -> None:
+        if not cls._session:
+            raise UninitializedHttpSessionError()
+        await cls._session.close()
+        cls._session = None
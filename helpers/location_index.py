@@ -0,0 +1,147 @@
+import logging
+import time
+import unicodedata
+from bisect import bisect_left, insort
+from collections import OrderedDict
+from typing import List, NamedTuple, Optional, Tuple
+from urllib.parse import quote
+
+from asyncpg import Pool
+from telebot.async_telebot import AsyncTeleBot
+
+from config.config import Settings, get_settings
+from helpers.helpers import get_response, CITY_NOT_FOUND
+from postgres.database_adapters import (select_location_alias, select_locations, upsert_location,
+                                        upsert_location_alias)
+from prometheus.couters import instance_id, location_lookups
+
+log = logging.getLogger(__name__)
+
+
+class IndexedLocation(NamedTuple):
+    id: int
+    name: str
+    region: str
+    country: str
+    lat: float
+    lon: float
+
+    @property
+    def query(self) -> str:
+        """The canonical weatherapi q parameter; stored in user_state.city and used as the cache key."""
+        return f"id:{self.id}"
+
+    @property
+    def title(self) -> str:
+        return ", ".join(part for part in (self.name, self.region, self.country) if part)
+
+
+class Resolution(NamedTuple):
+    location: Optional[IndexedLocation]
+    not_found: bool  # True if weatherapi does not know the name, False on a hit or an upstream error
+
+
+def normalize_alias(text: str) -> str:
+    """Case-folds, strips accents and collapses whitespace: ' Zürich ' and 'zurich' give the same alias."""
+    decomposed = unicodedata.normalize("NFKD", text.casefold())
+    return " ".join("".join(c for c in decomposed if not unicodedata.combining(c)).split())
+
+
+class LocationIndex:
+    """
+    Canonical locations shared by every user.
+
+    Typed names are normalized and resolved through an in-memory LRU, then the location_aliases table,
+    and only then weatherapi search.json. Every search result is stored in the locations table, and
+    names weatherapi does not know are negative-cached for LOCATION_NEGATIVE_TTL.
+    A sorted list of normalized names serves prefix suggestions without touching the database.
+    """
+    _aliases: "OrderedDict[str, Tuple[Optional[IndexedLocation], int]]" = OrderedDict()
+    _names: List[Tuple[str, str]] = []
+
+    @classmethod
+    async def load(cls, pool: Pool) -> None:
+        """Fills the prefix index from the locations table."""
+        rows = await select_locations(pool, get_settings().LOCATION_INDEX_MAX_NAMES)
+        cls._names = sorted({(normalize_alias(row["name"]), IndexedLocation(**row).title) for row in rows})
+        log.info("Location index loaded: %s names", len(cls._names))
+
+    @classmethod
+    async def resolve(cls, pool: Pool, bot: AsyncTeleBot, config: Settings, text: str) -> Resolution:
+        alias = normalize_alias(text)
+        if not alias:
+            return Resolution(None, True)
+        now = int(time.time())
+
+        cached = cls._aliases.get(alias)
+        if cached and (cached[0] is not None or cached[1] > now):
+            cls._aliases.move_to_end(alias)
+            location_lookups.labels(instance=instance_id, source="memory").inc()
+            return Resolution(cached[0], cached[0] is None)
+
+        row = await select_location_alias(pool, alias)
+        if row and row["location_id"] is not None:
+            location = IndexedLocation(row["id"], row["name"], row["region"], row["country"], row["lat"], row["lon"])
+            cls._remember(alias, location, 0)
+            location_lookups.labels(instance=instance_id, source="database").inc()
+            return Resolution(location, False)
+        if row and row["expires_at"] > now:
+            cls._remember(alias, None, row["expires_at"])
+            location_lookups.labels(instance=instance_id, source="database").inc()
+            return Resolution(None, True)
+
+        location_lookups.labels(instance=instance_id, source="upstream").inc()
+        # Typed text is escaped: '&', '#', '?', '+' or '%' would otherwise add parameters or change q
+        url = f'http://api.weatherapi.com/v1/search.json?key={config.API_KEY}&q={quote(text.strip(), safe="")}'
+        # message=None: add_city owns the reply, get_response only logs
+        data = await get_response(None, url, bot)
+        if data is CITY_NOT_FOUND or data == []:
+            expires_at = now + config.LOCATION_NEGATIVE_TTL
+            cls._remember(alias, None, expires_at)
+            await upsert_location_alias(pool, alias, None, expires_at)
+            return Resolution(None, True)
+        if not data:
+            return Resolution(None, False)
+
+        matches = [IndexedLocation(item["id"], item["name"], item.get("region", ""), item.get("country", ""),
+                                   item["lat"], item["lon"]) for item in data]
+        for match in matches:
+            await upsert_location(pool, match._asdict())
+            cls._add_name(match)
+        location = matches[0]
+        for name in {alias, normalize_alias(location.name)}:
+            cls._remember(name, location, 0)
+            await upsert_location_alias(pool, name, location.id, None)
+        return Resolution(location, False)
+
+    @classmethod
+    def suggest(cls, text: str, limit: int = 5) -> List[str]:
+        """
+        Known locations sharing the longest prefix (at least 3 characters) with text.
+        """
+        alias = normalize_alias(text)
+        for size in range(len(alias), 2, -1):
+            prefix = alias[:size]
+            start = bisect_left(cls._names, (prefix,))
+            found = []
+            for name, title in cls._names[start:]:
+                if not name.startswith(prefix) or len(found) == limit:
+                    break
+                found.append(title)
+            if found:
+                return found
+        return []
+
+    @classmethod
+    def _remember(cls, alias: str, location: Optional[IndexedLocation], expires_at: int) -> None:
+        cls._aliases[alias] = (location, expires_at)
+        cls._aliases.move_to_end(alias)
+        while len(cls._aliases) > get_settings().LOCATION_ALIAS_CACHE_SIZE:
+            cls._aliases.popitem(last=False)
+
+    @classmethod
+    def _add_name(cls, location: IndexedLocation) -> None:
+        entry = (normalize_alias(location.name), location.title)
+        index = bisect_left(cls._names, entry)
+        if index == len(cls._names) or cls._names[index] != entry:
+            insort(cls._names, entry)
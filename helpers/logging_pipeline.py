@@ -0,0 +1,134 @@
+import json
+import logging
+import queue
+import sys
+import threading
+import time
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+from typing import Dict, List, Optional, Tuple
+
+trace_id_var: ContextVar[Optional[str]] = ContextVar("trace_id", default=None)
+chat_id_var: ContextVar[Optional[int]] = ContextVar("chat_id", default=None)
+
+TEXT_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+# uvicorn installs its own stderr handlers; they are routed through the queue as well
+UVICORN_LOGGERS = ("uvicorn", "uvicorn.error", "uvicorn.access")
+
+log = logging.getLogger(__name__)
+
+
+def bind_log_context(trace_id: Optional[str], chat_id: Optional[int] = None) -> None:
+    """Tags every record logged from now on in the current task (and the tasks it starts)."""
+    trace_id_var.set(trace_id)
+    chat_id_var.set(chat_id)
+
+
+class ContextQueueHandler(QueueHandler):
+    """
+    Puts records on the queue as they are, with the trace and chat ids of the logging task.
+
+    Unlike QueueHandler.prepare, the message and traceback are not formatted here but by the listener
+    thread, so the event loop only pays for an append.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record.trace_id = trace_id_var.get()
+        record.chat_id = chat_id_var.get()
+        return record
+
+
+class RateLimitFilter(logging.Filter):
+    """
+    Lets at most `limit` records of one message template through per `window` seconds.
+
+    The key is (logger, level, unformatted message), so an error repeated with different arguments counts
+    as one message. The first record let through after a suppression carries the number of dropped ones.
+    """
+
+    def __init__(self, limit: int, window: float):
+        super().__init__()
+        self.limit = limit
+        self.window = window
+        # key -> [window start, records in the window, records dropped]
+        self._keys: Dict[Tuple[str, int, str], List[float]] = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        key = (record.name, record.levelno, str(record.msg))
+        now = time.monotonic()
+        with self._lock:
+            state = self._keys.get(key)
+            if state is None or now - state[0] >= self.window:
+                if len(self._keys) > 10000:
+                    self._keys = {k: v for k, v in self._keys.items() if now - v[0] < self.window}
+                suppressed = int(state[2]) if state else 0
+                self._keys[key] = [now, 1, 0]
+                if suppressed:
+                    record.suppressed = suppressed
+                return True
+            if state[1] < self.limit:
+                state[1] += 1
+                return True
+            state[2] += 1
+            return False
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line, for the json stage of Promtail and `| json` in Loki."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname.lower(),
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for field in ("trace_id", "chat_id", "suppressed"):
+            value = getattr(record, field, None)
+            if value is not None:
+                entry[field] = value
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        if record.stack_info:
+            entry["stack"] = self.formatStack(record.stack_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class LogPipeline:
+    """
+    Root logging through a queue: the event loop enqueues records, a listener thread formats and writes them.
+    """
+    _listener: Optional[QueueListener] = None
+    _output: Optional[logging.Handler] = None
+
+    @classmethod
+    def configure(cls, log_level: str, log_format: str, rate_limit: int, rate_window: float) -> None:
+        cls.stop()
+        output = logging.StreamHandler(sys.stderr)
+        output.setFormatter(JsonFormatter() if log_format == "json" else logging.Formatter(TEXT_FORMAT))
+        records: queue.SimpleQueue = queue.SimpleQueue()
+        handler = ContextQueueHandler(records)
+        handler.addFilter(RateLimitFilter(rate_limit, rate_window))
+
+        root = logging.getLogger()
+        root.handlers = [handler]
+        root.setLevel(getattr(logging, log_level.upper()))
+        for name in UVICORN_LOGGERS:
+            logger = logging.getLogger(name)
+            logger.handlers = []
+            logger.propagate = True
+        cls._output = output
+        cls._listener = QueueListener(records, output)
+        cls._listener.start()
+        log.info("Logging configured: level %s, %s output", log_level.upper(), log_format)
+
+    @classmethod
+    def stop(cls) -> None:
+        """Writes out the queued records and stops the listener thread; later records are written directly."""
+        if cls._listener is not None:
+            cls._listener.stop()
+            logging.getLogger().handlers = [cls._output]
+            cls._listener = None
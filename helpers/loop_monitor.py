@@ -0,0 +1,69 @@
+import asyncio
+import logging
+import sys
+import threading
+import time
+import traceback
+from typing import Optional
+
+from config.config import get_settings
+from helpers.background import start_periodic
+from prometheus.couters import instance_id, event_loop_lag, event_loop_tasks, event_loop_stalls
+
+log = logging.getLogger(__name__)
+
+
+class LoopMonitor:
+    """
+    Event loop health: lag, task count and the stack of anything that blocks the loop.
+
+    A periodic task measures how late its timer fires (event_loop_lag_seconds) and counts the live tasks.
+    A watchdog thread, which keeps running while the loop is blocked, logs the loop thread's stack once
+    per stall longer than LOOP_STALL_THRESHOLD, so the blocking call is named while it is still running.
+    """
+    _heartbeat: float = 0.0
+    _loop_thread: Optional[int] = None
+    _stop: Optional[threading.Event] = None
+    _watchdog: Optional[threading.Thread] = None
+
+    @classmethod
+    def start(cls) -> None:
+        settings = get_settings()
+        cls._loop_thread = threading.get_ident()
+        cls._heartbeat = time.monotonic()
+        start_periodic("loop_monitor", settings.LOOP_MONITOR_INTERVAL, cls._tick)
+        cls._stop = threading.Event()
+        cls._watchdog = threading.Thread(target=cls._watch, name="loop-watchdog", daemon=True,
+                                         args=(cls._stop, settings.LOOP_MONITOR_INTERVAL,
+                                               settings.LOOP_STALL_THRESHOLD))
+        cls._watchdog.start()
+
+    @classmethod
+    def stop(cls) -> None:
+        """Stops the watchdog thread; the periodic task is cancelled with the other background tasks."""
+        if cls._stop is not None:
+            cls._stop.set()
+            cls._watchdog.join()
+            cls._stop = cls._watchdog = None
+
+    @classmethod
+    async def _tick(cls) -> None:
+        now = time.monotonic()
+        interval = get_settings().LOOP_MONITOR_INTERVAL
+        event_loop_lag.labels(instance=instance_id).observe(max(now - cls._heartbeat - interval, 0.0))
+        event_loop_tasks.labels(instance=instance_id).set(len(asyncio.all_tasks()))
+        cls._heartbeat = now
+
+    @classmethod
+    def _watch(cls, stop: threading.Event, interval: float, threshold: float) -> None:
+        reported = None
+        while not stop.wait(threshold / 2):
+            heartbeat = cls._heartbeat
+            blocked = time.monotonic() - heartbeat - interval
+            if blocked <= threshold or heartbeat == reported:
+                continue
+            reported = heartbeat
+            event_loop_stalls.labels(instance=instance_id).inc()
+            frame = sys._current_frames().get(cls._loop_thread)
+            stack = "".join(traceback.format_stack(frame)) if frame is not None else "unavailable\n"
+            log.warning("Event loop blocked for %.2fs, loop thread stack:\n%s", blocked, stack)
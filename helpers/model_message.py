@@ -1,13 +1,18 @@
-from pydantic import BaseModel
+import time
+
+from pydantic import BaseModel, ConfigDict, Field
 from typing import Optional
 
+# Update types the bot handles; passed to setWebhook so Telegram does not deliver anything else
+ALLOWED_UPDATES = ["message", "callback_query"]
+
 
 class User(BaseModel):
     id: int
     is_bot: bool
     first_name: str
-    username: str
-    language_code: str
+    username: Optional[str] = None
+    language_code: Optional[str] = None
 
 
 class Chat(BaseModel):
@@ -26,15 +31,65 @@ class Location(BaseModel):
 #     type: str
 
 class Message(BaseModel):
+    model_config = ConfigDict(populate_by_name=True)
+
     message_id: int
-    from_user: User
+    from_user: User = Field(alias="from")
     chat: Chat
     date: int
-    text: str
+    text: Optional[str] = None
     location: Optional[Location] = None
 
-#
-#
-# class UpdateMessage(BaseModel):
-#     update_id: int
-#     message: Message
+
+class KeyboardMessage(BaseModel):
+    """The message an inline keyboard is attached to; only the fields that are also sent for inaccessible ones."""
+    message_id: int
+    chat: Chat
+    date: int
+
+
+class CallbackQuery(BaseModel):
+    model_config = ConfigDict(populate_by_name=True)
+
+    id: str
+    from_user: User = Field(alias="from")
+    message: Optional[KeyboardMessage] = None
+    data: Optional[str] = None
+
+    def as_message(self) -> Message:
+        """
+        The button press as a message from the user who pressed it, in the chat of the keyboard;
+        the text is the callback data, so rate limiting and analytics treat it like any other update.
+        """
+        return Message(message_id=self.message.message_id, from_user=self.from_user, chat=self.message.chat,
+                       date=int(time.time()), text=self.data)
+
+
+class Update(BaseModel):
+    update_id: int
+    message: Optional[Message] = None
+    callback_query: Optional[CallbackQuery] = None
+
+    @property
+    def is_supported(self) -> bool:
+        """
+        True if the update carries a text or location message, or an inline button press on a message
+        that is still accessible, that the handlers know how to process.
+        """
+        if self.callback_query is not None:
+            return self.callback_query.data is not None and self.callback_query.message is not None
+        return self.message is not None and (self.message.text is not None or self.message.location is not None)
+
+
+def decode_update(body: bytes) -> Update:
+    """
+    Decode a raw Telegram webhook body into a typed Update in a single pass.
+
+    Args:
+        body (bytes): The raw request body.
+    Returns:
+        Update: The validated update; unknown update types are left as None fields.
+    Raises:
+        ValidationError: If the body is not valid JSON or does not match the Update schema.
+    """
+    return Update.model_validate_json(body)
@@ -1,5 +1,5 @@
 from pydantic import BaseModel, conlist
-from typing import List
+from typing import List, Optional
 
 
 class Condition(BaseModel):
@@ -68,11 +68,42 @@ class CurrentWeather(BaseModel):
     gust_kph: float
 
 
+class Astro(BaseModel):
+    sunrise: str  # local time, e.g. "07:12 AM"
+    sunset: str
+    moonrise: str
+    moonset: str
+    moon_phase: str
+    moon_illumination: float
+    is_moon_up: Optional[int] = None
+    is_sun_up: Optional[int] = None
+
+
+class Hour(BaseModel):
+    """
+    One hour of forecastday.hour. Only used to check payloads; the hourly series are cached as
+    columns (see bot/hourly.py) instead of as a list of these.
+    """
+    time_epoch: int
+    time: str
+    temp_c: float
+    is_day: int
+    condition: Condition
+    wind_kph: float
+    wind_dir: str
+    precip_mm: float
+    humidity: int
+    feelslike_c: float
+    chance_of_rain: int
+    chance_of_snow: int
+
+
 class ForecastDay(BaseModel):
+    """The hour list of the payload is not modelled here; daily replies do not need 24 objects per day."""
     date: str
     date_epoch: int
     day: DayDetails
-    astro: dict  # You can create a Pydantic model for Astro if needed
+    astro: Astro
 
 
 class Forecast(BaseModel):
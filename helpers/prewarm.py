@@ -0,0 +1,62 @@
+import logging
+import time
+from datetime import date, timedelta
+
+from config.config import Settings, get_settings, get_bot
+from helpers.helpers import get_response
+from helpers.quota import QuotaBudget, NORMAL
+from helpers.upstream import CircuitBreaker
+from helpers.weather_api import forecast_request, history_request
+from helpers.weather_cache import WeatherCache
+from postgres.database_adapters import select_popular_cities, try_advisory_lock
+from postgres.pool import DbPool
+from prometheus.couters import instance_id, prewarm_upstream_calls
+
+log = logging.getLogger(__name__)
+
+
+async def prewarm_popular_cities() -> None:
+    """
+    Refreshes cached data of the most popular cities shortly before it expires.
+
+    Covers what the commands read: current weather (/current_weather), the 3-day forecast (/prediction)
+    and yesterday's history (the only day that rolls into the /weather_statistic window).
+    Stops after PREWARM_MAX_CALLS upstream calls; the most popular cities are refreshed first.
+    Skipped while the weatherapi circuit breaker is open or the quota budget is above NORMAL.
+    Every worker of every replica has this tick, but a run holds an advisory lock: the other processes skip
+    theirs, so PREWARM_MAX_CALLS is the budget of the whole deployment and a city is refreshed once.
+    """
+    if CircuitBreaker.is_open():
+        log.info("Pre-warm skipped, weatherapi circuit breaker is open")
+        return
+    if QuotaBudget.level() > NORMAL:
+        log.info("Pre-warm skipped, weatherapi quota budget is tight")
+        return
+    async with try_advisory_lock(await DbPool.get_pool(), "prewarm_popular_cities") as acquired:
+        if not acquired:
+            log.debug("Pre-warm skipped, another process is running it")
+            return
+        await _prewarm(get_settings())
+
+
+async def _prewarm(config: Settings) -> None:
+    since = int(time.time()) - config.PREWARM_ACTIVITY_WINDOW
+    cities = await select_popular_cities(await DbPool.get_pool(), since, config.PREWARM_TOP_CITIES)
+    yesterday = date.today() - timedelta(days=1)
+    budget = config.PREWARM_MAX_CALLS
+    for city in cities:
+        for request in (forecast_request(config, city), forecast_request(config, city, 3),
+                        history_request(config, city, yesterday)):
+            if not await WeatherCache.expires_soon(request.key, config.PREWARM_LEAD_SECONDS):
+                continue
+            if budget <= 0:
+                log.warning("Pre-warm budget of %s calls exhausted", config.PREWARM_MAX_CALLS)
+                return
+            budget -= 1
+            data = await get_response(None, request.url, get_bot())
+            if data:
+                await WeatherCache.set(request.key, data, request.ttl)
+                prewarm_upstream_calls.labels(instance=instance_id, result="ok").inc()
+            else:
+                prewarm_upstream_calls.labels(instance=instance_id, result="failed").inc()
+    log.debug("Pre-warm finished, %s calls left", budget)
@@ -0,0 +1,88 @@
+import asyncio
+import cProfile
+import logging
+import marshal
+import sys
+import threading
+from collections import Counter
+from typing import Optional
+
+log = logging.getLogger(__name__)
+
+
+class ProfilerBusyError(Exception):
+    def __init__(self, message="A profile is already running"):
+        self.message = message
+        super().__init__(message)
+
+
+def collapse(frame) -> str:
+    """A stack as one 'module:function;...' line, outermost frame first (the collapsed-stack format)."""
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f"{frame.f_globals.get('__name__', '?')}:{code.co_name}")
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+
+class Profiler:
+    """
+    On-demand CPU profiles of the event loop thread of this worker.
+
+    Nothing runs until a profile is requested, and only one profile runs at a time per worker.
+    'sample' reads the loop thread's stack from a helper thread every PROFILE_SAMPLE_INTERVAL seconds,
+    which costs little and does not change what is measured. 'cprofile' traces every call in the
+    loop thread and is exact but slows it down while it runs.
+    """
+    _running: bool = False
+
+    @classmethod
+    def _acquire(cls) -> None:
+        if cls._running:
+            raise ProfilerBusyError()
+        cls._running = True
+
+    @classmethod
+    async def sample(cls, seconds: float, interval: float) -> str:
+        """Collapsed stacks with their sample counts, one per line, ready for flamegraph.pl or speedscope."""
+        cls._acquire()
+        try:
+            loop_thread = threading.get_ident()
+            stacks: Counter = Counter()
+            stop = threading.Event()
+
+            def run() -> None:
+                while not stop.wait(interval):
+                    frame: Optional[object] = sys._current_frames().get(loop_thread)
+                    if frame is not None:
+                        stacks[collapse(frame)] += 1
+
+            sampler = threading.Thread(target=run, name="profiler-sampler", daemon=True)
+            sampler.start()
+            try:
+                await asyncio.sleep(seconds)
+            finally:
+                stop.set()
+                await asyncio.to_thread(sampler.join)
+            log.info("profile: %s samples over %ss", sum(stacks.values()), seconds)
+            return "".join(f"{stack} {count}\n" for stack, count in stacks.most_common())
+        finally:
+            cls._running = False
+
+    @classmethod
+    async def cprofile(cls, seconds: float) -> bytes:
+        """Deterministic profile of the loop thread, in the pstats file format (pstats.Stats, snakeviz)."""
+        cls._acquire()
+        try:
+            profile = cProfile.Profile()
+            profile.enable()
+            try:
+                await asyncio.sleep(seconds)
+            finally:
+                profile.disable()
+            profile.create_stats()
+            log.info("profile: cProfile over %ss", seconds)
+            return marshal.dumps(profile.stats)
+        finally:
+            cls._running = False
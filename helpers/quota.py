@@ -0,0 +1,119 @@
+import logging
+from collections import Counter
+from datetime import date, datetime, timedelta, timezone
+from typing import Optional
+from urllib.parse import urlsplit
+
+from config.config import get_settings
+from postgres.database_adapters import add_api_usage, select_api_usage
+from postgres.pool import DbPool
+from prometheus.couters import instance_id, upstream_calls, quota_remaining, quota_level
+
+log = logging.getLogger(__name__)
+
+# Degradation levels, each includes the ones before it
+NORMAL = 0
+LONG_TTL = 1  # cache TTLs are multiplied by QUOTA_TTL_MULTIPLIER
+CACHE_ONLY = 2  # /weather_statistic and /prediction answer from the cache only
+WARM_ONLY = 3  # cities with nothing cached are refused
+
+# Projected month-end usage, as a share of QUOTA_MONTHLY_CALLS, that switches on each level
+LEVEL_THRESHOLDS = ((1.5, WARM_ONLY), (1.2, CACHE_ONLY), (1.0, LONG_TTL))
+
+
+def month_start(now: datetime) -> date:
+    return now.date().replace(day=1)
+
+
+def endpoint_of(api_url: str) -> str:
+    """The weatherapi endpoint of a URL: 'forecast' for .../v1/forecast.json?..."""
+    return urlsplit(api_url).path.rsplit("/", 1)[-1].removesuffix(".json")
+
+
+def project_usage(used: int, now: datetime) -> float:
+    """
+    Month-end usage if calls keep coming at the month's average rate so far.
+    The first day counts as a full day, so a burst right after the reset does not look like a month's worth.
+    """
+    start = datetime.combine(month_start(now), datetime.min.time(), tzinfo=timezone.utc)
+    end = (start + timedelta(days=32)).replace(day=1)
+    elapsed = max((now - start).total_seconds(), 86400)
+    return used * (end - start).total_seconds() / elapsed
+
+
+class QuotaBudget:
+    """
+    Accounts weatherapi calls against the monthly quota (QUOTA_MONTHLY_CALLS) and picks a degradation level.
+
+    Calls are counted in memory by endpoint and added to the api_usage table every QUOTA_FLUSH_INTERVAL
+    seconds; the flush reads back the month total of every replica. The level follows the projected
+    month-end usage, so the bot gets cheaper before weatherapi answers 2007 (quota exceeded) to everyone.
+    """
+    _pending: Counter = Counter()
+    _used: int = 0  # month total in api_usage as of the last flush
+    _month: date = month_start(datetime.now(timezone.utc))
+    _level: int = NORMAL
+    _exhausted: Optional[date] = None  # month in which weatherapi answered 2007
+
+    @classmethod
+    def record(cls, api_url: str, calls: int = 1) -> None:
+        endpoint = endpoint_of(api_url)
+        cls._pending[endpoint] += calls
+        upstream_calls.labels(instance=instance_id, endpoint=endpoint).inc(calls)
+
+    @classmethod
+    def level(cls) -> int:
+        return cls._level
+
+    @classmethod
+    def ttl(cls, ttl: int) -> int:
+        """The cache TTL to use at the current level."""
+        return ttl * get_settings().QUOTA_TTL_MULTIPLIER if cls._level >= LONG_TTL else ttl
+
+    @classmethod
+    def mark_exhausted(cls) -> None:
+        """Called on error 2007: nothing more can be spent this month, whatever the counters say."""
+        if cls._level != WARM_ONLY:
+            log.critical("weatherapi monthly quota exceeded, serving cached cities only")
+        cls._exhausted = cls._month
+        cls._set_level(WARM_ONLY)
+
+    @classmethod
+    async def flush(cls) -> None:
+        """Persists the calls counted since the previous flush and recomputes the level from the month total."""
+        now = datetime.now(timezone.utc)
+        pool = await DbPool.get_pool()
+        pending, cls._pending = cls._pending, Counter()
+        if pending:
+            try:
+                await add_api_usage(pool, cls._month, dict(pending))
+            except Exception:
+                cls._pending.update(pending)  # counted again on the next flush
+                raise
+        cls._month = month_start(now)
+        rows = await select_api_usage(pool, cls._month)
+        if rows is None:
+            return
+        cls._used = sum(row["calls"] for row in rows)
+        cls._update_level(now)
+
+    @classmethod
+    def _update_level(cls, now: datetime) -> None:
+        budget = get_settings().QUOTA_MONTHLY_CALLS
+        used = cls._used + sum(cls._pending.values())
+        ratio = project_usage(used, now) / budget
+        level = NORMAL if used < budget and cls._exhausted != cls._month else WARM_ONLY
+        for threshold, threshold_level in LEVEL_THRESHOLDS:
+            if ratio > threshold:
+                level = max(level, threshold_level)
+                break
+        if level != cls._level:
+            log.warning("weatherapi quota: %s of %s calls used, %.0f projected, degradation level %s -> %s",
+                        used, budget, ratio * budget, cls._level, level)
+        cls._set_level(level)
+        quota_remaining.labels(instance=instance_id).set(max(budget - used, 0))
+
+    @classmethod
+    def _set_level(cls, level: int) -> None:
+        cls._level = level
+        quota_level.labels(instance=instance_id).set(level)
@@ -0,0 +1,100 @@
+import logging
+import time
+from collections import OrderedDict
+from typing import List
+
+from bot.keyboards import FORECAST_DAY, FORECAST_DAYS, HOURLY
+from config.config import get_settings
+from helpers.model_message import Message
+from prometheus.couters import instance_id, rate_limited_updates, rate_limiter_chats
+
+log = logging.getLogger(__name__)
+
+# Tokens a command costs; /weather_statistic and /prediction make up to 8 upstream calls each.
+# Forecast pickers cost nothing to send; the button press that fetches the forecast is charged instead.
+COMMAND_WEIGHTS = {
+    "/weather_statistic": 5,
+    "/prediction": 5,
+    "/current_weather": 2,
+    FORECAST_DAY: 2,
+    FORECAST_DAYS: 2,
+    "/hourly": 2,
+    HOURLY: 2,
+    "/my_cities": 3,
+}
+DEFAULT_WEIGHT = 1
+
+RATE_LIMITED_TEXT = "Too many requests, please wait a minute and try again."
+
+# Results of ChatRateLimiter.acquire
+ALLOWED, LIMITED, LIMITED_SILENT = 0, 1, 2
+
+
+def weight_of(message: Message) -> int:
+    """
+    Cost of a message; '/prediction@my_bot' costs the same as '/prediction', and a button press
+    ('fd:2024-06-01') is charged by its callback prefix.
+    """
+    words = (message.text or "").split(maxsplit=1)
+    if not words:
+        return DEFAULT_WEIGHT
+    return COMMAND_WEIGHTS.get(words[0].split("@", 1)[0].split(":", 1)[0], DEFAULT_WEIGHT)
+
+
+class ChatRateLimiter:
+    """
+    Per-chat token buckets checked before any database or upstream work.
+
+    A bucket holds up to RATE_LIMIT_CAPACITY tokens and refills at RATE_LIMIT_REFILL_PER_SEC.
+    Buckets are kept in last-used order: a bucket unused for longer than a full refill is the same as
+    a new one, so it is dropped from the front on the next call. RATE_LIMIT_MAX_CHATS bounds the
+    memory when more chats than that are active within one refill period.
+    """
+    # chat_id -> [tokens, last update (monotonic), reply allowed again at (monotonic)]
+    _buckets: "OrderedDict[int, List[float]]" = OrderedDict()
+
+    @classmethod
+    def acquire(cls, message: Message) -> int:
+        """
+        Takes the message's weight from its chat's bucket.
+
+        Returns:
+            ALLOWED if the message may be processed, LIMITED if the chat should get RATE_LIMITED_TEXT,
+            LIMITED_SILENT if it already got it recently and the update is dropped without a reply.
+        """
+        config = get_settings()
+        now = time.monotonic()
+        cls._expire(now, config.RATE_LIMIT_CAPACITY / config.RATE_LIMIT_REFILL_PER_SEC)
+
+        chat_id = message.chat.id
+        bucket = cls._buckets.get(chat_id)
+        if bucket is None:
+            bucket = cls._buckets[chat_id] = [config.RATE_LIMIT_CAPACITY, now, 0.0]
+            if len(cls._buckets) > config.RATE_LIMIT_MAX_CHATS:
+                cls._buckets.popitem(last=False)
+        else:
+            cls._buckets.move_to_end(chat_id)
+            refill = (now - bucket[1]) * config.RATE_LIMIT_REFILL_PER_SEC
+            bucket[0] = min(config.RATE_LIMIT_CAPACITY, bucket[0] + refill)
+            bucket[1] = now
+        rate_limiter_chats.labels(instance=instance_id).set(len(cls._buckets))
+
+        weight = weight_of(message)
+        if bucket[0] >= weight:
+            bucket[0] -= weight
+            return ALLOWED
+        rate_limited_updates.labels(instance=instance_id).inc()
+        log.info("Chat %s is rate limited", chat_id)
+        if now < bucket[2]:
+            return LIMITED_SILENT
+        # One reply per time the bucket needs to afford the message, so the limiter does not spam either
+        bucket[2] = now + (weight - bucket[0]) / config.RATE_LIMIT_REFILL_PER_SEC
+        return LIMITED
+
+    @classmethod
+    def _expire(cls, now: float, idle: float) -> None:
+        while cls._buckets:
+            chat_id, bucket = next(iter(cls._buckets.items()))
+            if now - bucket[1] < idle:
+                break
+            del cls._buckets[chat_id]
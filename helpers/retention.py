@@ -0,0 +1,35 @@
+import asyncio
+import logging
+import time
+
+from config.config import get_settings
+from postgres.database_adapters import archive_statistic_batch
+from postgres.pool import DbPool
+from prometheus.couters import instance_id, statistic_rows_archived, statistic_retention_seconds
+
+log = logging.getLogger(__name__)
+
+
+async def archive_old_statistic() -> None:
+    """
+    Moves statistic rows older than STATISTIC_RETENTION_DAYS into the per-chat daily summaries.
+
+    Works in batches of STATISTIC_RETENTION_BATCH rows, each its own short transaction, with a
+    STATISTIC_RETENTION_PAUSE between them so webhook queries keep getting connections and locks.
+    A run stops after STATISTIC_RETENTION_MAX_BATCHES; a backlog is worked off over several runs.
+    """
+    config = get_settings()
+    pool = await DbPool.get_pool()
+    before_ts = int(time.time()) - config.STATISTIC_RETENTION_DAYS * 86400
+    total = 0
+    for _ in range(config.STATISTIC_RETENTION_MAX_BATCHES):
+        started = time.perf_counter()
+        archived = await archive_statistic_batch(pool, before_ts, config.STATISTIC_RETENTION_BATCH)
+        statistic_retention_seconds.labels(instance=instance_id).inc(time.perf_counter() - started)
+        statistic_rows_archived.labels(instance=instance_id).inc(archived)
+        total += archived
+        if archived < config.STATISTIC_RETENTION_BATCH:
+            break
+        await asyncio.sleep(config.STATISTIC_RETENTION_PAUSE)
+    if total:
+        log.info("statistic retention: %s rows archived", total)
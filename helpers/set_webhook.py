@@ -1,30 +1,63 @@
-import requests
+import asyncio
+import hashlib
 import logging
-import sys
-import traceback
+
+import aiohttp
+
+from helpers.helpers import StartupCheckError
+from helpers.http_client import HttpSession
+from helpers.model_message import ALLOWED_UPDATES
 
 log = logging.getLogger(__name__)
 
 
-def set_webhook(token: str, ngrok: str, secret_token: str) -> None:
+def webhook_url(ngrok: str, secret_token: str) -> str:
+    """
+    The URL Telegram delivers updates to.
+    getWebhookInfo never returns the secret token, so a short fingerprint of it is part of the URL:
+    a changed secret changes the URL and forces setWebhook on the next start.
+    """
+    fingerprint = hashlib.sha256(secret_token.encode()).hexdigest()[:12]
+    return f"{ngrok}/tg_webhooks?v={fingerprint}"
+
+
+async def set_webhook(token: str, ngrok: str, secret_token: str, timeout: float) -> None:
     """
     Sets up a webhook for the Telegram bot using the provided tokens.
+    Only the update types listed in ALLOWED_UPDATES are subscribed to.
+    setWebhook is skipped when getWebhookInfo shows the same URL and update types are already registered.
     Parameters:
         token (str): The Telegram bot token.
         ngrok (str): The ngrok URL.
         secret_token (str): The secret token for the webhook.
+        timeout (float): Seconds to wait for each Telegram call.
     Raises:
-        SystemExit: If the webhook setup fails.
+        StartupCheckError: If the webhook setup fails.
     """
+    session = HttpSession.get_session()
+    client_timeout = aiohttp.ClientTimeout(total=timeout)
+    url = webhook_url(ngrok, secret_token)
     try:
-        webhook_url = f'https://api.telegram.org/bot{token}/setWebhook?url={ngrok}/tg_webhooks&secret_token={secret_token}'
-        response = requests.post(webhook_url)
-        if response.status_code == 200:
-            log.info('Webhook setup successful')
-        else:
-            log.critical('Webhook setup failed: %s' + webhook_url + str(response.status_code))
-            sys.exit(1)
-    except Exception as e:
-        log.critical(f'Webhook setup failed :\n{e}')
-        log.debug(F"Exception traceback:\n", traceback.format_exc())
-        sys.exit(1)
+        async with session.get(f'https://api.telegram.org/bot{token}/getWebhookInfo',
+                               timeout=client_timeout) as response:
+            info = (await response.json()).get("result", {})
+        if info.get("url") == url and sorted(info.get("allowed_updates", [])) == sorted(ALLOWED_UPDATES):
+            log.info('Webhook already set, setWebhook skipped')
+            return
+
+        payload = {
+            "url": url,
+            "secret_token": secret_token,
+            "allowed_updates": ALLOWED_UPDATES,  # Telegram drops every other update type before delivery
+        }
+        async with session.post(f'https://api.telegram.org/bot{token}/setWebhook', json=payload,
+                                timeout=client_timeout) as response:
+            if response.status == 200:
+                log.info('Webhook setup successful')
+            else:
+                log.critical('Webhook setup failed: %s', response.status)
+                raise StartupCheckError(f"setWebhook returned {response.status}")
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        log.critical('Webhook setup failed :\n%s', e)
+        log.debug("Exception traceback", exc_info=True)
+        raise StartupCheckError("Webhook setup failed") from e
@@ -0,0 +1,60 @@
+import asyncio
+import logging
+import time
+
+from asyncpg import Pool
+
+from bot.scheduler import deliver_due_subscriptions
+from config.config import Settings
+from handlers.health_handler import Readiness
+from helpers.activity import ActivityTracker
+from helpers.analytics import Analytics
+from helpers.background import start_periodic
+from helpers.helpers import check_bot_token, check_api_key
+from helpers.location_index import LocationIndex
+from helpers.prewarm import prewarm_popular_cities
+from helpers.quota import QuotaBudget
+from helpers.retention import archive_old_statistic
+from helpers.set_webhook import set_webhook
+from helpers.weather_cache import WeatherCache
+from postgres.database_adapters import advisory_lock, create_table
+from prometheus.couters import inc_counters, instance_id, startup_duration
+
+log = logging.getLogger(__name__)
+
+
+async def register_webhook(settings: Settings, pool: Pool, timeout: float) -> None:
+    async with advisory_lock(pool, "set_webhook"):
+        await set_webhook(settings.TOKEN, settings.APP_DOMAIN, settings.SECRET_TOKEN_TG_WEBHOOK, timeout)
+
+
+async def run_startup(settings: Settings, pool: Pool) -> None:
+    """
+    Runs the startup work concurrently within STARTUP_TIMEOUT seconds.
+
+    The token and API key checks are skipped with SKIP_STARTUP_CHECKS (e.g. on restarts with known-good
+    settings); setWebhook is skipped by set_webhook itself when Telegram already has the same webhook.
+    With several workers the table creation and the webhook check run under advisory locks, so they are done
+    once and the workers after the first find the tables and the webhook in place.
+    The pool is warmed, and the quota level restored, by reading this month's api_usage before the
+    instance reports ready.
+    """
+    started = time.perf_counter()
+    timeout = settings.STARTUP_TIMEOUT
+    steps = [create_table(pool), register_webhook(settings, pool, timeout)]
+    if not settings.SKIP_STARTUP_CHECKS:
+        steps += [check_bot_token(settings.TOKEN, timeout), check_api_key(settings.API_KEY, timeout)]
+    await asyncio.wait_for(asyncio.gather(*steps), timeout)
+
+    await asyncio.gather(LocationIndex.load(pool), QuotaBudget.flush(), inc_counters())
+    start_periodic("weather_cache_cleanup", settings.CACHE_CLEANUP_INTERVAL, WeatherCache.purge_expired)
+    start_periodic("prewarm_popular_cities", settings.PREWARM_INTERVAL, prewarm_popular_cities)
+    start_periodic("daily_subscriptions", settings.SUBSCRIPTION_TICK, deliver_due_subscriptions)
+    start_periodic("quota_flush", settings.QUOTA_FLUSH_INTERVAL, QuotaBudget.flush)
+    start_periodic("users_online_flush", settings.ACTIVITY_FLUSH_INTERVAL, ActivityTracker.flush)
+    start_periodic("analytics_flush", settings.ANALYTICS_FLUSH_INTERVAL, Analytics.flush)
+    start_periodic("statistic_retention", settings.STATISTIC_RETENTION_INTERVAL, archive_old_statistic)
+
+    Readiness.mark_started()
+    startup_duration.labels(instance=instance_id).set(time.perf_counter() - started)
+    log.info("Startup completed in %.2fs", time.perf_counter() - started)
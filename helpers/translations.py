@@ -0,0 +1,164 @@
+from typing import Dict
+
+LANGUAGES = ("en", "ru")
+DEFAULT_LANGUAGE = "en"
+
+# weatherapi condition codes (Condition.code); English texts are the ones weatherapi sends by default
+CONDITIONS: Dict[int, Dict[str, str]] = {
+    1000: {"en": "Sunny", "ru": "Солнечно"},
+    1003: {"en": "Partly cloudy", "ru": "Переменная облачность"},
+    1006: {"en": "Cloudy", "ru": "Облачно"},
+    1009: {"en": "Overcast", "ru": "Пасмурная погода"},
+    1030: {"en": "Mist", "ru": "Туман"},
+    1063: {"en": "Patchy rain possible", "ru": "Возможен кратковременный дождь"},
+    1066: {"en": "Patchy snow possible", "ru": "Возможен кратковременный снег"},
+    1069: {"en": "Patchy sleet possible", "ru": "Возможен кратковременный мокрый снег"},
+    1072: {"en": "Patchy freezing drizzle possible", "ru": "Возможен кратковременный ледяной дождь"},
+    1087: {"en": "Thundery outbreaks possible", "ru": "Возможны грозовые вспышки"},
+    1114: {"en": "Blowing snow", "ru": "Низовая метель"},
+    1117: {"en": "Blizzard", "ru": "Метель"},
+    1135: {"en": "Fog", "ru": "Туман"},
+    1147: {"en": "Freezing fog", "ru": "Ледяной туман"},
+    1150: {"en": "Patchy light drizzle", "ru": "Небольшой мелкий дождь"},
+    1153: {"en": "Light drizzle", "ru": "Легкая морось"},
+    1168: {"en": "Freezing drizzle", "ru": "Изморозь"},
+    1171: {"en": "Heavy freezing drizzle", "ru": "Сильный ледяной дождь"},
+    1180: {"en": "Patchy light rain", "ru": "Небольшой дождь"},
+    1183: {"en": "Light rain", "ru": "Легкий дождь"},
+    1186: {"en": "Moderate rain at times", "ru": "Временами умеренный дождь"},
+    1189: {"en": "Moderate rain", "ru": "Умеренный дождь"},
+    1192: {"en": "Heavy rain at times", "ru": "Временами сильный дождь"},
+    1195: {"en": "Heavy rain", "ru": "Ливень"},
+    1198: {"en": "Light freezing rain", "ru": "Легкий ледяной дождь"},
+    1201: {"en": "Moderate or heavy freezing rain", "ru": "Умеренный или сильный ледяной дождь"},
+    1204: {"en": "Light sleet", "ru": "Легкий мокрый снег"},
+    1207: {"en": "Moderate or heavy sleet", "ru": "Умеренный или сильный мокрый снег"},
+    1210: {"en": "Patchy light snow", "ru": "Небольшой мелкий снег"},
+    1213: {"en": "Light snow", "ru": "Легкий снег"},
+    1216: {"en": "Patchy moderate snow", "ru": "Неровный умеренный снег"},
+    1219: {"en": "Moderate snow", "ru": "Умеренный снег"},
+    1222: {"en": "Patchy heavy snow", "ru": "Неровный сильный снег"},
+    1225: {"en": "Heavy snow", "ru": "Сильный снегопад"},
+    1237: {"en": "Ice pellets", "ru": "Ледяная крупа"},
+    1240: {"en": "Light rain shower", "ru": "Небольшой дождь моросит"},
+    1243: {"en": "Moderate or heavy rain shower", "ru": "Умеренный или сильный ливень"},
+    1246: {"en": "Torrential rain shower", "ru": "Проливной ливень"},
+    1249: {"en": "Light sleet showers", "ru": "Небольшой ливень с мокрым снегом"},
+    1252: {"en": "Moderate or heavy sleet showers", "ru": "Умеренный или сильный ливень с мокрым снегом"},
+    1255: {"en": "Light snow showers", "ru": "Легкий снегопад"},
+    1258: {"en": "Moderate or heavy snow showers", "ru": "Умеренный или сильный снегопад"},
+    1261: {"en": "Light showers of ice pellets", "ru": "Легкий дождь ледяных крупинок"},
+    1264: {"en": "Moderate or heavy showers of ice pellets", "ru": "Умеренные или сильные ливни ледяной крупы"},
+    1273: {"en": "Patchy light rain with thunder", "ru": "Небольшой дождь с грозой"},
+    1276: {"en": "Moderate or heavy rain with thunder", "ru": "Умеренный или сильный дождь с грозой"},
+    1279: {"en": "Patchy light snow with thunder", "ru": "Небольшой снег с грозой"},
+    1282: {"en": "Moderate or heavy snow with thunder", "ru": "Умеренный или сильный снег с грозой"},
+}
+
+# Condition texts, lowercased, to codes; includes the newer and night-time texts weatherapi also sends
+CONDITION_CODES: Dict[str, int] = {
+    **{texts["en"].lower(): code for code, texts in CONDITIONS.items()},
+    "clear": 1000,
+    "patchy rain nearby": 1063,
+    "patchy snow nearby": 1066,
+    "patchy sleet nearby": 1069,
+    "patchy freezing drizzle nearby": 1072,
+    "thundery outbreaks in nearby": 1087,
+}
+
+WIND_DIRECTIONS: Dict[str, Dict[str, str]] = {
+    'N': {"en": "N", "ru": "Северный"},
+    'NNE': {"en": "NNE", "ru": "Северо-северо-восточный"},
+    'NE': {"en": "NE", "ru": "Северо-восточный"},
+    'ENE': {"en": "ENE", "ru": "Восточно-северо-восточный"},
+    'E': {"en": "E", "ru": "Восточный"},
+    'ESE': {"en": "ESE", "ru": "Восточно-юго-восточный"},
+    'SE': {"en": "SE", "ru": "Юго-восточный"},
+    'SSE': {"en": "SSE", "ru": "Юго-юго-восточный"},
+    'S': {"en": "S", "ru": "Южный"},
+    'SSW': {"en": "SSW", "ru": "Юго-юго-западный"},
+    'SW': {"en": "SW", "ru": "Юго-западный"},
+    'WSW': {"en": "WSW", "ru": "Западно-юго-западный"},
+    'W': {"en": "W", "ru": "Западный"},
+    'WNW': {"en": "WNW", "ru": "Западно-северо-западный"},
+    'NW': {"en": "NW", "ru": "Северо-западный"},
+    'NNW': {"en": "NNW", "ru": "Северо-северо-западный"},
+}
+
+# Message templates by language; filled with str.format
+TEMPLATES: Dict[str, Dict[str, str]] = {
+    "en": {
+        "current": ("{city} ({region}): {local_time}\n"
+                    "Temperature: {temperature}°C (feels like {feels_like}°C)\n"
+                    "Maximum temperature: {max_temp}°C\n"
+                    "Minimum temperature: {min_temp}°C\n"
+                    "{wind}\n"
+                    "Humidity: {humidity}% \n"
+                    "Precipitation: {precipitation}%\n"
+                    "{condition}"),
+        "wind": "Wind {direction} {speed} m/s (with maximum wind speed of {max_speed} m/s)",
+        "wind_unknown": "Wind direction is unknown.",
+        "forecast_day": ("{city} ({region}):{date}\n"
+                         "Maximum temperature: {max_temp}°C\n"
+                         "Minimum temperature: {min_temp}°C\n"
+                         "Wind up to {wind_speed} m/s\n"
+                         "Precipitation: {precipitation}%\n"
+                         "{condition}"),
+        "forecast_days": ("{city} ({region}):{date}\n"
+                          "Maximum temperature: {max_temp}°C\n"
+                          "Minimum temperature: {min_temp}°C\n"
+                          "Wind up to {wind_speed} m/s\n"
+                          "Humidity: {humidity}% \n"
+                          "Precipitation probability: {precipitation}%\n"
+                          "{condition}"),
+        "history_day": ("{city} ({region}): {date}\n"
+                        "Temperature: Max: {max_temp}°C, Min: {min_temp}°C, {condition} \n"),
+        "chart": ("{city} ({region}), {period}: {first} - {last}\n"
+                  "Highest: {max_temp}°C ({max_date})\n"
+                  "Lowest: {min_temp}°C ({min_date})\n"
+                  "Red: daily maximum, blue: daily minimum"),
+        "period_history": "last {days} days",
+        "period_forecast": "next {days} days",
+        "hourly": ("{city} ({region}), next {hours} h\n"
+                   "Sunrise {sunrise}, sunset {sunset}"),
+        "hourly_detail": "By hour:",
+        "hour": "{time}  {temp:+d}°C  {wind} m/s  {chance}%  {condition}",
+    },
+    "ru": {
+        "current": ("{city} ({region}): {local_time}\n"
+                    "Температура: {temperature}°C (ощущается как {feels_like}°C)\n"
+                    "Максимальная температура: {max_temp}°C\n"
+                    "Минимальная температура: {min_temp}°C\n"
+                    "{wind}\n"
+                    "Влажность: {humidity}% \n"
+                    "Вероятность осадков: {precipitation}%\n"
+                    "{condition}"),
+        "wind": "Ветер {direction} {speed} м/с (порывы до {max_speed} м/с)",
+        "wind_unknown": "Направление ветра неизвестно.",
+        "forecast_day": ("{city} ({region}):{date}\n"
+                         "Максимальная температура: {max_temp}°C\n"
+                         "Минимальная температура: {min_temp}°C\n"
+                         "Ветер до {wind_speed} м/с\n"
+                         "Вероятность осадков: {precipitation}%\n"
+                         "{condition}"),
+        "forecast_days": ("{city} ({region}):{date}\n"
+                          "Максимальная температура: {max_temp}°C\n"
+                          "Минимальная температура: {min_temp}°C\n"
+                          "Ветер до {wind_speed} м/с\n"
+                          "Влажность: {humidity}% \n"
+                          "Вероятность осадков: {precipitation}%\n"
+                          "{condition}"),
+        "history_day": ("{city} ({region}): {date}\n"
+                        "Температура: макс. {max_temp}°C, мин. {min_temp}°C, {condition} \n"),
+        "chart": ("{city} ({region}), {period}: {first} - {last}\n"
+                  "Самая высокая: {max_temp}°C ({max_date})\n"
+                  "Самая низкая: {min_temp}°C ({min_date})\n"
+                  "Красная линия: максимум дня, синяя: минимум дня"),
+        "period_history": "последние {days} дн.",
+        "period_forecast": "следующие {days} дн.",
+        "hourly": ("{city} ({region}), следующие {hours} ч\n"
+                   "Восход {sunrise}, закат {sunset}"),
+        "hourly_detail": "По часам:",
+        "hour": "{time}  {temp:+d}°C  {wind} м/с  {chance}%  {condition}",
+    },
+}
@@ -0,0 +1,152 @@
+import asyncio
+import logging
+import random
+import time
+from typing import Any, Dict, Optional, Tuple
+
+import aiohttp
+
+from config.config import get_settings
+from helpers.http_client import HttpSession
+from helpers.quota import QuotaBudget
+from prometheus.couters import instance_id, upstream_breaker_state, upstream_retries
+
+log = logging.getLogger(__name__)
+
+# Values of the upstream_breaker_state gauge
+CLOSED, HALF_OPEN, OPEN = 0, 1, 2
+
+
+class UpstreamUnavailableError(Exception):
+    def __init__(self, message="Weather API is unavailable"):
+        self.message = message
+        super().__init__(self.message)
+
+
+class CircuitBreaker:
+    """
+    Circuit breaker in front of weatherapi.
+
+    BREAKER_FAILURE_THRESHOLD failed calls in a row open it: calls are rejected right away instead of
+    waiting for timeouts. After BREAKER_RESET_TIMEOUT seconds a single probe call is let through
+    (half-open); its success closes the breaker, its failure opens it again.
+    """
+    _state: int = CLOSED
+    _failures: int = 0
+    _opened_at: float = 0.0
+
+    @classmethod
+    def allow(cls) -> bool:
+        if cls._state == CLOSED:
+            return True
+        if cls._state == OPEN and time.monotonic() - cls._opened_at >= get_settings().BREAKER_RESET_TIMEOUT:
+            cls._set_state(HALF_OPEN)
+            log.info("Circuit breaker half-open, probing weatherapi")
+            return True
+        return False
+
+    @classmethod
+    def is_open(cls) -> bool:
+        return cls._state != CLOSED
+
+    @classmethod
+    def record_success(cls) -> None:
+        if cls._state != CLOSED:
+            log.info("Circuit breaker closed")
+        cls._failures = 0
+        cls._set_state(CLOSED)
+
+    @classmethod
+    def record_failure(cls) -> None:
+        cls._failures += 1
+        if cls._state == HALF_OPEN or cls._failures >= get_settings().BREAKER_FAILURE_THRESHOLD:
+            if cls._state != OPEN:
+                log.warning("Circuit breaker opened after %s failed calls", cls._failures)
+            cls._opened_at = time.monotonic()
+            cls._set_state(OPEN)
+
+    @classmethod
+    def release_probe(cls) -> None:
+        """
+        Called when a call is cancelled, which says nothing about weatherapi: a half-open probe goes back to
+        open with the reset timeout still elapsed, so the next call probes again; a closed breaker is left alone.
+        """
+        if cls._state == HALF_OPEN:
+            cls._set_state(OPEN)
+
+    @classmethod
+    def _set_state(cls, state: int) -> None:
+        cls._state = state
+        upstream_breaker_state.labels(instance=instance_id).set(state)
+
+
+def backoff(attempt: int, base: float, cap: float) -> float:
+    """Full-jitter exponential backoff: a random delay between 0 and min(cap, base * 2^attempt)."""
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+async def fetch_json(api_url: str, body: Optional[Dict[str, Any]] = None) -> Tuple[int, Any]:
+    """
+    GET api_url through the circuit breaker and return (status, json body); with a body it is POSTed as JSON
+    (weatherapi bulk requests).
+
+    Each attempt is bounded by UPSTREAM_TIMEOUT and the whole call, backoff included, by UPSTREAM_DEADLINE.
+    Timeouts, connection and other client errors and 5xx responses are retried up to UPSTREAM_RETRIES times.
+    Every attempt is counted against the monthly quota, a bulk request once per location.
+    4xx responses are answers, not failures: they are returned as is and count as a success for the breaker.
+    A 5xx left after the last retry is returned as well, so the caller can report it.
+
+    Raises:
+        UpstreamUnavailableError: If the breaker is open, or the last attempt timed out or failed.
+    """
+    config = get_settings()
+    if not CircuitBreaker.allow():
+        raise UpstreamUnavailableError("Circuit breaker is open")
+
+    session = HttpSession.get_session()
+    deadline = time.monotonic() + config.UPSTREAM_DEADLINE
+    calls = len(body["locations"]) if body else 1
+    attempt = 0
+    try:
+        while True:
+            remaining = deadline - time.monotonic()
+            QuotaBudget.record(api_url, calls)
+            try:
+                timeout = aiohttp.ClientTimeout(total=min(config.UPSTREAM_TIMEOUT, remaining))
+                async with session.request("POST" if body else "GET", api_url, json=body,
+                                           timeout=timeout) as response:
+                    try:
+                        data = await response.json(content_type=None)
+                    except ValueError:
+                        data = {}  # gateways answer 5xx with HTML
+                    if response.status < 500:
+                        CircuitBreaker.record_success()
+                        return response.status, data
+                    reason, error = "5xx", None
+            except asyncio.TimeoutError as e:
+                reason, error = "timeout", e
+            except aiohttp.ClientConnectionError as e:
+                reason, error = "connection", e
+            except aiohttp.ClientError as e:
+                reason, error = "client", e  # truncated payload, malformed response
+
+            delay = backoff(attempt, config.UPSTREAM_BACKOFF_BASE, config.UPSTREAM_BACKOFF_MAX)
+            if attempt >= config.UPSTREAM_RETRIES or time.monotonic() + delay >= deadline:
+                CircuitBreaker.record_failure()
+                if error is not None:
+                    raise UpstreamUnavailableError(f"weatherapi {reason}: {error!r}") from error
+                return response.status, data
+            attempt += 1
+            upstream_retries.labels(instance=instance_id, reason=reason).inc()
+            log.warning("weatherapi %s, retry %s in %.2fs", reason, attempt, delay)
+            await asyncio.sleep(delay)
+    except UpstreamUnavailableError:
+        raise
+    except asyncio.CancelledError:
+        CircuitBreaker.release_probe()
+        raise
+    except BaseException:
+        # Anything else still settles the call: a half-open probe that is never settled would keep
+        # the breaker half-open and every later call rejected
+        CircuitBreaker.record_failure()
+        raise
@@ -0,0 +1,184 @@
+import asyncio
+import logging
+from datetime import date, timedelta
+from typing import Any, Dict, List, NamedTuple, Optional, Set
+
+from pydantic import ValidationError
+from telebot.async_telebot import AsyncTeleBot
+
+from config.config import Settings
+from helpers.background import run_once
+from helpers.helpers import get_response, notify_user
+from helpers.model_message import Message
+from helpers.models_weather import DayDetails, WeatherData
+from helpers.quota import QuotaBudget, CACHE_ONLY, WARM_ONLY
+from helpers.upstream import CircuitBreaker
+from helpers.weather_cache import CacheKey, WeatherCache, make_key
+from prometheus.couters import instance_id, validation_error
+
+log = logging.getLogger(__name__)
+
+
+async def cached_response(message: Message, api_url: str, bot: AsyncTeleBot, key: CacheKey,
+                          ttl: int, cache_only: bool = False) -> Optional[Dict[str, Any]]:
+    """
+    Returns the payload for key from the weather cache, calling weatherapi through get_response only on a miss.
+    Successful upstream payloads are written back to both cache tiers.
+
+    A stale entry is returned right away and refreshed in the background (stale-while-revalidate),
+    so users keep getting the last known data while weatherapi is slow or down.
+    A miss is refused instead of calling weatherapi when cache_only is set, or for every city once the
+    quota budget is down to cached cities (WARM_ONLY); the user is told and None is returned.
+    """
+    data = await cached_entry(api_url, bot, key, ttl)
+    if data is not None:
+        return data
+    if cache_only or QuotaBudget.level() >= WARM_ONLY:
+        log.info("Upstream call for %s refused by the quota budget (level %s)", key, QuotaBudget.level())
+        await notify_user(bot, message, "This data is temporarily unavailable, please try again later.")
+        return None
+    data = await get_response(message, api_url, bot)
+    if data:
+        await WeatherCache.set(key, data, QuotaBudget.ttl(ttl))
+    return data
+
+
+async def cached_entry(api_url: str, bot: AsyncTeleBot, key: CacheKey, ttl: int) -> Optional[Dict[str, Any]]:
+    """The cached payload for key, fresh or stale, or None on a miss; a stale one is refreshed in the background."""
+    entry = await WeatherCache.get(key)
+    if entry is None:
+        return None
+    if not entry.fresh and key not in _revalidating and not CircuitBreaker.is_open():
+        _revalidating.add(key)
+        run_once(f"revalidate {key.location}", revalidate(api_url, bot, key, ttl))
+    return entry.data
+
+
+# Keys with a background refresh in flight, so concurrent stale reads start only one
+_revalidating: Set[CacheKey] = set()
+
+
+async def revalidate(api_url: str, bot: AsyncTeleBot, key: CacheKey, ttl: int) -> None:
+    """Refreshes a stale entry; failures are only logged, the stale copy stays until its stale window ends."""
+    try:
+        data = await get_response(None, api_url, bot)
+        if data:
+            await WeatherCache.set(key, data, QuotaBudget.ttl(ttl))
+    finally:
+        _revalidating.discard(key)
+
+
+class WeatherRequest(NamedTuple):
+    url: str
+    key: CacheKey
+    ttl: int
+
+
+def forecast_request(config: Settings, city: str, days: int = 1) -> WeatherRequest:
+    """Current weather plus a forecast for the given number of days (forecast.json)."""
+    url = (f'http://api.weatherapi.com/v1/forecast.json?key={config.API_KEY}&'
+           f'q={city}&days={days}&aqi=no&alerts=no')
+    return WeatherRequest(url, make_key(city, f"forecast:{days}", date.today()), config.CACHE_TTL_FORECAST)
+
+
+def bulk_forecast_url(config: Settings) -> str:
+    """forecast.json for the locations POSTed in the body; served on the weatherapi plans with bulk requests."""
+    return f'http://api.weatherapi.com/v1/forecast.json?key={config.API_KEY}&q=bulk&days=1&aqi=no&alerts=no'
+
+
+def history_request(config: Settings, city: str, day: date) -> WeatherRequest:
+    """Observed weather for a past day (history.json)."""
+    url = f'https://api.weatherapi.com/v1/history.json?key={config.API_KEY}&q={city}&dt={day}'
+    return WeatherRequest(url, make_key(city, "history", day), config.CACHE_TTL_HISTORY)
+
+
+async def fetch_forecast(message: Message, bot: AsyncTeleBot, config: Settings, city: str,
+                         days: int = 1, cache_only: bool = False) -> Optional[Dict[str, Any]]:
+    request = forecast_request(config, city, days)
+    return await cached_response(message, request.url, bot, request.key, request.ttl, cache_only)
+
+
+async def fetch_forecasts(message: Message, bot: AsyncTeleBot, config: Settings, cities: List[str],
+                          cache_only: bool = False) -> Dict[str, Dict[str, Any]]:
+    """
+    Today's forecast of several cities, as fetch_forecast returns it for one, with at most one weatherapi call.
+
+    Cached cities are read from the weather cache, and the misses go into a single bulk request (q=bulk),
+    each location tagged with its position in custom_id. Every payload is written back under the key
+    fetch_forecast uses, so /current_weather of the same city is a hit afterwards.
+    Cities weatherapi could not answer, or every miss when cache_only is set, are missing from the result.
+    """
+    requests = [forecast_request(config, city) for city in cities]
+    cached = await asyncio.gather(*[cached_entry(r.url, bot, r.key, r.ttl) for r in requests])
+    found = {city: data for city, data in zip(cities, cached) if data is not None}
+    misses = [i for i, data in enumerate(cached) if data is None]
+    if not misses or cache_only:
+        return found
+    if QuotaBudget.level() >= WARM_ONLY:
+        log.info("Bulk call for %s cities refused by the quota budget (level %s)", len(misses), QuotaBudget.level())
+        await notify_user(bot, message, "Some cities are temporarily unavailable, please try again later.")
+        return found
+
+    if len(misses) == 1:
+        payloads = {misses[0]: await get_response(message, requests[misses[0]].url, bot)}
+    else:
+        body = {"locations": [{"q": cities[i], "custom_id": str(i)} for i in misses]}
+        data = await get_response(message, bulk_forecast_url(config), bot, body)
+        payloads = {}
+        for item in (data or {}).get("bulk", []):
+            query = item.get("query", {})
+            if "error" in query:
+                log.warning("Bulk forecast for %s failed: %s", query.get("q"), query["error"].get("message"))
+                continue
+            payloads[int(query["custom_id"])] = {k: v for k, v in query.items() if k not in ("custom_id", "q")}
+    for i, payload in payloads.items():
+        if payload:
+            await WeatherCache.set(requests[i].key, payload, QuotaBudget.ttl(requests[i].ttl))
+            found[cities[i]] = payload
+    return found
+
+
+async def fetch_history(message: Message, bot: AsyncTeleBot, config: Settings, city: str,
+                        day: date, cache_only: bool = False) -> Optional[Dict[str, Any]]:
+    request = history_request(config, city, day)
+    return await cached_response(message, request.url, bot, request.key, request.ttl, cache_only)
+
+
+def statistics_cache_only() -> bool:
+    """/weather_statistic and /prediction are the most expensive commands and the first to lose upstream calls."""
+    return QuotaBudget.level() >= CACHE_ONLY
+
+
+async def calculate_avg_temp_7days(message, today_date, status_user, config, bot):
+    """The mean of the daily average temperatures of the last 7 days, or None if they could not be read."""
+    avgtemp_c_7days = []
+    try:
+        for days in range(1, 8):
+            statistic_date = today_date - timedelta(days=days)
+            data = await fetch_history(message, bot, config, status_user["city"], statistic_date,
+                                       statistics_cache_only())
+            if data is None:
+                return None
+            day_details = DayDetails.model_validate(data['forecast']['forecastday'][0]['day'])
+            avgtemp_c_7days.append(day_details.avgtemp_c)
+    except ValidationError as e:
+        validation_error.labels(instance=instance_id).inc(0)
+        await bot.send_message(message.chat.id, f"Error")
+        log.error("prediction: Validation error %s", e)
+        log.debug("Exception traceback", exc_info=True)
+        return None
+    return round(sum(avgtemp_c_7days) / len(avgtemp_c_7days))
+
+
+async def calculate_avg_temp_3days(message, status_user, config, bot):
+    """The mean of the daily average temperatures of the forecast days after today, or None without any."""
+    data = await fetch_forecast(message, bot, config, status_user["city"], days=3, cache_only=statistics_cache_only())
+    if data is None:
+        return None
+    weather_data = WeatherData.model_validate(data)
+    avgtemp_c_3days = [forecast.day.avgtemp_c for forecast in weather_data.forecast.forecastday[1:]]
+    if not avgtemp_c_3days:
+        log.error("prediction: No forecast days after today for %s", status_user["city"])
+        await notify_user(bot, message, "Error requesting data. Please try again later.")
+        return None
+    return round(sum(avgtemp_c_3days) / len(avgtemp_c_3days))
@@ -0,0 +1,119 @@
+import json
+import logging
+import time
+import zlib
+from collections import OrderedDict
+from datetime import date
+from typing import Any, Dict, NamedTuple, Optional
+
+from config.config import get_settings
+from postgres.database_adapters import select_weather_cache, upsert_weather_cache, delete_expired_weather_cache
+from postgres.pool import DbPool
+from prometheus.couters import instance_id, weather_cache_requests, weather_cache_evicted_rows
+
+log = logging.getLogger(__name__)
+
+
+class CacheKey(NamedTuple):
+    location: str
+    kind: str
+    day: date
+
+
+def make_key(city: str, kind: str, day: date) -> CacheKey:
+    """Builds a cache key; city names are normalized so 'Kazan' and ' kazan' share an entry."""
+    return CacheKey(city.strip().lower(), kind, day)
+
+
+class CacheEntry(NamedTuple):
+    expires_at: int
+    data: Dict[str, Any]
+
+    @property
+    def fresh(self) -> bool:
+        return self.expires_at > time.time()
+
+
+def pack(data: Dict[str, Any]) -> bytes:
+    """Serializes an upstream payload into compact compressed bytes for the L2 table."""
+    return zlib.compress(json.dumps(data, separators=(",", ":")).encode(), 6)
+
+
+def unpack(payload: bytes) -> Dict[str, Any]:
+    return json.loads(zlib.decompress(payload))
+
+
+class WeatherCache:
+    """
+    Two-tier cache of weatherapi responses.
+
+    L1 is a bounded in-process LRU, L2 is the UNLOGGED weather_cache table shared by every worker
+    and replica. Reads go L1 -> L2, writes go to both tiers.
+    Entries are kept CACHE_STALE_SECONDS past their expiry, so a stale copy can be served
+    while weatherapi is slow or down.
+    """
+    _l1: "OrderedDict[CacheKey, CacheEntry]" = OrderedDict()
+
+    @classmethod
+    async def get(cls, key: CacheKey) -> Optional[CacheEntry]:
+        """Returns the entry for key, fresh or stale; check CacheEntry.fresh before trusting it."""
+        now = int(time.time())
+        entry = cls._l1.get(key)
+        if entry and entry.expires_at > now:
+            cls._l1.move_to_end(key)
+            weather_cache_requests.labels(instance=instance_id, tier="l1", result="hit").inc()
+            return entry
+        weather_cache_requests.labels(instance=instance_id, tier="l1", result="miss").inc()
+
+        stale_after = now - get_settings().CACHE_STALE_SECONDS
+        row = await select_weather_cache(await DbPool.get_pool(), key.location, key.kind, key.day, stale_after)
+        if row is not None:
+            entry = CacheEntry(row["expires_at"], unpack(row["payload"]))
+            cls._put_l1(key, entry.expires_at, entry.data)
+        elif entry and entry.expires_at <= stale_after:
+            entry = None
+        if entry is None:
+            weather_cache_requests.labels(instance=instance_id, tier="l2", result="miss").inc()
+        else:
+            result = "hit" if entry.expires_at > now else "stale"
+            weather_cache_requests.labels(instance=instance_id, tier="l2", result=result).inc()
+        return entry
+
+    @classmethod
+    async def set(cls, key: CacheKey, data: Dict[str, Any], ttl: int) -> None:
+        expires_at = int(time.time()) + ttl
+        cls._put_l1(key, expires_at, data)
+        await upsert_weather_cache(await DbPool.get_pool(), key.location, key.kind, key.day, pack(data), expires_at)
+
+    @classmethod
+    async def expires_soon(cls, key: CacheKey, lead: int) -> bool:
+        """
+        True if key is missing or expires within lead seconds in both tiers.
+        L2 is consulted when L1 is stale, so a refresh done by another replica is not repeated.
+        """
+        now = int(time.time())
+        entry = cls._l1.get(key)
+        if entry and entry.expires_at - now > lead:
+            return False
+        row = await select_weather_cache(await DbPool.get_pool(), key.location, key.kind, key.day, now)
+        if row is None:
+            return True
+        cls._put_l1(key, row["expires_at"], unpack(row["payload"]))
+        return row["expires_at"] - now <= lead
+
+    @classmethod
+    def _put_l1(cls, key: CacheKey, expires_at: int, data: Dict[str, Any]) -> None:
+        cls._l1[key] = CacheEntry(expires_at, data)
+        cls._l1.move_to_end(key)
+        while len(cls._l1) > get_settings().CACHE_L1_MAX_ENTRIES:
+            cls._l1.popitem(last=False)
+
+    @classmethod
+    async def purge_expired(cls) -> None:
+        """Drops entries past their stale window from L1 and deletes such L2 rows in one bulk statement."""
+        stale_after = int(time.time()) - get_settings().CACHE_STALE_SECONDS
+        for key in [k for k, entry in cls._l1.items() if entry.expires_at <= stale_after]:
+            del cls._l1[key]
+        deleted = await delete_expired_weather_cache(await DbPool.get_pool(), stale_after)
+        weather_cache_evicted_rows.labels(instance=instance_id).inc(deleted)
+        log.debug("weather_cache: %s expired rows deleted", deleted)
@@ -1,21 +1,30 @@
 import asyncpg
 import logging
-import traceback
 from fastapi.security import HTTPBasic
 from postgres.decorators import log_database_query
 from helpers.model_message import Message
 from prometheus.couters import instance_id, database_errors_counters, count_instance_errors
 from postgres.sqlfactory import SQLQueryBuilder
+from postgres.unit_of_work import UnitOfWork
+from contextlib import asynccontextmanager
 from asyncpg import Pool
-from typing import Union, Optional, List
+from typing import AsyncIterator, Dict, Union, Optional, List, Sequence, Set, Tuple
+from datetime import date
 
 log = logging.getLogger(__name__)
 security = HTTPBasic()
 
+# Commands recorded in the statistic table
+VALID_COMMANDS = ("/start", "/help", "/change_city", "/current_weather",
+                  "/weather_forecast", "/forecast_for_several_days",
+                  "/weather_statistic", "/prediction", "/subscribe", "/unsubscribe", "/hourly",
+                  "/add_favorite", "/my_cities")
+
 
 async def create_table(pool: Pool):
     """
-    This function creates two tables: user_state and statistic.
+    This function creates the tables: user_state, statistic, users_online, the weather_cache table
+    and the tables behind subscriptions, locations, the api_usage quota accounting, the statistic archive and the analytics aggregates.
     """
     log.debug("Creating table...")
     create_user_state_table = """
@@ -26,7 +35,9 @@ async def create_table(pool: Pool):
             qty_days VARCHAR(15),
             CONSTRAINT unique_chat_id UNIQUE (chat_id)
         );
+        ALTER TABLE user_state ADD COLUMN IF NOT EXISTS favorites TEXT[] NOT NULL DEFAULT '{}';
     """
+    # (chat_id, ts) serves /users_actions and /actions_count of one chat, (ts) the latest actions of all chats
     create_statistic_table = """
         CREATE TABLE IF NOT EXISTS statistic (
             id SERIAL PRIMARY KEY,
@@ -36,25 +47,114 @@ async def create_table(pool: Pool):
             chat_id INTEGER,
             action VARCHAR(50)
         );
+        CREATE INDEX IF NOT EXISTS statistic_chat_id_ts_idx ON statistic (chat_id, ts);
+        CREATE INDEX IF NOT EXISTS statistic_ts_idx ON statistic (ts);
     """
     create_users_online_table = """
     CREATE TABLE IF NOT EXISTS users_online (
             chat_id INTEGER NOT NULL UNIQUE,
             timestamp INTEGER NOT NULL
     );
+    CREATE INDEX IF NOT EXISTS users_online_timestamp_idx ON users_online (timestamp);
+    """
+    # UNLOGGED: the cache is rebuilt from weatherapi after a crash, so it does not need WAL
+    create_weather_cache_table = """
+        CREATE UNLOGGED TABLE IF NOT EXISTS weather_cache (
+            location VARCHAR(100) NOT NULL,
+            kind VARCHAR(20) NOT NULL,
+            day DATE NOT NULL,
+            payload BYTEA NOT NULL,
+            expires_at INTEGER NOT NULL,
+            PRIMARY KEY (location, kind, day)
+        );
+        CREATE INDEX IF NOT EXISTS weather_cache_expires_at_idx ON weather_cache (expires_at);
+    """
+    # due_minute is the UTC minute of the day; its index is the time bucket the scheduler reads every tick
+    create_subscriptions_table = """
+        ALTER TABLE user_state ADD COLUMN IF NOT EXISTS subscribe_time VARCHAR(15) DEFAULT 'None';
+        CREATE TABLE IF NOT EXISTS subscriptions (
+            chat_id INTEGER PRIMARY KEY,
+            city VARCHAR(50) NOT NULL,
+            local_minute SMALLINT NOT NULL,
+            due_minute SMALLINT NOT NULL,
+            last_sent DATE
+        );
+        CREATE INDEX IF NOT EXISTS subscriptions_due_minute_idx ON subscriptions (due_minute);
+        ALTER TABLE subscriptions ADD COLUMN IF NOT EXISTS language VARCHAR(8) NOT NULL DEFAULT 'en';
+    """
+    # location_id IS NULL marks a name weatherapi does not know (negative cache until expires_at)
+    create_locations_table = """
+        CREATE TABLE IF NOT EXISTS locations (
+            id INTEGER PRIMARY KEY,
+            name VARCHAR(100) NOT NULL,
+            region VARCHAR(100),
+            country VARCHAR(100),
+            lat REAL,
+            lon REAL
+        );
+        CREATE TABLE IF NOT EXISTS location_aliases (
+            alias VARCHAR(100) PRIMARY KEY,
+            location_id INTEGER,
+            expires_at INTEGER
+        );
+    """
+    # Per-chat daily action counts of statistic rows older than STATISTIC_RETENTION_DAYS
+    create_statistic_daily_table = """
+        CREATE TABLE IF NOT EXISTS statistic_daily (
+            day DATE NOT NULL,
+            chat_id INTEGER NOT NULL,
+            action VARCHAR(50) NOT NULL,
+            user_name VARCHAR(50),
+            count INTEGER NOT NULL,
+            PRIMARY KEY (chat_id, day, action)
+        );
+    """
+    # Analytics counters by day, e.g. (day, 'command', '/prediction') or (day, 'errors', 'handler'),
+    # and the chats active on each day for DAU/WAU
+    create_analytics_tables = """
+        CREATE TABLE IF NOT EXISTS analytics_daily (
+            day DATE NOT NULL,
+            metric VARCHAR(20) NOT NULL,
+            key VARCHAR(100) NOT NULL,
+            count INTEGER NOT NULL,
+            PRIMARY KEY (metric, day, key)
+        );
+        CREATE TABLE IF NOT EXISTS chat_days (
+            day DATE NOT NULL,
+            chat_id BIGINT NOT NULL,
+            PRIMARY KEY (day, chat_id)
+        );
+    """
+    # Calls made to weatherapi per month and endpoint, shared by every worker and replica
+    create_api_usage_table = """
+        CREATE TABLE IF NOT EXISTS api_usage (
+            month DATE NOT NULL,
+            endpoint VARCHAR(30) NOT NULL,
+            calls BIGINT NOT NULL DEFAULT 0,
+            PRIMARY KEY (month, endpoint)
+        );
     """
 
     try:
         async with pool.acquire() as connection:
             async with connection.transaction():
+                # Workers starting together would race on the catalog (duplicate pg_type/pg_class rows);
+                # the first one creates everything, the others wait and find it in place
+                await connection.execute("SELECT pg_advisory_xact_lock(hashtext('create_table'))")
                 await connection.execute(create_user_state_table)  # Execute user_state table creation
                 await connection.execute(create_statistic_table)  # Execute statistic table creation
                 await connection.execute(create_users_online_table)
+                await connection.execute(create_weather_cache_table)
+                await connection.execute(create_subscriptions_table)
+                await connection.execute(create_locations_table)
+                await connection.execute(create_api_usage_table)
+                await connection.execute(create_statistic_daily_table)
+                await connection.execute(create_analytics_tables)
 
         log.info("Tables created successfully")
     except Exception as e:
-        log.error(f"An error occurred during table creation: {e}")
-        log.debug("Exception traceback:", traceback.format_exc())
+        log.error("An error occurred during table creation: %s", e)
+        log.debug("Exception traceback", exc_info=True)
         exit(1)  # Exit the program with error code 1
 
 
@@ -62,6 +162,7 @@ async def create_table(pool: Pool):
 async def sql_update_user_state_bd(bot, pool: asyncpg.Pool, message, fields: str, new_state: str = "waiting_value"):
     """
     Update the user state in the database by setting the given fields to the new state.
+    Inside a webhook update the change is queued in the update's unit of work instead.
 
     Args:
         bot: The asynchronous Telegram bot instance.
@@ -74,6 +175,12 @@ async def sql_update_user_state_bd(bot, pool: asyncpg.Pool, message, fields: str
         Exception: If an error occurs during the process.
     """
     try:
+        unit = UnitOfWork.active()
+        if unit is not None:
+            # Written with the rest of the update's changes when tg_webhooks finishes
+            unit.set_state(message.chat.id, fields, new_state)
+            log.debug("User %s %s = %s queued", message.chat.id, fields, new_state)
+            return
         # Build the query to update the user state
         conditions = {
             "chat_id": ("=", message.chat.id),
@@ -83,20 +190,21 @@ async def sql_update_user_state_bd(bot, pool: asyncpg.Pool, message, fields: str
         # Execute the query and check the result
         await execute_query(pool, builder.sql, *builder.args, fetch=True)
         if new_state == "waiting_value":
-            log.info(f"User {message.chat.id} state waiting_value for {fields}")
+            log.info("User %s state waiting_value for %s", message.chat.id, fields)
         else:
-            log.info(f"User {message.chat.id} {fields} updated successfully")
+            log.info("User %s %s updated successfully", message.chat.id, fields)
     except Exception as e:
         count_instance_errors.labels(instance=instance_id).inc()
         await bot.send_message(message.chat.id, "An error occurred. Please try again later.")
-        log.error(f"An error occurred during user state adding: {e}")
-        log.debug("Exception traceback:", traceback.format_exc())
+        log.error("An error occurred during user state adding: %s", e)
+        log.debug("Exception traceback", exc_info=True)
 
 
 @log_database_query
 async def add_statistic_bd(pool: asyncpg.Pool, message: Message) -> None:
     """
     Add a statistic record to the database based on the message received.
+    Inside a webhook update the record is queued in the update's unit of work instead.
 
     Args:
         pool (asyncpg.Pool): The connection pool to the database.
@@ -109,12 +217,13 @@ async def add_statistic_bd(pool: asyncpg.Pool, message: Message) -> None:
         Exception: If an error occurs during the process.
     """
     try:
-        # List of valid commands
-        valid_commands = ["/start", "/help", "/change_city", "/current_weather",
-                          "/weather_forecast", "/forecast_for_several_days",
-                          "/weather_statistic", "/prediction"]
         # Check if the message is a valid command
-        if message.text in valid_commands:
+        if message.text in VALID_COMMANDS:
+            unit = UnitOfWork.active()
+            if unit is not None:
+                # Written with the rest of the update's changes when tg_webhooks finishes
+                unit.add_statistic(message.date, message.from_user.first_name, message.chat.id, message.text)
+                return
             # Insert the statistic data into the database
             fields = {"ts": message.date, "user_name": message.from_user.first_name,
                       "chat_id": message.chat.id, "action": message.text}
@@ -124,8 +233,283 @@ async def add_statistic_bd(pool: asyncpg.Pool, message: Message) -> None:
             log.debug("Statistic added successfully")
     except Exception as e:
         count_instance_errors.labels(instance=instance_id).inc()
-        log.error(f"An error occurred during statistic adding: {e}")
-        log.error("Exception traceback:", traceback.format_exc())
+        log.error("An error occurred during statistic adding: %s", e)
+        log.error("Exception traceback", exc_info=True)
+
+
+@asynccontextmanager
+async def unit_of_work(pool: asyncpg.Pool) -> AsyncIterator[UnitOfWork]:
+    """
+    Collects the user_state changes and statistic events made inside the block and writes them
+    with one statement when it exits. Nothing is written if the block raises.
+    """
+    unit = UnitOfWork()
+    token = unit.open()
+    try:
+        yield unit
+    finally:
+        unit.close(token)
+    sql, args = unit.build()
+    if sql:
+        await execute_query(pool, sql, *args, execute=True)
+        log.debug("Unit of work flushed: %s states, %s statistic events", len(unit.state), len(unit.statistic))
+
+
+@asynccontextmanager
+async def advisory_lock(pool: asyncpg.Pool, name: str) -> AsyncIterator[None]:
+    """
+    Holds a session-level advisory lock named name for the duration of the block, on a connection of its own,
+    so one worker or replica at a time runs it.
+    """
+    async with pool.acquire() as connection:
+        await connection.execute("SELECT pg_advisory_lock(hashtext($1))", name)
+        try:
+            yield
+        finally:
+            await connection.execute("SELECT pg_advisory_unlock(hashtext($1))", name)
+
+
+@asynccontextmanager
+async def try_advisory_lock(pool: asyncpg.Pool, name: str) -> AsyncIterator[bool]:
+    """
+    Like advisory_lock, but does not wait: the block gets False when another worker or replica holds the lock,
+    so periodic work runs in one process at a time and the others skip their tick.
+    """
+    async with pool.acquire() as connection:
+        acquired = await connection.fetchval("SELECT pg_try_advisory_lock(hashtext($1))", name)
+        try:
+            yield acquired
+        finally:
+            if acquired:
+                await connection.execute("SELECT pg_advisory_unlock(hashtext($1))", name)
+
+
+@log_database_query
+async def select_or_create_user_state(pool: asyncpg.Pool, fields: Dict[str, str]) -> Optional[asyncpg.Record]:
+    """
+    Return the user_state row of fields["chat_id"], inserting it with the given values first if it is missing.
+
+    One statement: the insert returns the new row, the select returns an existing one (it reads the snapshot
+    from before the insert, so never both), and an existing row is not rewritten.
+    It returns neither when another update for a new chat inserted the row concurrently: the insert waits for
+    that transaction and does nothing, and the snapshot predates it. The row is then read again.
+    """
+    returned = [column for column in fields if column != "chat_id"]
+    inserted = SQLQueryBuilder("user_state")
+    inserted.insert(fields, on_conflict="chat_id").returning(returned)
+    sql = f"""
+        WITH inserted AS ({inserted.sql})
+        SELECT {", ".join(returned)} FROM inserted
+        UNION ALL
+        SELECT {", ".join(returned)} FROM user_state WHERE chat_id = ${list(fields).index("chat_id") + 1}
+    """
+    row = await execute_query(pool, sql, *inserted.args, fetchrow=True)
+    if row is None:
+        existing = SQLQueryBuilder("user_state")
+        existing.select(returned).where({"chat_id": ("=", fields["chat_id"])})
+        row = await execute_query(pool, existing.sql, *existing.args, fetchrow=True)
+    return row
+
+
+@log_database_query
+async def add_favorite(pool: asyncpg.Pool, chat_id: int, city: str, limit: int) -> Optional[List[str]]:
+    """
+    Append a city to the favorites of a chat unless it is already there or the list holds limit cities.
+
+    Returns:
+        The new favorites, or None if nothing was added.
+    """
+    query = """
+        UPDATE user_state SET favorites = array_append(favorites, $2)
+        WHERE chat_id = $1 AND NOT $2 = ANY(favorites) AND cardinality(favorites) < $3
+        RETURNING favorites
+    """
+    return await execute_query(pool, query, chat_id, city, limit, fetchval=True)
+
+
+@log_database_query
+async def remove_favorite(pool: asyncpg.Pool, chat_id: int, city: str) -> Optional[List[str]]:
+    """Remove a city from the favorites of a chat and return what is left."""
+    query = "UPDATE user_state SET favorites = array_remove(favorites, $2) WHERE chat_id = $1 RETURNING favorites"
+    return await execute_query(pool, query, chat_id, city, fetchval=True)
+
+
+async def select_weather_cache(pool: asyncpg.Pool, location: str, kind: str, day: date,
+                               expired_after: int) -> Optional[asyncpg.Record]:
+    """
+    Fetch a weather_cache row that expires after the given timestamp.
+
+    Args:
+        pool (asyncpg.Pool): The connection pool to the database.
+        location (str): The normalized location.
+        kind (str): The kind of the cached payload (forecast:N, history).
+        day (date): The day the payload belongs to.
+        expired_after (int): Unix timestamp; the current time for fresh rows, earlier to accept stale ones.
+
+    Returns:
+        The row with payload and expires_at, or None on a miss or a database error.
+    """
+    conditions = {
+        "location": ("=", location),
+        "kind": ("=", kind),
+        "day": ("=", day),
+        "expires_at": (">", expired_after),
+    }
+    builder = SQLQueryBuilder("weather_cache")
+    builder.select(["payload", "expires_at"]).where(conditions)
+    return await execute_query(pool, builder.sql, *builder.args, fetchrow=True)
+
+
+async def upsert_weather_cache(pool: asyncpg.Pool, location: str, kind: str, day: date, payload: bytes,
+                               expires_at: int) -> None:
+    """
+    Insert or refresh a weather_cache row.
+    """
+    fields = {"location": location, "kind": kind, "day": day, "payload": payload, "expires_at": expires_at}
+    builder = SQLQueryBuilder("weather_cache")
+    builder.insert(fields, on_conflict="location, kind, day", update_fields=["payload", "expires_at"])
+    await execute_query(pool, builder.sql, *builder.args, execute=True)
+
+
+async def delete_expired_weather_cache(pool: asyncpg.Pool, expired_before: int) -> int:
+    """
+    Delete every weather_cache row expired before the given timestamp in one statement.
+
+    Returns:
+        int: The number of deleted rows.
+    """
+    builder = SQLQueryBuilder("weather_cache")
+    builder.delete().where({"expires_at": ("<=", expired_before)})
+    status = await execute_query(pool, builder.sql, *builder.args, execute=True)
+    # asyncpg returns the command tag, e.g. "DELETE 42"
+    return int(status.split()[-1]) if status else 0
+
+
+@log_database_query
+async def upsert_subscription(pool: asyncpg.Pool, chat_id: int, city: str, local_minute: int,
+                              due_minute: int, language: str) -> None:
+    """
+    Create or replace the daily forecast subscription of a chat.
+
+    Args:
+        pool (asyncpg.Pool): The connection pool to the database.
+        chat_id (int): The chat to deliver to.
+        city (str): The city of the forecast.
+        local_minute (int): Delivery time as minute of the day in the city's local time.
+        due_minute (int): The same time as minute of the day in UTC.
+        language (str): The language the forecast is rendered in.
+    """
+    fields = {"chat_id": chat_id, "city": city, "local_minute": local_minute, "due_minute": due_minute,
+              "last_sent": None, "language": language}
+    builder = SQLQueryBuilder("subscriptions")
+    builder.insert(fields, on_conflict="chat_id",
+                   update_fields=["city", "local_minute", "due_minute", "last_sent", "language"])
+    await execute_query(pool, builder.sql, *builder.args, execute=True)
+
+
+@log_database_query
+async def delete_subscription(pool: asyncpg.Pool, chat_id: int) -> None:
+    builder = SQLQueryBuilder("subscriptions")
+    builder.delete().where({"chat_id": ("=", chat_id)})
+    await execute_query(pool, builder.sql, *builder.args, execute=True)
+
+
+@log_database_query
+async def claim_due_subscriptions(pool: asyncpg.Pool, minutes: List[int], day: date) -> List[asyncpg.Record]:
+    """
+    Atomically mark the subscriptions due in the given UTC minutes as sent for day and return them.
+    Only rows not yet sent for day are claimed, so several workers or replicas never deliver twice.
+    """
+    query = """
+        UPDATE subscriptions SET last_sent = $1
+        WHERE due_minute = ANY($2::smallint[]) AND (last_sent IS NULL OR last_sent < $1)
+        RETURNING chat_id, city, local_minute, due_minute, language
+    """
+    return await execute_query(pool, query, day, minutes, fetch=True) or []
+
+
+@log_database_query
+async def release_subscriptions(pool: asyncpg.Pool, chat_ids: List[int], day: date) -> None:
+    """
+    Undo claim_due_subscriptions for chats whose delivery failed, so a later tick can claim them again.
+    Only rows still marked sent for day are reset.
+    """
+    builder = SQLQueryBuilder("subscriptions")
+    builder.update({"last_sent": None}).where({"chat_id": ("= ANY", chat_ids, "int[]"), "last_sent": ("=", day)})
+    await execute_query(pool, builder.sql, *builder.args, execute=True)
+
+
+@log_database_query
+async def rebucket_subscriptions(pool: asyncpg.Pool, chat_ids: List[int], utc_offset: int) -> None:
+    """
+    Recompute due_minute of the given chats after the UTC offset of their city changed (DST).
+    """
+    query = """
+        UPDATE subscriptions SET due_minute = ((local_minute - $1) % 1440 + 1440) % 1440
+        WHERE chat_id = ANY($2::int[])
+    """
+    await execute_query(pool, query, utc_offset, chat_ids, execute=True)
+
+
+async def select_location_alias(pool: asyncpg.Pool, alias: str) -> Optional[asyncpg.Record]:
+    """
+    Look up a normalized alias together with its location.
+
+    Returns:
+        The row (location_id, expires_at, id, name, region, country, lat, lon), or None if the alias is unknown.
+        location_id is NULL for negative-cache entries.
+    """
+    builder = SQLQueryBuilder("location_aliases LEFT JOIN locations ON locations.id = location_aliases.location_id")
+    builder.select(["location_id", "expires_at", "id", "name", "region", "country", "lat", "lon"])
+    builder.where({"alias": ("=", alias)})
+    return await execute_query(pool, builder.sql, *builder.args, fetchrow=True)
+
+
+async def select_locations(pool: asyncpg.Pool, limit: int) -> List[asyncpg.Record]:
+    builder = SQLQueryBuilder("locations")
+    builder.select(["id", "name", "region", "country", "lat", "lon"]).limit(limit)
+    return await execute_query(pool, builder.sql, *builder.args, fetch=True) or []
+
+
+async def upsert_location(pool: asyncpg.Pool, fields: dict) -> None:
+    builder = SQLQueryBuilder("locations")
+    builder.insert(fields, on_conflict="id", update_fields=["name", "region", "country", "lat", "lon"])
+    await execute_query(pool, builder.sql, *builder.args, execute=True)
+
+
+async def upsert_location_alias(pool: asyncpg.Pool, alias: str, location_id: Optional[int],
+                                expires_at: Optional[int]) -> None:
+    fields = {"alias": alias, "location_id": location_id, "expires_at": expires_at}
+    builder = SQLQueryBuilder("location_aliases")
+    builder.insert(fields, on_conflict="alias", update_fields=["location_id", "expires_at"])
+    await execute_query(pool, builder.sql, *builder.args, execute=True)
+
+
+async def select_popular_cities(pool: asyncpg.Pool, since: int, limit: int) -> List[str]:
+    """
+    Most requested cities: first by recent statistic activity of their users, then by how many users hold them.
+
+    Args:
+        pool (asyncpg.Pool): The connection pool to the database.
+        since (int): Unix timestamp where recent activity starts.
+        limit (int): The maximum number of cities.
+
+    Returns:
+        List[str]: Lower-cased city names, most popular first.
+    """
+    fields = ["LOWER(city) AS city", "COUNT(*) AS hits"]
+    recent = SQLQueryBuilder("statistic JOIN user_state USING (chat_id)")
+    recent.select(fields).where({"ts": (">", since), "city": ("<>", "waiting_value")})
+    recent.group_by(["LOWER(city)"]).order_by("hits", "DESC").limit(limit)
+    holders = SQLQueryBuilder("user_state")
+    holders.select(fields).where({"city": ("<>", "waiting_value")})
+    holders.group_by(["LOWER(city)"]).order_by("hits", "DESC").limit(limit)
+
+    cities = []
+    for builder in (recent, holders):
+        rows = await execute_query(pool, builder.sql, *builder.args, fetch=True) or []
+        cities.extend(row["city"] for row in rows if row["city"] not in cities)
+    return cities[:limit]
 
 
 async def execute_query(
@@ -178,17 +562,187 @@ async def execute_query(
                         result = None
             return result
         except asyncpg.PostgresError as e:
-            log.error(f"Database error: {e} {traceback.format_exc()}")
+            log.error("Database error: %s", e, exc_info=True)
             database_errors_counters[0].labels(instance=instance_id).inc()  # database_connection_errors
             retries += 1
         except asyncpg.QueryCanceledError as e:
-            log.error(f"Query canceled error: {e} {traceback.format_exc()}")
+            log.error("Query canceled error: %s", e, exc_info=True)
             database_errors_counters[1].labels(instance=instance_id).inc()  # database_query_errors
             retries += 1
         except RuntimeError as e:
-            log.error(f"Runtime error: {e} {traceback.format_exc()}")
+            log.error("Runtime error: %s", e, exc_info=True)
             database_errors_counters[3].labels(instance=instance_id).inc()
             retries += 1
         except Exception as e:
-            log.error(f"Unexpected error: {e} {traceback.format_exc()} {query} {args}")
+            log.error("Unexpected error: %s %s %s", e, query, args, exc_info=True)
             database_errors_counters[2].labels(instance=instance_id).inc()  # database_other_errors
+
+
+async def execute_many(pool: asyncpg.Pool, query: str, rows: List[Sequence]) -> None:
+    """
+    Run one statement for every row of arguments with executemany: a single prepare and one round trip
+    for all rows, in one transaction. Prefer a multi-row statement (insert_many, insert_unnest) when the
+    rows fit one; this is for statements that cannot be written that way.
+
+    Raises:
+        asyncpg.PostgresError: If the statement fails for any row; no row is written then.
+    """
+    try:
+        async with pool.acquire() as connection:
+            async with connection.transaction():
+                await connection.executemany(query, rows)
+        log.debug("executemany: %s rows", len(rows))
+    except asyncpg.PostgresError as e:
+        log.error("Database error in executemany: %s", e, exc_info=True)
+        database_errors_counters[1].labels(instance=instance_id).inc()  # database_query_errors
+        raise
+
+
+async def copy_records(pool: asyncpg.Pool, table: str, columns: List[str], records: List[Sequence]) -> int:
+    """
+    Append rows with COPY FROM STDIN, the fastest way to load many rows. COPY has no ON CONFLICT,
+    so it is for append-only tables; use insert_unnest for upserts.
+
+    Returns:
+        int: The number of copied rows.
+
+    Raises:
+        asyncpg.PostgresError: If the copy fails; no row is written then.
+    """
+    try:
+        async with pool.acquire() as connection:
+            status = await connection.copy_records_to_table(table, records=records, columns=columns)
+        log.debug("copy into %s: %s", table, status)
+        # asyncpg returns the command tag, e.g. "COPY 42"
+        return int(status.split()[-1]) if status else 0
+    except asyncpg.PostgresError as e:
+        log.error("Database error in copy into %s: %s", table, e, exc_info=True)
+        database_errors_counters[1].labels(instance=instance_id).inc()  # database_query_errors
+        raise
+
+
+@log_database_query
+async def add_api_usage(pool: asyncpg.Pool, month: date, calls: Dict[str, int]) -> None:
+    """
+    Add weatherapi calls to the monthly per-endpoint counters.
+
+    Args:
+        pool (asyncpg.Pool): The connection pool to the database.
+        month (date): The first day of the month the calls belong to.
+        calls (Dict[str, int]): Calls made since the previous flush, by endpoint.
+    """
+    if not calls:
+        return
+    builder = SQLQueryBuilder("api_usage")
+    builder.insert_many(["month", "endpoint", "calls"], [(month, endpoint, count) for endpoint, count in calls.items()],
+                        on_conflict="month, endpoint", update_fields={"calls": "api_usage.calls + EXCLUDED.calls"})
+    async with pool.acquire() as connection:
+        await connection.execute(builder.sql, *builder.args)
+
+
+@log_database_query
+async def select_api_usage(pool: asyncpg.Pool, month: date) -> Optional[List[asyncpg.Record]]:
+    """
+    Fetch the weatherapi calls of a month by endpoint, as counted by every replica.
+
+    Returns:
+        Rows with endpoint and calls, or None on a database error.
+    """
+    builder = SQLQueryBuilder("api_usage")
+    builder.select(["endpoint", "calls"]).where({"month": ("=", month)})
+    return await execute_query(pool, builder.sql, *builder.args, fetch=True)
+
+
+@log_database_query
+async def archive_statistic_batch(pool: asyncpg.Pool, before_ts: int, batch_size: int) -> int:
+    """
+    Move up to batch_size statistic rows older than before_ts into statistic_daily, in one statement.
+
+    The oldest rows are picked through the primary key, then deleted and added to the per-chat daily
+    counts of statistic_daily; deleting and archiving happen atomically.
+
+    Args:
+        pool (asyncpg.Pool): The connection pool to the database.
+        before_ts (int): Unix timestamp; older rows are archived.
+        batch_size (int): The maximum number of rows to move.
+
+    Returns:
+        int: The number of archived rows, 0 when nothing is left to archive.
+    """
+    sql = """
+        WITH batch AS (
+            DELETE FROM statistic WHERE id IN (
+                SELECT id FROM statistic WHERE ts < $1 ORDER BY id LIMIT $2
+            )
+            RETURNING ts, chat_id, user_name, action
+        ), archived AS (
+            INSERT INTO statistic_daily (day, chat_id, action, user_name, count)
+            SELECT (to_timestamp(ts) AT TIME ZONE 'UTC')::date AS day, chat_id, action, max(user_name), count(*)
+            FROM batch GROUP BY day, chat_id, action
+            ON CONFLICT (chat_id, day, action)
+            DO UPDATE SET count = statistic_daily.count + EXCLUDED.count, user_name = EXCLUDED.user_name
+        )
+        SELECT count(*) FROM batch
+    """
+    return await execute_query(pool, sql, before_ts, batch_size, fetchval=True) or 0
+
+
+@log_database_query
+async def upsert_users_online(pool: asyncpg.Pool, last_seen: Dict[int, int]) -> None:
+    """
+    Store the last-seen timestamps of many chats with one multi-row upsert.
+
+    Rows are written in chat_id order so concurrent flushes from several workers lock them in the same order.
+    A timestamp never moves backwards, whichever worker flushes last.
+
+    Args:
+        pool (asyncpg.Pool): The connection pool to the database.
+        last_seen (Dict[int, int]): Unix timestamp of the latest update by chat_id.
+    """
+    builder = SQLQueryBuilder("users_online")
+    builder.insert_unnest({"chat_id": "integer", "timestamp": "integer"}, sorted(last_seen.items()),
+                          on_conflict="chat_id",
+                          update_fields={"timestamp": "GREATEST(users_online.timestamp, EXCLUDED.timestamp)"})
+    async with pool.acquire() as connection:
+        await connection.execute(builder.sql, *builder.args)
+
+
+@log_database_query
+async def count_users_online(pool: asyncpg.Pool, since: int) -> Optional[int]:
+    """
+    Count the chats seen since the given unix timestamp, by every worker and replica.
+
+    Returns:
+        The number of chats, or None on a database error.
+    """
+    builder = SQLQueryBuilder("users_online")
+    builder.select(["COUNT(*)"]).where({"timestamp": (">=", since)})
+    return await execute_query(pool, builder.sql, *builder.args, fetchval=True)
+
+
+@log_database_query
+async def add_analytics(pool: asyncpg.Pool, counts: Dict[Tuple[date, str, str], int],
+                        chat_days: Set[Tuple[date, int]]) -> None:
+    """
+    Add counted events to analytics_daily and active chats to chat_days, in one transaction.
+
+    Args:
+        pool (asyncpg.Pool): The connection pool to the database.
+        counts: Event counts by (day, metric, key) since the previous flush.
+        chat_days: (day, chat_id) pairs seen since the previous flush.
+    """
+    statements = []
+    if counts:
+        builder = SQLQueryBuilder("analytics_daily")
+        builder.insert_unnest({"day": "date", "metric": "varchar", "key": "varchar", "count": "integer"},
+                              [(*key, counts[key]) for key in sorted(counts)], on_conflict="metric, day, key",
+                              update_fields={"count": "analytics_daily.count + EXCLUDED.count"})
+        statements.append(builder)
+    if chat_days:
+        builder = SQLQueryBuilder("chat_days")
+        builder.insert_unnest({"day": "date", "chat_id": "bigint"}, sorted(chat_days), on_conflict="day, chat_id")
+        statements.append(builder)
+    async with pool.acquire() as connection:
+        async with connection.transaction():
+            for builder in statements:
+                await connection.execute(builder.sql, *builder.args)
@@ -7,8 +7,8 @@ log = logging.getLogger(__name__)
 def log_database_query(func):
     @functools.wraps(func)
     async def wrapper(*args, **kwargs):
-        log.debug(f"Query is being made to the database: {func.__name__}")
+        log.debug("Query is being made to the database: %s", func.__name__)
         result = await func(*args, **kwargs)
-        log.debug(f"Database query completed: {func.__name__}")
+        log.debug("Database query completed: %s", func.__name__)
         return result
     return wrapper
@@ -1,6 +1,5 @@
 import asyncpg
-import traceback
-from config.config import get_settings
+from config.config import get_settings, worker_share
 
 import logging
 
@@ -10,6 +9,7 @@ log = logging.getLogger(__name__)
 async def create_pool() -> asyncpg.pool.Pool:
     """
     Creates a connection pool to a PostgreSQL database.
+    The pool size is the worker's share of DB_POOL_MAX_SIZE, so N workers never open more connections in total.
 
     Returns:
         asyncpg.pool.Pool: The connection pool to the database.
@@ -19,8 +19,8 @@ async def create_pool() -> asyncpg.pool.Pool:
         dsn = f"postgresql://{settings.POSTGRES_USER}:{settings.POSTGRES_PASSWORD}@{settings.POOL_HOST_DB}/{settings.POSTGRES_DB}"
         pool = await asyncpg.create_pool(
             dsn=dsn,
-            min_size=3,
-            max_size=100,
+            min_size=min(settings.DB_POOL_MIN_SIZE, worker_share(settings.DB_POOL_MAX_SIZE)),
+            max_size=worker_share(settings.DB_POOL_MAX_SIZE),
             max_inactive_connection_lifetime=60,
             max_queries=1000,
 
@@ -29,5 +29,5 @@ async def create_pool() -> asyncpg.pool.Pool:
         return pool
     except Exception as e:
         log.error("Failed to connect to the database: %s", str(e))
-        log.error("Exception traceback:\n%s", traceback.format_exc())
+        log.error("Exception traceback", exc_info=True)
         exit(1)
@@ -1,17 +1,23 @@
 import logging
-from typing import Optional, List
-import traceback
+from typing import Optional, List, Sequence, Union
 from typing import Dict, Tuple, Any
 from prometheus.couters import instance_id, count_instance_errors
 
 log = logging.getLogger(__name__)
 
+# Postgres accepts at most this many bind parameters in one statement
+MAX_PARAMETERS = 32767
+
+# A condition is (op, value) or (op, value, cast); a column may have a list of them, joined with AND
+Condition = Union[Tuple[str, Any], Tuple[str, Any, str]]
+
 
 class SQLQueryBuilder:
     def __init__(self, table_name: str):
         self.table_name = table_name
         self.sql = ""
         self.args = []
+        self.has_where = False
 
     def select(self, fields: Optional[List[str]] = None) -> 'SQLQueryBuilder':
         if fields:
@@ -25,12 +31,28 @@ class SQLQueryBuilder:
         self.sql = f"DELETE FROM {self.table_name}"
         return self
 
-    def where(self, conditions: Dict[str, Tuple[str, Any]]) -> 'SQLQueryBuilder':
-        where_clause = " AND ".join(
-            [f"{key} {op} ${i + len(self.args) + 1}" for i, (key, (op, _)) in enumerate(conditions.items())]
-        )
-        self.sql = f"{self.sql} WHERE {where_clause}"
-        self.args.extend([value for _, (_, value) in conditions.items()])
+    def where(self, conditions: Dict[str, Union[Condition, List[Condition]]]) -> 'SQLQueryBuilder':
+        """
+        Adds `key op $n` conditions joined with AND; a second call extends the same WHERE clause.
+
+        A list of conditions applies all of them to one column: {"ts": [(">", start), ("<", end)]}.
+        A third element casts the parameter, and an ANY/ALL operator takes a list:
+        {"chat_id": ("= ANY", chat_ids, "bigint[]")} gives `chat_id = ANY($1::bigint[])`.
+        """
+        clauses = []
+        for key, condition in conditions.items():
+            for op, value, *cast in (condition if isinstance(condition, list) else [condition]):
+                self.args.append(value)
+                placeholder = f"${len(self.args)}" + (f"::{cast[0]}" if cast else "")
+                if op.upper().endswith(("ANY", "ALL")):
+                    clauses.append(f"{key} {op}({placeholder})")
+                else:
+                    clauses.append(f"{key} {op} {placeholder}")
+        if not clauses:
+            return self
+        keyword = " AND " if self.has_where else " WHERE "
+        self.sql = f"{self.sql}{keyword}{' AND '.join(clauses)}"
+        self.has_where = True
         return self
 
     def limit(self, limit: int) -> 'SQLQueryBuilder':
@@ -55,26 +77,73 @@ class SQLQueryBuilder:
         return self
 
     def insert(self, fields: Dict[str, Any], on_conflict: Optional[str] = None,
-               update_fields: Optional[List[str]] = None) -> 'SQLQueryBuilder':
+               update_fields: Optional[Union[List[str], Dict[str, str]]] = None) -> 'SQLQueryBuilder':
         columns = ", ".join(fields.keys())
         placeholders = ', '.join([f"${i + 1}" for i in range(len(fields))])
         sql = f"INSERT INTO {self.table_name} ({columns}) VALUES ({placeholders})"
-        if on_conflict:
-            if update_fields:
-                conflict_update = ", ".join(
-                    [f"{col} = EXCLUDED.{col}" for col in update_fields]
-                )
-                sql += f" ON CONFLICT ({on_conflict}) DO UPDATE SET {conflict_update}"
-            else:
-                sql += f" ON CONFLICT ({on_conflict}) DO NOTHING"
         self.args = list(fields.values())
-        self.sql = sql
+        self.sql = sql + self._on_conflict(on_conflict, update_fields)
+        return self
+
+    def insert_many(self, columns: List[str], rows: Sequence[Sequence[Any]], on_conflict: Optional[str] = None,
+                    update_fields: Optional[Union[List[str], Dict[str, str]]] = None) -> 'SQLQueryBuilder':
+        """
+        One INSERT with a VALUES tuple per row. Each value is a parameter, so the rows must stay under
+        MAX_PARAMETERS values; insert_unnest has no such limit.
+        An upsert must not contain the same conflict key twice, Postgres rejects a row updated twice.
+        """
+        if not rows:
+            raise ValueError("insert_many needs at least one row")
+        if any(len(row) != len(columns) for row in rows):
+            raise ValueError(f"Every row must have {len(columns)} values")
+        if len(rows) * len(columns) > MAX_PARAMETERS:
+            raise ValueError(f"{len(rows) * len(columns)} parameters exceed the limit of {MAX_PARAMETERS}")
+        width = len(columns)
+        values = ", ".join(
+            "(" + ", ".join(f"${r * width + c + 1}" for c in range(width)) + ")" for r in range(len(rows))
+        )
+        self.sql = (f"INSERT INTO {self.table_name} ({', '.join(columns)}) VALUES {values}"
+                    + self._on_conflict(on_conflict, update_fields))
+        self.args = [value for row in rows for value in row]
         return self
 
+    def insert_unnest(self, columns: Dict[str, str], rows: Sequence[Sequence[Any]], on_conflict: Optional[str] = None,
+                      update_fields: Optional[Union[List[str], Dict[str, str]]] = None) -> 'SQLQueryBuilder':
+        """
+        One INSERT ... SELECT FROM unnest() with an array parameter per column, so the statement text and its
+        plan are the same for any number of rows. columns maps each column to its Postgres type.
+        """
+        placeholders = ", ".join(f"${i + 1}::{pg_type}[]" for i, pg_type in enumerate(columns.values()))
+        self.sql = (f"INSERT INTO {self.table_name} ({', '.join(columns)}) SELECT * FROM unnest({placeholders})"
+                    + self._on_conflict(on_conflict, update_fields))
+        self.args = [list(column) for column in zip(*rows)] if rows else [[] for _ in columns]
+        return self
+
+    def returning(self, columns: List[str]) -> 'SQLQueryBuilder':
+        """
+        Returns the written rows. After an upsert with DO NOTHING, rows that already existed are not returned;
+        with DO UPDATE both inserted and updated rows are.
+        """
+        self.sql = f"{self.sql} RETURNING {', '.join(columns)}"
+        return self
+
+    def _on_conflict(self, on_conflict: Optional[str],
+                     update_fields: Optional[Union[List[str], Dict[str, str]]]) -> str:
+        """update_fields copies the listed columns from EXCLUDED, or sets each key to its SQL expression."""
+        if not on_conflict:
+            return ""
+        if not update_fields:
+            return f" ON CONFLICT ({on_conflict}) DO NOTHING"
+        if isinstance(update_fields, dict):
+            conflict_update = ", ".join([f"{col} = {expression}" for col, expression in update_fields.items()])
+        else:
+            conflict_update = ", ".join([f"{col} = EXCLUDED.{col}" for col in update_fields])
+        return f" ON CONFLICT ({on_conflict}) DO UPDATE SET {conflict_update}"
+
     def build(self) -> Tuple[str, List[Any]]:
         try:
             return self.sql, self.args
         except Exception as e:
             count_instance_errors.labels(instance=instance_id).inc()
             log.error("An error occurred: %s", str(e))
-            log.debug(f"Exception traceback:\n{traceback.format_exc()}")
+            log.debug("Exception traceback", exc_info=True)
@@ -0,0 +1,214 @@
+"""
+Query-plan regression tests: the queries the app builds run as EXPLAIN (ANALYZE, BUFFERS) against a
+synthetic dataset, and fail on a sequential scan of a large table or when they go over a buffer or time budget.
+
+The suite needs Postgres and is skipped otherwise:
+    PLAN_TEST_DSN=postgresql://postgres@localhost/postgres python -m pytest postgres/tests/test_query_plans.py
+or, with initdb and pg_ctl on PATH, a throwaway cluster is started:
+    PLAN_TEST_START_POSTGRES=1 python -m pytest postgres/tests/test_query_plans.py
+
+The tables are created by create_table in their own schema, which is dropped afterwards.
+PLAN_TEST_ROWS statistic rows (20 million by default) are spread over PLAN_TEST_CHATS chats.
+"""
+import asyncio
+import json
+import os
+import shutil
+import socket
+import subprocess
+import tempfile
+from contextlib import asynccontextmanager
+
+import asyncpg
+import pytest
+
+from handlers.db_query_builder import execute_users_actions, execute_actions_count
+from helpers.check_values import check_chat_id
+from helpers.model_message import Message
+from postgres.database_adapters import (VALID_COMMANDS, create_table, sql_update_user_state_bd, add_statistic_bd,
+                                        unit_of_work, add_favorite, remove_favorite)
+
+SCHEMA = "plan_test"
+ROWS = int(os.environ.get("PLAN_TEST_ROWS", 20_000_000))
+CHATS = int(os.environ.get("PLAN_TEST_CHATS", 1_000_000))
+BUFFER_BUDGET = int(os.environ.get("PLAN_TEST_BUFFERS", 1000))  # shared blocks hit or read per statement
+TIME_BUDGET = float(os.environ.get("PLAN_TEST_MS", 100))  # execution time per statement, ms
+# A sequential scan of these is a missing or unusable index
+LARGE_TABLES = {"statistic", "user_state", "statistic_daily"}
+# Unix time of the first synthetic statistic row; one row per second after it
+BASE_TS = 1_700_000_000
+CHAT_ID = 42
+
+
+def message(chat_id: int, text: str) -> Message:
+    return Message.model_validate({
+        "message_id": 1, "date": BASE_TS + ROWS, "text": text, "chat": {"id": chat_id, "type": "private"},
+        "from": {"id": chat_id, "is_bot": False, "first_name": "Plan", "username": "plan", "language_code": "en"},
+    })
+
+
+async def flush_unit_of_work(pool) -> None:
+    async with unit_of_work(pool):
+        await sql_update_user_state_bd(None, pool, message(CHAT_ID, "Kazan"), "city", "Kazan")
+        await add_statistic_bd(pool, message(CHAT_ID, "/current_weather"))
+
+
+CASES = {
+    "check_chat_id existing": lambda pool: check_chat_id(pool, message(CHAT_ID, "/start")),
+    "check_chat_id new": lambda pool: check_chat_id(pool, message(CHATS + 1, "/start")),
+    "users_actions of a chat": lambda pool: execute_users_actions(pool, CHAT_ID),
+    "users_actions of a chat in a range": lambda pool: execute_users_actions(pool, CHAT_ID, BASE_TS,
+                                                                             BASE_TS + ROWS // 2),
+    "users_actions latest": lambda pool: execute_users_actions(pool),
+    "users_actions last hour": lambda pool: execute_users_actions(pool, None, BASE_TS + ROWS - 3600),
+    "actions_count": lambda pool: execute_actions_count(pool, CHAT_ID),
+    "update user_state": lambda pool: sql_update_user_state_bd(None, pool, message(CHAT_ID, "Kazan"), "city", "Kazan"),
+    "add statistic": lambda pool: add_statistic_bd(pool, message(CHAT_ID, "/current_weather")),
+    "unit of work flush": flush_unit_of_work,
+    "add favorite": lambda pool: add_favorite(pool, CHAT_ID, "London", 5),
+    "remove favorite": lambda pool: remove_favorite(pool, CHAT_ID, "London"),
+}
+
+
+class ExplainPool:
+    """
+    Stands in for the pool: every statement the app sends is run as EXPLAIN (ANALYZE, BUFFERS) on one
+    connection, whose transaction the test rolls back, and its plan is kept. Queries return empty results.
+    """
+
+    def __init__(self, connection: asyncpg.Connection):
+        self.connection = connection
+        self.plans = []
+
+    @asynccontextmanager
+    async def acquire(self):
+        yield self
+
+    def transaction(self):
+        return self.connection.transaction()
+
+    async def _explain(self, query: str, *args) -> None:
+        plan = await self.connection.fetchval(f"EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) {query}", *args)
+        self.plans.append((query, json.loads(plan)[0]))
+
+    async def fetch(self, query, *args):
+        await self._explain(query, *args)
+        return []
+
+    async def fetchrow(self, query, *args):
+        await self._explain(query, *args)
+        return {}
+
+    async def fetchval(self, query, *args):
+        await self._explain(query, *args)
+
+    async def execute(self, query, *args):
+        await self._explain(query, *args)
+        return "EXPLAIN"
+
+
+def plan_nodes(node: dict):
+    yield node
+    for child in node.get("Plans", []):
+        yield from plan_nodes(child)
+
+
+def start_cluster(directory: str) -> str:
+    """initdb and start a cluster listening on a unix socket in directory only; returns its DSN."""
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+    data = os.path.join(directory, "data")
+    subprocess.run(["initdb", "-D", data, "-U", "postgres", "--auth=trust"], check=True, capture_output=True)
+    subprocess.run(["pg_ctl", "-D", data, "-w", "-l", os.path.join(directory, "log"),
+                    "-o", f"-p {port} -k {directory} -c listen_addresses=''", "start"],
+                   check=True, capture_output=True)
+    return f"postgresql://postgres@/postgres?host={directory}&port={port}"
+
+
+async def load_dataset(dsn: str) -> asyncpg.Pool:
+    connection = await asyncpg.connect(dsn)
+    try:
+        await connection.execute(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE; CREATE SCHEMA {SCHEMA}")
+    finally:
+        await connection.close()
+    pool = await asyncpg.create_pool(dsn, min_size=1, max_size=2,
+                                     server_settings={"search_path": SCHEMA, "jit": "off"})
+    await create_table(pool)
+    commands = ", ".join(f"'{command}'" for command in VALID_COMMANDS)
+    async with pool.acquire() as connection:
+        await connection.execute(f"""
+            INSERT INTO user_state (chat_id, city, date_difference, qty_days)
+            SELECT c, (ARRAY['Moskva', 'Kazan', 'London', 'Paris'])[1 + c % 4], 'None', 'None'
+            FROM generate_series(1, {CHATS}) c
+        """)
+        await connection.execute(f"""
+            INSERT INTO statistic (ts, user_name, chat_id, action)
+            SELECT {BASE_TS} + i, 'user', 1 + (random() * ({CHATS} - 1))::integer,
+                   (ARRAY[{commands}])[1 + i % {len(VALID_COMMANDS)}]
+            FROM generate_series(1, {ROWS}) i
+        """)
+        await connection.execute(f"""
+            INSERT INTO statistic_daily (day, chat_id, action, user_name, count)
+            SELECT DATE '2023-01-01' + d, c, '/start', 'user', 1
+            FROM generate_series(1, {CHATS}) c, generate_series(1, 3) d
+        """)
+        await connection.execute("VACUUM ANALYZE")
+    return pool
+
+
+@pytest.fixture(scope="module")
+def database():
+    dsn = os.environ.get("PLAN_TEST_DSN")
+    directory = None
+    if not dsn:
+        if not os.environ.get("PLAN_TEST_START_POSTGRES"):
+            pytest.skip("set PLAN_TEST_DSN or PLAN_TEST_START_POSTGRES=1 to run the query-plan tests")
+        if not (shutil.which("initdb") and shutil.which("pg_ctl")):
+            pytest.skip("initdb and pg_ctl are not on PATH")
+        directory = tempfile.mkdtemp(prefix="plan_test_")
+        try:
+            dsn = start_cluster(directory)
+        except subprocess.CalledProcessError as e:
+            shutil.rmtree(directory, ignore_errors=True)
+            pytest.skip(f"could not start Postgres: {e.stderr.decode(errors='replace').strip()}")
+    loop = asyncio.new_event_loop()
+    try:
+        pool = loop.run_until_complete(load_dataset(dsn))
+        yield loop, pool
+        loop.run_until_complete(pool.execute(f"DROP SCHEMA {SCHEMA} CASCADE"))
+        loop.run_until_complete(pool.close())
+    finally:
+        loop.close()
+        if directory:
+            subprocess.run(["pg_ctl", "-D", os.path.join(directory, "data"), "-m", "immediate", "stop"],
+                           capture_output=True)
+            shutil.rmtree(directory, ignore_errors=True)
+
+
+@pytest.mark.parametrize("case", CASES)
+def test_query_plan(database, case):
+    loop, pool = database
+
+    async def explain() -> list:
+        async with pool.acquire() as connection:
+            transaction = connection.transaction()
+            await transaction.start()
+            try:
+                explain_pool = ExplainPool(connection)
+                await CASES[case](explain_pool)
+                return explain_pool.plans
+            finally:
+                await transaction.rollback()
+
+    plans = loop.run_until_complete(explain())
+    assert plans, f"{case}: no statement was run, or it failed"
+    for query, result in plans:
+        plan = result["Plan"]
+        scans = {node["Relation Name"] for node in plan_nodes(plan)
+                 if node["Node Type"] == "Seq Scan" and node.get("Relation Name") in LARGE_TABLES}
+        assert not scans, f"{case}: sequential scan of {', '.join(sorted(scans))}\n{query}"
+        buffers = plan["Shared Hit Blocks"] + plan["Shared Read Blocks"]
+        assert buffers <= BUFFER_BUDGET, f"{case}: {buffers} buffers > {BUFFER_BUDGET}\n{query}"
+        assert result["Execution Time"] <= TIME_BUDGET, \
+            f"{case}: {result['Execution Time']:.1f} ms > {TIME_BUDGET} ms\n{query}"
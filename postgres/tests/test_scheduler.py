@@ -0,0 +1,33 @@
+from datetime import date, datetime, timezone
+
+import pytest
+
+from bot import scheduler
+from bot.scheduler import due_minutes
+
+
+@pytest.fixture(autouse=True)
+def fresh_scheduler(monkeypatch):
+    monkeypatch.setattr(scheduler, "_last_minute", None)
+    monkeypatch.setattr(scheduler, "_retry", set())
+
+
+def at(hour: int, minute: int, second: int = 0, day: int = 2) -> datetime:
+    return datetime(2024, 6, day, hour, minute, second, tzinfo=timezone.utc)
+
+
+def test_second_tick_in_the_same_minute_claims_it_again():
+    assert due_minutes(at(7, 30, 5), 30) == {date(2024, 6, 2): [450]}
+    assert due_minutes(at(7, 30, 35), 30) == {date(2024, 6, 2): [450]}
+
+
+def test_missed_minutes_are_caught_up_and_stay_on_their_day():
+    due_minutes(at(23, 58), 30)
+    assert due_minutes(at(0, 1, day=3), 30) == {date(2024, 6, 3): [1, 0], date(2024, 6, 2): [1439]}
+
+
+def test_released_minutes_are_retried_within_the_catchup_window():
+    due_minutes(at(7, 29), 30)
+    scheduler._retry.update({(date(2024, 6, 2), 440), (date(2024, 6, 2), 400)})
+    assert due_minutes(at(7, 30), 30) == {date(2024, 6, 2): [450, 440]}
+    assert due_minutes(at(7, 31), 30) == {date(2024, 6, 2): [451]}
@@ -1,4 +1,6 @@
-from postgres.sqlfactory import SQLQueryBuilder
+import pytest
+
+from postgres.sqlfactory import MAX_PARAMETERS, SQLQueryBuilder
 
 
 def test_select():
@@ -91,3 +93,59 @@ def test_insert():
     builder.insert(fields, on_conflict="chat_id", update_fields=["city"])
     assert builder.sql == 'INSERT INTO users (chat_id, city, last_name) VALUES ($1, $2, $3) ON CONFLICT (chat_id) DO UPDATE SET city = EXCLUDED.city'
     assert builder.args == ['1809', 'Kazan', 'Yakupov']
+
+
+def test_where_several_conditions_per_column():
+    builder = SQLQueryBuilder("statistic")
+    builder.select().where({"chat_id": ("=", 1809), "ts": [(">", 100), ("<", 200)]})
+    assert builder.sql == "SELECT * FROM statistic WHERE chat_id = $1 AND ts > $2 AND ts < $3"
+    assert builder.args == [1809, 100, 200]
+
+
+def test_where_chained():
+    builder = SQLQueryBuilder("statistic")
+    builder.select().where({"chat_id": ("=", 1809)}).where({}).where({"ts": (">", 100)}).limit(5)
+    assert builder.sql == "SELECT * FROM statistic WHERE chat_id = $1 AND ts > $2 LIMIT $3"
+    assert builder.args == [1809, 100, 5]
+
+
+def test_where_any():
+    builder = SQLQueryBuilder("subscriptions")
+    builder.update({"last_sent": None}).where({"chat_id": ("= ANY", [1, 2, 3], "bigint[]"), "city": ("<>", "Kazan")})
+    assert builder.sql == "UPDATE subscriptions SET last_sent = $1 WHERE chat_id = ANY($2::bigint[]) AND city <> $3"
+    assert builder.args == [None, [1, 2, 3], "Kazan"]
+
+
+def test_insert_many():
+    builder = SQLQueryBuilder("api_usage")
+    builder.insert_many(["endpoint", "calls"], [("forecast", 3), ("history", 1)],
+                        on_conflict="endpoint", update_fields={"calls": "api_usage.calls + EXCLUDED.calls"})
+    assert builder.sql == ("INSERT INTO api_usage (endpoint, calls) VALUES ($1, $2), ($3, $4) "
+                           "ON CONFLICT (endpoint) DO UPDATE SET calls = api_usage.calls + EXCLUDED.calls")
+    assert builder.args == ["forecast", 3, "history", 1]
+
+    with pytest.raises(ValueError):
+        SQLQueryBuilder("api_usage").insert_many(["endpoint", "calls"], [("forecast",)])
+    with pytest.raises(ValueError):
+        SQLQueryBuilder("api_usage").insert_many(["endpoint", "calls"], [])
+    with pytest.raises(ValueError):
+        SQLQueryBuilder("api_usage").insert_many(["endpoint", "calls"], [("forecast", 1)] * (MAX_PARAMETERS // 2 + 1))
+
+
+def test_insert_unnest():
+    builder = SQLQueryBuilder("users_online")
+    builder.insert_unnest({"chat_id": "integer", "timestamp": "integer"}, [(1, 100), (2, 200), (3, 300)],
+                          on_conflict="chat_id", update_fields=["timestamp"])
+    assert builder.sql == ("INSERT INTO users_online (chat_id, timestamp) "
+                           "SELECT * FROM unnest($1::integer[], $2::integer[]) "
+                           "ON CONFLICT (chat_id) DO UPDATE SET timestamp = EXCLUDED.timestamp")
+    assert builder.args == [[1, 2, 3], [100, 200, 300]]
+
+
+def test_upsert_returning():
+    builder = SQLQueryBuilder("user_state")
+    builder.insert({"chat_id": 1809, "city": "Kazan"}, on_conflict="chat_id", update_fields=["city"])
+    builder.returning(["chat_id", "city"])
+    assert builder.sql == ("INSERT INTO user_state (chat_id, city) VALUES ($1, $2) "
+                           "ON CONFLICT (chat_id) DO UPDATE SET city = EXCLUDED.city RETURNING chat_id, city")
+    assert builder.args == [1809, "Kazan"]
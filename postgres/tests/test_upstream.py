@@ -0,0 +1,79 @@
+import asyncio
+from types import SimpleNamespace
+
+import aiohttp
+import pytest
+
+from helpers import upstream
+from helpers.upstream import CLOSED, OPEN, CircuitBreaker, UpstreamUnavailableError, fetch_json
+
+SETTINGS = SimpleNamespace(UPSTREAM_TIMEOUT=1.0, UPSTREAM_DEADLINE=2.0, UPSTREAM_RETRIES=0,
+                           UPSTREAM_BACKOFF_BASE=0.0, UPSTREAM_BACKOFF_MAX=0.0,
+                           BREAKER_FAILURE_THRESHOLD=5, BREAKER_RESET_TIMEOUT=30.0)
+
+
+class FailingSession:
+    """Every request raises error once the response is entered."""
+
+    def __init__(self, error: BaseException):
+        self.error = error
+
+    def request(self, *args, **kwargs):
+        session = self
+
+        class Response:
+            async def __aenter__(self):
+                raise session.error
+
+            async def __aexit__(self, *exc):
+                return False
+
+        return Response()
+
+
+@pytest.fixture
+def breaker(monkeypatch):
+    """Sets the breaker state and the error every request raises."""
+    monkeypatch.setattr(upstream, "get_settings", lambda: SETTINGS)
+
+    def use(state: int, failures: int, error: BaseException) -> None:
+        monkeypatch.setattr(CircuitBreaker, "_state", state)
+        monkeypatch.setattr(CircuitBreaker, "_failures", failures)
+        monkeypatch.setattr(CircuitBreaker, "_opened_at", -SETTINGS.BREAKER_RESET_TIMEOUT)  # reset timeout passed
+        monkeypatch.setattr(upstream.HttpSession, "get_session", classmethod(lambda cls: FailingSession(error)))
+    yield use
+    CircuitBreaker._set_state(CLOSED)
+
+
+def call() -> None:
+    asyncio.run(fetch_json("http://api.weatherapi.com/v1/current.json?q=Kazan"))
+
+
+@pytest.mark.parametrize("error, raised", [
+    (aiohttp.ClientPayloadError("Response payload is not completed"), UpstreamUnavailableError),
+    (RuntimeError("unexpected"), RuntimeError),
+])
+def test_failed_half_open_probe_reopens_breaker(breaker, error, raised):
+    breaker(OPEN, SETTINGS.BREAKER_FAILURE_THRESHOLD, error)
+    with pytest.raises(raised):
+        call()
+    assert CircuitBreaker._state == OPEN
+    assert CircuitBreaker._opened_at > 0
+
+
+def test_cancelled_half_open_probe_is_released(breaker):
+    breaker(OPEN, SETTINGS.BREAKER_FAILURE_THRESHOLD, asyncio.CancelledError())
+    with pytest.raises(asyncio.CancelledError):
+        call()
+    assert CircuitBreaker._state == OPEN
+    assert CircuitBreaker._failures == SETTINGS.BREAKER_FAILURE_THRESHOLD
+    assert CircuitBreaker.allow()  # the next call probes right away
+
+
+def test_cancelled_call_does_not_count_against_closed_breaker(breaker):
+    breaker(CLOSED, 0, asyncio.CancelledError())
+    for _ in range(SETTINGS.BREAKER_FAILURE_THRESHOLD):
+        with pytest.raises(asyncio.CancelledError):
+            call()
+    assert CircuitBreaker._state == CLOSED
+    assert CircuitBreaker._failures == 0
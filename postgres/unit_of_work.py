@@ -0,0 +1,63 @@
+from contextvars import ContextVar, Token
+from typing import Any, Dict, List, Optional, Tuple
+
+
+class UnitOfWork:
+    """
+    The user_state changes and statistic events of one webhook update.
+
+    Handlers record their writes here instead of running them, and `build` turns everything into a single
+    statement that is sent at the end of the update: one connection, one round trip, one implicit transaction.
+    Repeated updates of the same field keep only the last value.
+    """
+    _current: ContextVar[Optional["UnitOfWork"]] = ContextVar("unit_of_work", default=None)
+
+    def __init__(self):
+        self.state: Dict[int, Dict[str, str]] = {}
+        self.statistic: List[Tuple[int, str, int, str]] = []
+        self.closed = False
+
+    @classmethod
+    def active(cls) -> Optional["UnitOfWork"]:
+        """The unit of work of the update being handled, or None outside a webhook update."""
+        unit = cls._current.get()
+        return unit if unit is not None and not unit.closed else None
+
+    def open(self) -> Token:
+        """Makes this the active unit of work of the current task (and of tasks it starts)."""
+        return self._current.set(self)
+
+    def close(self, token: Token) -> None:
+        """Stops collecting; later writes, e.g. from background tasks started by the update, run directly."""
+        self.closed = True
+        self._current.reset(token)
+
+    def set_state(self, chat_id: int, field: str, value: str) -> None:
+        self.state.setdefault(chat_id, {})[field] = value
+
+    def add_statistic(self, ts: int, user_name: str, chat_id: int, action: str) -> None:
+        self.statistic.append((ts, user_name, chat_id, action))
+
+    def build(self) -> Tuple[str, List[Any]]:
+        """
+        One statement for all pending writes: a data-modifying CTE per chat whose state changed,
+        followed by a multi-row insert of the statistic events. Empty sql if there is nothing to write.
+        """
+        args: List[Any] = []
+        ctes = []
+        for chat_id, fields in self.state.items():
+            args.extend(fields.values())
+            set_clause = ", ".join(f"{field} = ${len(args) - len(fields) + i + 1}" for i, field in enumerate(fields))
+            args.append(chat_id)
+            ctes.append(f"s{len(ctes)} AS (UPDATE user_state SET {set_clause} WHERE chat_id = ${len(args)})")
+        if self.statistic:
+            args.extend(list(column) for column in zip(*self.statistic))
+            n = len(args)
+            main = (f"INSERT INTO statistic (ts, user_name, chat_id, action) "
+                    f"SELECT * FROM unnest(${n - 3}::integer[], ${n - 2}::varchar[], ${n - 1}::integer[], ${n}::varchar[])")
+        elif ctes:
+            main = "SELECT 1"
+        else:
+            return "", []
+        sql = f"WITH {', '.join(ctes)} {main}" if ctes else main
+        return sql, args
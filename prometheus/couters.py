@@ -1,4 +1,6 @@
-from prometheus_client import Counter
+from prometheus_client import Counter, Gauge, Histogram, multiprocess
+import os
+import shutil
 import socket
 
 
@@ -9,6 +11,23 @@ def get_instance_id():
 instance_id = get_instance_id()
 
 
+def prepare_multiprocess_dir(path: str) -> None:
+    """
+    Prepares an empty directory for prometheus_client multiprocess mode and exports it to the workers.
+    Must be called in the parent process before the uvicorn workers are spawned,
+    because prometheus_client picks the storage backend when it is first imported.
+    """
+    shutil.rmtree(path, ignore_errors=True)
+    os.makedirs(path)
+    os.environ["PROMETHEUS_MULTIPROC_DIR"] = path
+
+
+def mark_worker_dead() -> None:
+    """Drops the live gauges of the current worker when it shuts down in multiprocess mode."""
+    if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+        multiprocess.mark_process_dead(os.getpid())
+
+
 async def inc_counters() -> None:
     unknown_command_counter.labels(instance=instance_id).inc(0)
     count_instance_errors.labels(instance=instance_id).inc(0)
@@ -18,6 +37,29 @@ async def inc_counters() -> None:
     database_errors_counters[2].labels(instance=instance_id).inc(0)
     database_errors_counters[3].labels(instance=instance_id).inc(0)
     validation_error.labels(instance=instance_id).inc(0)
+    unsupported_update_counter.labels(instance=instance_id).inc(0)
+    rate_limited_updates.labels(instance=instance_id).inc(0)
+    weather_cache_evicted_rows.labels(instance=instance_id).inc(0)
+    statistic_rows_archived.labels(instance=instance_id).inc(0)
+    statistic_retention_seconds.labels(instance=instance_id).inc(0)
+    event_loop_stalls.labels(instance=instance_id).inc(0)
+    for result in ["ok", "failed"]:
+        prewarm_upstream_calls.labels(instance=instance_id, result=result).inc(0)
+    for result in ["sent", "failed", "retried"]:
+        subscription_deliveries.labels(instance=instance_id, result=result).inc(0)
+    for source in ["memory", "database", "upstream"]:
+        location_lookups.labels(instance=instance_id, source=source).inc(0)
+    for result in ["hit", "miss"]:
+        render_cache_requests.labels(instance=instance_id, result=result).inc(0)
+        chart_cache_requests.labels(instance=instance_id, result=result).inc(0)
+        hourly_cache_requests.labels(instance=instance_id, result=result).inc(0)
+    for reason in ["timeout", "connection", "client", "5xx"]:
+        upstream_retries.labels(instance=instance_id, reason=reason).inc(0)
+    upstream_breaker_state.labels(instance=instance_id).set(0)
+    quota_level.labels(instance=instance_id).set(0)
+    for tier in ["l1", "l2"]:
+        for result in ["hit", "stale", "miss"]:
+            weather_cache_requests.labels(instance=instance_id, tier=tier, result=result).inc(0)
 
     for status_code in [401, 403]:
         external_api_error.labels(instance=instance_id, status_code=status_code).inc(0)
@@ -37,6 +79,80 @@ validation_error = Counter('external_api_validation_errors', 'Count of validatio
 unknown_command_counter = Counter('unknown_commands', 'Count of unknown commands received',
                                   ['instance'])
 
+unsupported_update_counter = Counter('unsupported_updates', 'Count of webhook updates skipped as unsupported',
+                                     ['instance'])
+
+rate_limited_updates = Counter('rate_limited_updates', 'Updates rejected by the per-chat rate limiter', ['instance'])
+
+rate_limiter_chats = Gauge('rate_limiter_chats', 'Chats tracked by the per-chat rate limiter', ['instance'],
+                           multiprocess_mode='livesum')
+
 count_instance_errors = Counter('instance_errors', 'Count of errors by instance', ['instance'])
 
 count_user_errors = Counter('user_errors', 'User interaction errors', ['instance'])
+
+weather_cache_requests = Counter('weather_cache_requests', 'Weather cache lookups by tier and result',
+                                 ['instance', 'tier', 'result'])
+
+weather_cache_evicted_rows = Counter('weather_cache_evicted_rows', 'Expired weather cache rows deleted from Postgres',
+                                     ['instance'])
+
+prewarm_upstream_calls = Counter('prewarm_upstream_calls', 'Upstream calls made by the cache pre-warmer',
+                                 ['instance', 'result'])
+
+subscription_deliveries = Counter('subscription_deliveries', 'Daily forecast deliveries to subscribed chats',
+                                  ['instance', 'result'])
+
+location_lookups = Counter('location_lookups', 'City name resolutions by the source that answered them',
+                           ['instance', 'source'])
+
+render_cache_requests = Counter('render_cache_requests', 'Rendered reply lookups by result', ['instance', 'result'])
+
+chart_cache_requests = Counter('chart_cache_requests', 'Chart lookups by result; a miss draws and uploads the chart',
+                               ['instance', 'result'])
+
+hourly_cache_requests = Counter('hourly_cache_requests', 'Hourly series lookups by result; a miss builds the columns',
+                                ['instance', 'result'])
+
+hourly_cache_bytes = Gauge('hourly_cache_bytes', 'Memory held by the cached hourly series', ['instance'],
+                           multiprocess_mode='livesum')
+
+hourly_cache_entries = Gauge('hourly_cache_entries', 'Hourly series cached, one per city and forecast length',
+                             ['instance'], multiprocess_mode='livesum')
+
+statistic_rows_archived = Counter('statistic_rows_archived', 'statistic rows moved into statistic_daily',
+                                  ['instance'])
+
+statistic_retention_seconds = Counter('statistic_retention_seconds', 'Time spent in statistic retention batches',
+                                      ['instance'])
+
+upstream_retries = Counter('upstream_retries', 'Retried weatherapi calls by the reason of the retry',
+                           ['instance', 'reason'])
+
+upstream_breaker_state = Gauge('upstream_breaker_state', 'weatherapi circuit breaker: 0 closed, 1 half-open, 2 open',
+                               ['instance'], multiprocess_mode='livemax')
+
+upstream_calls = Counter('weatherapi_calls', 'Calls made to weatherapi by endpoint, retries included',
+                         ['instance', 'endpoint'])
+
+quota_remaining = Gauge('weatherapi_quota_remaining', 'weatherapi calls left in the monthly quota', ['instance'],
+                        multiprocess_mode='livemin')
+
+quota_level = Gauge('weatherapi_quota_level',
+                    'Quota degradation level: 0 normal, 1 long TTLs, 2 cache-only statistics, 3 cached cities only',
+                    ['instance'], multiprocess_mode='livemax')
+
+active_users = Gauge('active_users', 'Chats that sent an update within ACTIVE_USERS_WINDOW, across all replicas',
+                     ['instance'], multiprocess_mode='livemax')
+
+event_loop_lag = Histogram('event_loop_lag_seconds', 'How late the event loop ran a timer due now',
+                           ['instance'], buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10))
+
+event_loop_tasks = Gauge('event_loop_tasks', 'asyncio tasks alive on the event loop', ['instance'],
+                         multiprocess_mode='livesum')
+
+event_loop_stalls = Counter('event_loop_stalls', 'Times the event loop was blocked longer than LOOP_STALL_THRESHOLD',
+                            ['instance'])
+
+startup_duration = Gauge('startup_duration_seconds', 'Time the lifespan startup took', ['instance'],
+                         multiprocess_mode='max')
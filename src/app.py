@@ -1,14 +1,20 @@
-import traceback
+import importlib.util
 import logging
 import sys
-import uvicorn
+from typing import Tuple
 from config.config import get_settings
-from helpers.helpers import logging_config, check_bot_token, check_api_key
-from helpers.set_webhook import set_webhook
-from postgres.database_adapters import create_table
-from prometheus.couters import inc_counters
+from helpers.logging_pipeline import LogPipeline
+from prometheus.couters import prepare_multiprocess_dir, mark_worker_dead
 from postgres.pool import DbPool
+from helpers.http_client import HttpSession
+from helpers.background import stop_background_tasks
+from helpers.loop_monitor import LoopMonitor
+from helpers.activity import ActivityTracker
+from helpers.analytics import Analytics
+from helpers.quota import QuotaBudget
+from handlers.admin_handler import admin_router
 from handlers.db_handlers import bd_router
+from handlers.health_handler import health_router
 from handlers.tg_handler import webhook_router
 from prometheus_fastapi_instrumentator import Instrumentator
 from fastapi import FastAPI
@@ -22,48 +28,99 @@ async def lifespan(app: FastAPI):
     """
     Lifespan context manager for FastAPI application.
 
-    This context manager creates a database connection pool when the application starts,
-    and closes the pool when the application ends.
+    This context manager creates a database connection pool and the upstream HTTP session when the
+    application starts, and closes them when the application ends. With several workers every
+    worker runs its own lifespan, so each gets its own pool and session.
+    The event loop monitor starts first and stops with the background tasks.
+    The startup checks, table creation and webhook setup run concurrently in run_startup,
+    which is imported here because it is only needed once.
 
-    If an unexpected error occurs while creating the pool, the application will exit with code 1.
+    If an unexpected error occurs during startup, the application will exit with code 1.
+    On shutdown the weatherapi call counts, users_online timestamps and analytics counters not yet flushed are saved
+    before the pool is closed.
     If an error occurs while closing the pool, the error will be logged.
     """
     try:
         settings = get_settings()
-        logging_config(settings.LOG_LEVEL)
+        LogPipeline.configure(settings.LOG_LEVEL, settings.LOG_FORMAT, settings.LOG_RATE_LIMIT,
+                              settings.LOG_RATE_WINDOW)
+        LoopMonitor.start()  # first, so stalls during startup are reported too
         await DbPool.create_pool()
         pool = await DbPool.get_pool()
-        check_bot_token(settings.TOKEN)
-        check_api_key(settings.API_KEY)
-        set_webhook(settings.TOKEN, settings.APP_DOMAIN, settings.SECRET_TOKEN_TG_WEBHOOK)
-        await create_table(pool)
-        await inc_counters()
-        log.info("Startup completed successfully")
-
+        await HttpSession.create_session()
         if not pool:
             log.error("Failed to create database connection pool")
             sys.exit(1)
+
+        from helpers.startup import run_startup
+        await run_startup(settings, pool)
         yield
     except Exception as e:
-        log.error(f"An unexpected error occurred: {e}")
+        log.error("An unexpected error occurred: %r", e)
         sys.exit(1)
     finally:
+        await stop_background_tasks()
+        LoopMonitor.stop()
+        try:
+            await QuotaBudget.flush()
+        except Exception as e:
+            log.error("An error occurred while saving the weatherapi call counts: %s", e)
+        try:
+            await ActivityTracker.flush()
+        except Exception as e:
+            log.error("An error occurred while saving the users_online timestamps: %s", e)
+        try:
+            await Analytics.flush()
+        except Exception as e:
+            log.error("An error occurred while saving the analytics counters: %s", e)
         try:
             await DbPool.close_pool()
         except Exception as e:
-            log.error(f"An error occurred while closing the database connection pool: {e}")
+            log.error("An error occurred while closing the database connection pool: %s", e)
+        try:
+            await HttpSession.close_session()
+        except Exception as e:
+            log.error("An error occurred while closing the HTTP client session: %s", e)
+        mark_worker_dead()
+        LogPipeline.stop()
+
+
+def server_implementations() -> Tuple[str, str]:
+    """
+    The uvicorn loop and http implementations: uvloop and httptools when installed,
+    uvicorn's own choice ("auto") otherwise, so an environment without them still starts.
+    """
+    loop = "uvloop" if importlib.util.find_spec("uvloop") else "auto"
+    http = "httptools" if importlib.util.find_spec("httptools") else "auto"
+    if (loop, http) != ("uvloop", "httptools"):
+        log.warning("uvloop or httptools is not installed, uvicorn uses loop=%s http=%s", loop, http)
+    return loop, http
 
 
 app = FastAPI(lifespan=lifespan)
 app.include_router(bd_router)
 app.include_router(webhook_router)
+app.include_router(health_router)
+app.include_router(admin_router)
 
 instrumental = Instrumentator().instrument(app).expose(app, include_in_schema=False, should_gzip=True)
 
 if __name__ == "__main__":
+    import uvicorn
+
     try:
-        uvicorn.run(app, host="0.0.0.0", port=get_settings().LISTEN_PORT, log_level=get_settings().LOG_LEVEL_UVICORN)
+        settings = get_settings()
+        loop, http = server_implementations()
+        if settings.WORKERS > 1:
+            # Workers are separate processes: metrics go through the multiprocess directory
+            # and the app is passed as an import string so every worker loads its own copy
+            prepare_multiprocess_dir(settings.PROMETHEUS_MULTIPROC_DIR)
+            uvicorn.run("src.app:app", host="0.0.0.0", port=settings.LISTEN_PORT, workers=settings.WORKERS,
+                        loop=loop, http=http, log_level=settings.LOG_LEVEL_UVICORN)
+        else:
+            uvicorn.run(app, host="0.0.0.0", port=settings.LISTEN_PORT, loop=loop, http=http,
+                        log_level=settings.LOG_LEVEL_UVICORN)
     except Exception as e:
-        log.error(f"error during start: {e}")
-        log.debug(traceback.format_exc())
+        log.error("error during start: %s", e)
+        log.debug("Exception traceback", exc_info=True)
         sys.exit(1)